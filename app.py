@@ -1,13 +1,16 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from db_engine import SessionLocal
+from db_engine import SessionLocal, leak_detector
+import config
 
 from routes.ai import router as ai_router
 from routes.system import router as system_router
 from pkgs.system import queries as system_queries
 from pkgs.system import actions as system_actions
 from pkgs.ai import pipeline
+from pkgs.ai.jobs import pipeline_jobs
+from pkgs.system.chat_writer import chat_writer
 import os
 from dotenv import load_dotenv
 
@@ -36,6 +39,31 @@ app.add_middleware(
 app.include_router(ai_router)
 app.include_router(system_router)
 
+
+@app.on_event("startup")
+def resume_pipeline_jobs():
+    resumed = pipeline_jobs.resume()
+    if resumed:
+        print(f"Resumed {resumed} pipeline job(s)")
+
+
+@app.on_event("startup")
+def start_leak_detector():
+    if leak_detector is not None:
+        leak_detector.start(config.DB_CONNECTION_LEAK_CHECK_SECONDS)
+
+
+@app.on_event("shutdown")
+def stop_pipeline_jobs():
+    pipeline_jobs.shutdown()
+    if leak_detector is not None:
+        leak_detector.stop()
+
+
+@app.on_event("shutdown")
+async def flush_chat_writes():
+    await chat_writer.close()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=3002)
@@ -0,0 +1,144 @@
+"""
+Load generator for the /chat SSE endpoint of a running app.
+
+Opens `level` concurrent /chat streams at each concurrency level and measures every stream:
+time to first byte (first content event), total latency and the number of content events.
+Reports TTFB and latency p50/p99, per-stream and aggregate tokens/sec and the error count.
+
+Pair it with benchmarks/mock_openai_server.py so no OpenAI quota is spent:
+
+    python benchmarks/mock_openai_server.py --port 8001 --ttft 0.4 --token-delay 0.03
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 uvicorn app:app --port 8000 --workers 2
+    python benchmarks/chat_load_test.py --url http://127.0.0.1:8000 --levels 50 100 200 --seed-users 200
+
+Each stream posts as its own user, so streams do not contend for the same chat context.
+--seed-users creates that many users in the app's database (DATABASE_URL or DB_*) first;
+otherwise the user ids --first-user-id onwards must already exist.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def seed_users(count: int) -> int:
+    """Create count users in the app's database and return the first id"""
+    from db_engine import SessionLocal
+    from db_models import User
+
+    with SessionLocal() as session:
+        users = [User(name=f"Load Test User {i}", is_manager=False) for i in range(count)]
+        session.add_all(users)
+        session.commit()
+        return min(user.id for user in users)
+
+
+async def one_stream(client: httpx.AsyncClient, url: str, user_id: int, message: str) -> dict:
+    result = {"ttfb": None, "latency": None, "tokens": 0, "error": None}
+    start = time.perf_counter()
+    try:
+        async with client.stream("POST", f"{url}/chat", json={"user_id": user_id, "message": message}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                result["error"] = f"HTTP {response.status_code}"
+                return result
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                payload = json.loads(line[len("data: "):])
+                if "error" in payload or payload.get("content", "").startswith("Error:"):
+                    result["error"] = payload.get("error") or payload["content"]
+                    continue
+                if not payload.get("content"):
+                    continue
+                if result["ttfb"] is None:
+                    result["ttfb"] = time.perf_counter() - start
+                result["tokens"] += 1
+    except httpx.HTTPError as e:
+        result["error"] = f"{type(e).__name__}: {str(e)}"
+    finally:
+        result["latency"] = time.perf_counter() - start
+    return result
+
+
+async def run_level(url: str, concurrency: int, first_user_id: int, timeout: float) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(
+            one_stream(client, url, first_user_id + i, f"Load test message {i}: how was your week at work?")
+            for i in range(concurrency)
+        ))
+        wall = time.perf_counter() - start
+
+    ok = [r for r in results if r["error"] is None]
+    ttfbs = [r["ttfb"] for r in ok if r["ttfb"] is not None]
+    latencies = [r["latency"] for r in ok]
+    per_stream_rates = [r["tokens"] / r["latency"] for r in ok if r["latency"]]
+    errors = {}
+    for r in results:
+        if r["error"] is not None:
+            errors[r["error"][:80]] = errors.get(r["error"][:80], 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_s": round(wall, 3),
+        "ttfb_p50_s": round(percentile(ttfbs, 0.50), 3),
+        "ttfb_p99_s": round(percentile(ttfbs, 0.99), 3),
+        "latency_p50_s": round(percentile(latencies, 0.50), 3),
+        "latency_p99_s": round(percentile(latencies, 0.99), 3),
+        "stream_tokens_per_s": round(statistics.median(per_stream_rates), 1) if per_stream_rates else 0.0,
+        "total_tokens_per_s": round(sum(r["tokens"] for r in ok) / wall, 1),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="base URL of the app")
+    parser.add_argument("--levels", type=int, nargs="+", default=[10, 50, 100, 200])
+    parser.add_argument("--first-user-id", type=int, default=2, help="user id of the first stream")
+    parser.add_argument("--seed-users", type=int, default=0, help="create this many users before the run")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-stream timeout, seconds")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    first_user_id = seed_users(args.seed_users) if args.seed_users else args.first_user_id
+    if args.seed_users and args.seed_users < max(args.levels):
+        print(f"Only {args.seed_users} users seeded, levels above that will post to unknown user ids")
+
+    print(f"{'streams':>8} {'ok':>5} {'failed':>6} {'wall s':>7} {'ttfb p50':>9} {'ttfb p99':>9} "
+          f"{'lat p50':>8} {'lat p99':>8} {'tok/s/stream':>13} {'tok/s total':>12}")
+    results = []
+    for level in args.levels:
+        r = asyncio.run(run_level(args.url, level, first_user_id, args.timeout))
+        results.append(r)
+        print(f"{r['concurrency']:>8} {r['ok']:>5} {r['failed']:>6} {r['wall_s']:>7.2f} {r['ttfb_p50_s']:>9.3f} "
+              f"{r['ttfb_p99_s']:>9.3f} {r['latency_p50_s']:>8.2f} {r['latency_p99_s']:>8.2f} "
+              f"{r['stream_tokens_per_s']:>13.1f} {r['total_tokens_per_s']:>12.1f}")
+        for error, count in r["errors"].items():
+            print(f"{'':>8} {count} x {error}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""
+Measure how many concurrent /chat SSE streams a single worker can sustain.
+
+Runs the same fake GPT-4 token stream through two consumers on one event loop:
+
+  * sync   - the old pattern: a blocking generator iterated with a plain `for`
+             inside an async generator (every token read blocks the loop)
+  * async  - Chatbot.chat_stream driven by an async client with `async for`
+
+While the streams run, a probe task stands in for a dashboard read and records
+how late it gets scheduled. A concurrency level is "sustained" when every stream
+finishes within the SLA and the probe's p99 lag stays under the lag budget.
+
+chat_stream reserves its tokens in the shared rate limiter (pkgs/ai/rate_limiter.py),
+which at the real gpt-4 limits would hold most streams back before they start and
+measure throttling instead of concurrency. OPENAI_RATE_LIMITS is raised far above
+any level below unless set in the environment; set it to the production limits to
+see how many streams those allow.
+
+Usage:
+    python benchmarks/chat_stream_concurrency.py --levels 1 10 50 100 200 --tokens 60 --token-delay 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("OPENAI_RATE_LIMITS", json.dumps({"gpt-4": [1_000_000, 1_000_000_000]}))
+for var in ("DB_USERNAME", "DB_PASSWORD", "DB_HOST"):
+    os.environ.setdefault(var, "benchmark")
+
+from pkgs.ai.chatbot import Chatbot  # noqa: E402
+from pkgs.ai.conversation_store import ConversationStore, ChatContext  # noqa: E402
+
+
+def _chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))], usage=None)
+
+
+def _usage_chunk(completion_tokens: int):
+    """The last chunk of a stream requested with include_usage"""
+    return SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=20, completion_tokens=completion_tokens))
+
+
+class FakeSyncCompletions:
+    def __init__(self, tokens: int, token_delay: float):
+        self.tokens = tokens
+        self.token_delay = token_delay
+
+    def create(self, **kwargs):
+        for i in range(self.tokens):
+            time.sleep(self.token_delay)
+            yield _chunk(f"tok{i} ")
+
+
+class FakeAsyncCompletions:
+    def __init__(self, tokens: int, token_delay: float):
+        self.tokens = tokens
+        self.token_delay = token_delay
+
+    async def create(self, **kwargs):
+        async def stream():
+            for i in range(self.tokens):
+                await asyncio.sleep(self.token_delay)
+                yield _chunk(f"tok{i} ")
+            yield _usage_chunk(self.tokens)
+        return stream()
+
+
+def sync_chat_stream(completions: FakeSyncCompletions, message: str):
+    """The pre-async Chatbot.chat_stream body, kept here as the baseline."""
+    for chunk in completions.create(messages=[{"role": "user", "content": message}], stream=True):
+        content = chunk.choices[0].delta.content
+        if content is not None:
+            yield json.dumps({"content": content}) + "\n"
+
+
+async def consume_sync(stream):
+    chunks = []
+    for chunk in stream:
+        chunks.append(json.loads(chunk)["content"])
+    return "".join(chunks)
+
+
+async def consume_async(stream):
+    chunks = []
+    async for chunk in stream:
+        chunks.append(json.loads(chunk)["content"])
+    return "".join(chunks)
+
+
+async def probe(stop: asyncio.Event, interval: float, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run_level(mode: str, concurrency: int, args) -> dict:
+    lags = []
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(stop, 0.01, lags))
+
+    if mode == "sync":
+        completions = FakeSyncCompletions(args.tokens, args.token_delay)
+        make_stream = lambda i: consume_sync(sync_chat_stream(completions, f"hello {i}"))
+    else:
+        chatbot = Chatbot()
+        # Start every user with an empty context instead of reading the chats table
+        chatbot.conversations = ConversationStore(
+            loader=lambda user_id: ChatContext(),
+            max_users=concurrency, max_bytes=64 * 1024 * 1024, ttl_seconds=3600
+        )
+        chatbot.client = SimpleNamespace(
+            chat=SimpleNamespace(completions=FakeAsyncCompletions(args.tokens, args.token_delay))
+        )
+
+        async def make_stream(i):
+            await consume_async(chatbot.chat_stream(i, f"hello {i}", await chatbot.load_context(i)))
+
+    durations = []
+
+    async def timed(i):
+        start = time.perf_counter()
+        await make_stream(i)
+        durations.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(concurrency)))
+    wall = time.perf_counter() - start
+    stop.set()
+    await probe_task
+
+    lags.sort()
+    p99_lag = lags[int(len(lags) * 0.99) - 1] if lags else 0.0
+    slowest = max(durations)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "wall_s": wall,
+        "slowest_stream_s": slowest,
+        "median_stream_s": statistics.median(durations),
+        "probe_p99_lag_ms": p99_lag * 1000,
+        "sustained": slowest <= args.sla and p99_lag * 1000 <= args.lag_budget_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 10, 25, 50, 100, 200])
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per streamed reply")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="seconds between tokens")
+    parser.add_argument("--sla", type=float, default=None,
+                        help="max seconds per stream (default: 2x the ideal stream time)")
+    parser.add_argument("--lag-budget-ms", type=float, default=100.0)
+    args = parser.parse_args()
+    if args.sla is None:
+        args.sla = 2 * args.tokens * args.token_delay
+
+    print(f"{'mode':<6} {'streams':>8} {'wall s':>8} {'slowest s':>10} {'median s':>9} {'p99 lag ms':>11}  sustained")
+    best = {}
+    for mode in ("sync", "async"):
+        for level in args.levels:
+            r = asyncio.run(run_level(mode, level, args))
+            print(f"{r['mode']:<6} {r['concurrency']:>8} {r['wall_s']:>8.2f} {r['slowest_stream_s']:>10.2f} "
+                  f"{r['median_stream_s']:>9.2f} {r['probe_p99_lag_ms']:>11.1f}  {r['sustained']}")
+            if r["sustained"]:
+                best[mode] = level
+            else:
+                break
+
+    print()
+    for mode in ("sync", "async"):
+        print(f"{mode}: max sustained concurrent streams = {best.get(mode, 0)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+Compare read-route throughput of one worker on the sync and the async database session.
+
+Seeds a local database (SQLite by default) with users, chats and plans, then drives
+/conversation/{user_id} and /employees/{user_id} in-process on one event loop in two modes:
+
+  * sync   - the old pattern: an async route running the same statements on a get_db session,
+             every query blocks the event loop for its round trip
+  * async  - the routes of routes/system.py on get_async_db and pkgs/system/async_queries.py
+
+--db-latency adds an artificial round trip to every statement to stand in for the remote
+database: time.sleep on the sync engine, asyncio.sleep on the async one. Point --database-url
+at Postgres to measure real round trips instead.
+
+In sync mode a request keeps its connection until the loop gets round to closing its session,
+so past pool_size + max_overflow concurrent requests the loop blocks inside the pool waiting
+for a connection only it can release. --pool-timeout is kept short so those stalls show up as
+errors instead of 30 second hangs.
+
+On SQLite with 5 ms added per statement and the default budget, 10 connections per engine
+counting overflow, sync stays near 115 req/s up to 10 concurrent requests and collapses to
+~13 req/s with pool timeouts at 15. Async serves ~310-325 req/s up to 30, its requests wait
+for one of the 10 connections without blocking the loop.
+
+Usage:
+    python benchmarks/db_routes_throughput.py --concurrency 1 10 20 30 --requests 300 --db-latency 0.005
+    python benchmarks/db_routes_throughput.py --database-url postgresql://user:pw@host:25060/db --db-latency 0
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 20, 30])
+    parser.add_argument("--requests", type=int, default=300, help="requests per mode and concurrency level")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--db-latency", type=float, default=0.005, help="added per statement, seconds")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file")
+    parser.add_argument("--pool-timeout", type=float, default=0.5, help="seconds, see above")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# The app reads its settings at import time
+database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'db_routes_throughput.db')}"
+os.environ["DATABASE_URL"] = database_url
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ["DB_POOL_TIMEOUT_SECONDS"] = str(args.pool_timeout)
+# Both modes read the database on every request instead of serving plans from the cache
+os.environ["PLAN_CACHE_ENABLED"] = "false"
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI, Response  # noqa: E402
+from sqlalchemy import event, select  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+from sqlalchemy.util import await_only  # noqa: E402
+
+import config  # noqa: E402
+from db_engine import engine, async_engine, SessionLocal, get_db  # noqa: E402
+from db_models import Base, User, Chat, PlanOfAction  # noqa: E402
+from pydantic_models import CategoryGroup, ActionPlan, ChatMessage, ConversationPage  # noqa: E402
+from pkgs.system import actions as system_actions  # noqa: E402
+from pkgs.system import async_queries  # noqa: E402
+from pkgs.system.queries import employee_plan_json  # noqa: E402
+from routes import system as system_routes  # noqa: E402
+
+
+def seed() -> list[int]:
+    Base.metadata.create_all(bind=engine)
+    user_ids = []
+    with SessionLocal() as session:
+        for n in range(args.users):
+            user = User(name=f"Benchmark User {n} {time.time_ns()}", is_manager=False)
+            session.add(user)
+            session.flush()
+            for i in range(args.chats_per_user):
+                session.add(Chat(user_id=user.id, message=f"Message {i} of user {user.id}", is_ai=i % 2 == 1))
+            user_ids.append(user.id)
+        session.commit()
+        for user_id in user_ids:
+            system_actions.plan_of_actions(user_id, f"Benchmark User {user_id}", [CategoryGroup(
+                category="Communication",
+                action_items=[ActionPlan(
+                    action_title="Share weekly updates",
+                    action_status="pending",
+                    action_plan=["Draft the update", "Post it every Friday"],
+                    progress_notes=[]
+                )]
+            )], user_id, session)
+    return user_ids
+
+
+def sync_app() -> FastAPI:
+    """The routes as they were before async_queries.py: the same statements on a blocking get_db session"""
+    app = FastAPI()
+
+    @app.get("/conversation/{user_id}")
+    async def get_conversation(user_id: int, db: Session = Depends(get_db)):
+        chats = db.scalars(
+            async_queries.conversation_statement(user_id, None, False).limit(config.CONVERSATION_PAGE_SIZE + 1)
+        ).all()
+        page = ConversationPage(
+            messages=[ChatMessage.model_validate(chat) for chat in chats[:config.CONVERSATION_PAGE_SIZE]],
+            next_cursor=chats[config.CONVERSATION_PAGE_SIZE - 1].id if len(chats) > config.CONVERSATION_PAGE_SIZE else None
+        )
+        return Response(page.model_dump_json(), media_type="application/json")
+
+    @app.get("/employees/{user_id}")
+    async def get_employee_action_plan(user_id: int, db: Session = Depends(get_db)):
+        plan = db.scalars(
+            select(PlanOfAction)
+            .where(PlanOfAction.user_id == user_id, PlanOfAction.target_user_id == user_id)
+            .order_by(PlanOfAction.id.desc())
+            .limit(1)
+        ).first()
+        body = employee_plan_json(plan, plan.rendered) if plan is not None else b"null"
+        return Response(body, media_type="application/json")
+
+    return app
+
+
+def async_app() -> FastAPI:
+    app = FastAPI()
+    app.include_router(system_routes.router)
+    return app
+
+
+def add_latency():
+    if args.db_latency <= 0:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def sync_round_trip(*_):
+        time.sleep(args.db_latency)
+
+    # Events of the async engine run inside its greenlet, so they can await without blocking the loop
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def async_round_trip(*_):
+        await_only(asyncio.sleep(args.db_latency))
+
+
+async def drive(app: FastAPI, user_ids: list[int], concurrency: int) -> dict:
+    paths = [
+        f"/conversation/{user_ids[i % len(user_ids)]}" if i % 2 == 0 else f"/employees/{user_ids[i % len(user_ids)]}"
+        for i in range(args.requests)
+    ]
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def one(path: str):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(path)
+                latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    errors += 1
+
+        # Warm up the pools before measuring
+        await asyncio.gather(*(one(path) for path in paths[:concurrency]))
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(path) for path in paths))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests_per_second": len(paths) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+async def main():
+    user_ids = seed()
+    add_latency()
+    apps = {"sync": sync_app(), "async": async_app()}
+
+    print(f"database: {engine.url.render_as_string(hide_password=True)}, added latency {args.db_latency * 1000:.1f} ms")
+    print(f"{'mode':<6} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for concurrency in args.concurrency:
+        results = {}
+        for mode, app in apps.items():
+            results[mode] = await drive(app, user_ids, concurrency)
+            r = results[mode]
+            print(f"{mode:<6} {concurrency:>5} {r['requests_per_second']:>9.1f} {r['p50_ms']:>9.1f} "
+                  f"{r['p99_ms']:>9.1f} {r['errors']:>7}")
+        speedup = results["async"]["requests_per_second"] / results["sync"]["requests_per_second"]
+        print(f"{'':<6} {'':>5} async/sync throughput x{speedup:.2f}")
+
+    await async_engine.dispose()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
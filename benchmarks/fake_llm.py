@@ -0,0 +1,101 @@
+"""
+Deterministic stand-in for llama_index's OpenAI LLM.
+
+Answers every pipeline prompt with a canned response in the format the stage parses
+(FINDING:, ROUTING:, ITEM:/CATEGORY:, ACTION: lines or the coach's JSON), after a
+configurable latency. Responses carry an OpenAI-style usage block so token
+instrumentation sees realistic numbers.
+"""
+import ast
+import json
+import random
+import re
+import threading
+import time
+
+from llama_index.legacy.llms import CompletionResponse
+
+from pkgs.ai.employee_insights_categorizer import EmployeeInsightsCategorizer
+from pkgs.ai.manager_insights_categorizer import ManagerInsightsCategorizer
+
+FINDINGS = [
+    "Employee expressed interest in AWS certification training",
+    "Employee mentioned unclear task ownership on the team",
+    "Employee indicated a wish to lead the next client project",
+    "Employee shared that meetings often run over time",
+    "Employee requested a collaborative tool for task visibility",
+    "Employee mentioned difficulty balancing on-call and project work",
+]
+
+EMPLOYEE_CATEGORIES = list(EmployeeInsightsCategorizer(llm=None).categories)
+MANAGER_CATEGORIES = list(ManagerInsightsCategorizer(llm=None).categories)
+
+
+class FakeLLMSettings:
+    """Shared knobs of every FakeOpenAI instance"""
+    latency = 0.05
+    jitter = 0.0
+    calls = 0
+    _lock = threading.Lock()
+
+    @classmethod
+    def count_call(cls):
+        with cls._lock:
+            cls.calls += 1
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeOpenAI:
+    """Drop-in for llama_index.legacy.llms.openai.OpenAI in pkgs/ai/clients.py"""
+
+    def __init__(self, model: str = "gpt-3.5-turbo", api_key: str | None = None, temperature: float = 0.1,
+                 max_tokens: int | None = None, **kwargs):
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.additional_kwargs = {}
+
+    def complete(self, prompt: str, **kwargs) -> CompletionResponse:
+        FakeLLMSettings.count_call()
+        delay = FakeLLMSettings.latency + random.uniform(0, FakeLLMSettings.jitter)
+        if delay:
+            time.sleep(delay)
+
+        text = self._respond(prompt)
+        usage = {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(text)}
+        return CompletionResponse(text=text, raw={"usage": usage})
+
+    def _respond(self, prompt: str) -> str:
+        if "feedback analyst" in prompt:
+            count = 2 + len(prompt) % 4
+            start = len(prompt) % len(FINDINGS)
+            picked = [FINDINGS[(start + i) % len(FINDINGS)] for i in range(count)]
+            return "\n".join(f"FINDING: {finding}" for finding in picked)
+
+        if "routing specialist" in prompt:
+            section = prompt.split("Feedback items to categorize:", 1)[1].split("For each item", 1)[0]
+            items = ast.literal_eval(section.strip())
+            routes = ("BOTH", "EMPLOYEE_ONLY", "MANAGER_ONLY")
+            return "\n".join(f"ROUTING: {routes[i % 3]}: {item}" for i, item in enumerate(items))
+
+        if "categorize each feedback item" in prompt:
+            categories = EMPLOYEE_CATEGORIES if "career development analyst" in prompt else MANAGER_CATEGORIES
+            items = re.findall(r"^Item \d+: (.*)$", prompt, flags=re.MULTILINE)
+            return "\n".join(
+                f"ITEM: {item}\nCATEGORY: {categories[i % len(categories)]}" for i, item in enumerate(items)
+            )
+
+        if '"action_plans"' in prompt:
+            items = re.findall(r"^\s*Item \d+: (.*)$", prompt, flags=re.MULTILINE)
+            return json.dumps({"action_plans": [
+                {"action_title": f"Follow Up On Item {i + 1}", "actions": [f"Do step {j + 1}" for j in range(3)]}
+                for i in range(len(items))
+            ]})
+
+        if "Respond with only action steps" in prompt:
+            return "\n".join(f"ACTION: Do concrete step {i + 1}" for i in range(3))
+
+        return "'Improve Your Team Workflow'"
@@ -0,0 +1,158 @@
+"""
+Measure the connection setup a pipeline run saves by reusing LLM clients.
+
+Replays the LLM calls of one pipeline run (findings, routing, both categorizers and the
+coach's parallel calls) against an OpenAI-compatible endpoint in two modes:
+
+  * fresh  - the old pattern: every stage builds its own OpenAI client
+  * shared - every stage takes its client from pkgs/ai/clients.llm_clients
+
+and counts the TCP connections and TLS handshakes opened per run and the time spent on them.
+Against the local mock server only TCP setup is measured; point --base-url at an https
+endpoint to include TLS.
+
+Usage:
+    python benchmarks/mock_openai_server.py --port 8001 --ttft 0.05 --token-delay 0.001 &
+    python benchmarks/llm_client_reuse.py --base-url http://127.0.0.1:8001/v1 --runs 20
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=os.getenv("OPENAI_BASE_URL", "http://127.0.0.1:8001/v1"))
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--coach-calls", type=int, default=8, help="parallel coach calls per run")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+os.environ["OPENAI_BASE_URL"] = args.base_url
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ["LLM_CACHE_ENABLED"] = "false"
+os.environ["OPENAI_RATE_LIMITS"] = "{}"
+os.environ["OPENAI_DEFAULT_REQUESTS_PER_MINUTE"] = "1000000"
+os.environ["OPENAI_DEFAULT_TOKENS_PER_MINUTE"] = "1000000000"
+for var in ("DB_USERNAME", "DB_PASSWORD", "DB_HOST"):
+    os.environ.setdefault(var, "benchmark")
+
+import httpcore._backends.sync as httpcore_sync  # noqa: E402
+from llama_index.legacy.llms.openai import OpenAI  # noqa: E402
+
+from pkgs.ai.clients import llm_clients  # noqa: E402
+
+# (stage, model, calls made in parallel) of one pipeline run
+STAGES = [
+    ("findings", "gpt-4", 1),
+    ("routed_feedback", "gpt-4", 1),
+    ("employee_insights_categorizer", "gpt-4", 1),
+    ("manager_insights_categorizer", "gpt-3.5-turbo", 1),
+    ("action_plans", "gpt-3.5-turbo", args.coach_calls),
+]
+
+
+class ConnectionStats:
+    """Counts and times new TCP connections and TLS handshakes made by httpcore"""
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_seconds = 0.0
+        self.handshakes = 0
+        self.handshake_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.connects = self.handshakes = 0
+            self.connect_seconds = self.handshake_seconds = 0.0
+
+    def install(self):
+        connect_tcp = httpcore_sync.SyncBackend.connect_tcp
+        start_tls = httpcore_sync.SyncStream.start_tls
+        stats = self
+
+        def timed_connect_tcp(backend, *a, **kw):
+            started = time.perf_counter()
+            try:
+                return connect_tcp(backend, *a, **kw)
+            finally:
+                with stats._lock:
+                    stats.connects += 1
+                    stats.connect_seconds += time.perf_counter() - started
+
+        def timed_start_tls(stream, *a, **kw):
+            started = time.perf_counter()
+            try:
+                return start_tls(stream, *a, **kw)
+            finally:
+                with stats._lock:
+                    stats.handshakes += 1
+                    stats.handshake_seconds += time.perf_counter() - started
+
+        httpcore_sync.SyncBackend.connect_tcp = timed_connect_tcp
+        httpcore_sync.SyncStream.start_tls = timed_start_tls
+
+
+def fresh_client(model: str):
+    return OpenAI(model=model, api_key=os.environ["OPENAI_API_KEY"], api_base=args.base_url, max_retries=0)
+
+
+def shared_client(model: str):
+    return llm_clients.get(model, os.environ["OPENAI_API_KEY"])
+
+
+def run_once(get_client, executor: ThreadPoolExecutor) -> float:
+    started = time.perf_counter()
+    for stage, model, calls in STAGES:
+        llm = get_client(model)
+        prompts = [f"{stage} prompt {i}" for i in range(calls)]
+        list(executor.map(llm.complete, prompts))
+    return time.perf_counter() - started
+
+
+def measure(mode: str, get_client, stats: ConnectionStats) -> dict:
+    with ThreadPoolExecutor(max_workers=args.coach_calls) as executor:
+        # Warm up imports and, in shared mode, the pool a long-running worker would already have
+        run_once(get_client, executor)
+        stats.reset()
+        durations = [run_once(get_client, executor) for _ in range(args.runs)]
+    return {
+        "mode": mode,
+        "run_p50_s": statistics.median(durations),
+        "connects_per_run": stats.connects / args.runs,
+        "connect_ms_per_run": stats.connect_seconds / args.runs * 1000,
+        "handshakes_per_run": stats.handshakes / args.runs,
+        "handshake_ms_per_run": stats.handshake_seconds / args.runs * 1000,
+    }
+
+
+def main():
+    stats = ConnectionStats()
+    stats.install()
+    results = [measure("fresh", fresh_client, stats), measure("shared", shared_client, stats)]
+
+    print(f"{'mode':<7} {'run p50 ms':>10} {'conns/run':>10} {'connect ms':>11} {'tls/run':>8} {'tls ms':>8}")
+    for r in results:
+        print(f"{r['mode']:<7} {r['run_p50_s'] * 1000:>10.1f} {r['connects_per_run']:>10.1f} "
+              f"{r['connect_ms_per_run']:>11.2f} {r['handshakes_per_run']:>8.1f} {r['handshake_ms_per_run']:>8.2f}")
+
+    fresh, shared = results
+    saved = (fresh["connect_ms_per_run"] + fresh["handshake_ms_per_run"]
+             - shared["connect_ms_per_run"] - shared["handshake_ms_per_run"])
+    print(f"\nConnection setup saved per pipeline run: {saved:.2f} ms "
+          f"({fresh['connects_per_run'] - shared['connects_per_run']:.1f} fewer connections), "
+          f"run p50 {(fresh['run_p50_s'] - shared['run_p50_s']) * 1000:+.1f} ms")
+    print(f"Client registry: {llm_clients.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Local stand-in for the OpenAI chat completions API, for load-testing /chat.
+
+Serves POST /v1/chat/completions, streamed (SSE) and non-streamed, with tunable
+time to first token, delay between tokens, response length and error injection.
+The openai client reads OPENAI_BASE_URL, so pointing the app at it needs no code change:
+
+    python benchmarks/mock_openai_server.py --port 8001 --ttft 0.4 --token-delay 0.03 --tokens 80
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 uvicorn app:app --workers 2
+
+Error injection (--error-rate, a fraction of requests):
+  * http       - answer with --error-status (500 by default, 429 exercises client retries),
+                 with a Retry-After header when --retry-after is set
+  * disconnect - stream part of the response, then drop the connection
+  * stall      - stream part of the response, then stop sending tokens for --stall-seconds
+
+GET /stats returns the number of requests served, open streams and injected errors.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+ERROR_MODES = ("http", "disconnect", "stall")
+
+WORDS = (
+    "thanks for sharing that with me it sounds like the sprint planning has been "
+    "a challenge lately could you tell me more about how the team splits the work "
+    "and what would make the handoffs smoother for you"
+).split()
+
+
+class MockSettings:
+    ttft = 0.3
+    token_delay = 0.02
+    tokens = 60
+    jitter = 0.0
+    error_rate = 0.0
+    error_mode = "http"
+    error_status = 500
+    retry_after = None
+    stall_seconds = 30.0
+
+
+class Stats:
+    requests = 0
+    streams_open = 0
+    errors = 0
+
+
+app = FastAPI()
+
+
+def _delay(seconds: float) -> float:
+    return max(0.0, seconds + random.uniform(-MockSettings.jitter, MockSettings.jitter))
+
+
+def _usage(messages: list, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(m.get("content") or "")) // 4 + 4 for m in messages) + 3
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def _stream(completion_id: str, model: str, tokens: int, failure: str | None, usage: dict | None):
+    Stats.streams_open += 1
+    try:
+        await asyncio.sleep(_delay(MockSettings.ttft))
+        yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+        for i in range(tokens):
+            if failure and i == tokens // 2:
+                if failure == "disconnect":
+                    raise ConnectionResetError("Injected disconnect")
+                await asyncio.sleep(MockSettings.stall_seconds)
+            if i:
+                await asyncio.sleep(_delay(MockSettings.token_delay))
+            yield _chunk(completion_id, model, {"content": WORDS[i % len(WORDS)] + " "})
+        yield _chunk(completion_id, model, {}, finish_reason="stop")
+        if usage is not None:
+            # stream_options.include_usage: a last chunk without choices carrying the usage
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": model, "choices": [], "usage": usage}
+            yield f"data: {json.dumps(payload)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        Stats.streams_open -= 1
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    Stats.requests += 1
+    model = body.get("model", "gpt-4")
+    tokens = min(MockSettings.tokens, body.get("max_tokens") or MockSettings.tokens)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    failure = None
+    if random.random() < MockSettings.error_rate:
+        Stats.errors += 1
+        failure = MockSettings.error_mode
+        if failure == "http":
+            headers = {"retry-after": str(MockSettings.retry_after)} if MockSettings.retry_after is not None else None
+            return JSONResponse(
+                status_code=MockSettings.error_status,
+                content={"error": {"message": "Injected error", "type": "server_error", "code": None}},
+                headers=headers
+            )
+
+    if body.get("stream"):
+        usage = None
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = _usage(body.get("messages", []), tokens)
+        return StreamingResponse(_stream(completion_id, model, tokens, failure, usage), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay(MockSettings.ttft) + _delay(MockSettings.token_delay) * tokens)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": " ".join(WORDS[i % len(WORDS)] for i in range(tokens))},
+            "finish_reason": "stop",
+        }],
+        "usage": _usage(body.get("messages", []), tokens),
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return {"requests": Stats.requests, "streams_open": Stats.streams_open, "errors": Stats.errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--ttft", type=float, default=MockSettings.ttft, help="time to first token, seconds")
+    parser.add_argument("--token-delay", type=float, default=MockSettings.token_delay, help="seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=MockSettings.tokens, help="tokens per completion")
+    parser.add_argument("--jitter", type=float, default=MockSettings.jitter, help="random +/- seconds on each delay")
+    parser.add_argument("--error-rate", type=float, default=MockSettings.error_rate)
+    parser.add_argument("--error-mode", choices=ERROR_MODES, default=MockSettings.error_mode)
+    parser.add_argument("--error-status", type=int, default=MockSettings.error_status)
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After header of http errors")
+    parser.add_argument("--stall-seconds", type=float, default=MockSettings.stall_seconds)
+    args = parser.parse_args()
+
+    MockSettings.ttft = args.ttft
+    MockSettings.token_delay = args.token_delay
+    MockSettings.tokens = args.tokens
+    MockSettings.jitter = args.jitter
+    MockSettings.error_rate = args.error_rate
+    MockSettings.error_mode = args.error_mode
+    MockSettings.error_status = args.error_status
+    MockSettings.retry_after = args.retry_after
+    MockSettings.stall_seconds = args.stall_seconds
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Offline throughput benchmark of pkgs/ai/pipeline.run_pipeline.
+
+Seeds a local database (SQLite by default) with synthetic users and chats, swaps the
+llama_index OpenAI class of the shared client registry for benchmarks/fake_llm.FakeOpenAI and
+runs the pipeline for every user on a thread pool, the way the job queue does.
+
+Reports end-to-end runs/sec, per-stage wall time, time spent in database calls and peak
+Python memory. With --baseline it exits non-zero when runs/sec regressed by more than
+--max-regression compared to a previous --output file.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py --users 50 --chats-per-user 20 --latency 0.05 --concurrency 4
+    python benchmarks/pipeline_benchmark.py --output bench.json
+    python benchmarks/pipeline_benchmark.py --baseline bench.json
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM latency per call, seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random latency per call, seconds")
+    parser.add_argument("--concurrency", type=int, default=4, help="pipelines run at once")
+    parser.add_argument("--coach-mode", default=None, help="split, combined or batched")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file")
+    parser.add_argument("--llm-cache", action="store_true", help="keep the LLM cache enabled")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a report written with --output")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                        help="allowed drop in runs/sec against the baseline, as a fraction")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# The app reads its settings at import time
+database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'pipeline_benchmark.db')}"
+os.environ["DATABASE_URL"] = database_url
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ["LLM_CACHE_ENABLED"] = "true" if args.llm_cache else "false"
+os.environ["LLM_CACHE_PERSISTENT"] = "false"
+if args.coach_mode:
+    os.environ["COACH_GENERATION_MODE"] = args.coach_mode
+
+from faker import Faker  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from benchmarks.fake_llm import FakeOpenAI, FakeLLMSettings  # noqa: E402
+from db_engine import engine, SessionLocal  # noqa: E402
+from db_models import Base, User, Chat  # noqa: E402
+from pkgs.ai import pipeline, instrumentation, clients  # noqa: E402
+
+
+class DbTimer:
+    """Sums the time spent in database round trips, across threads"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.statements = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def before(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.started = time.perf_counter()
+
+    def after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - self._local.started
+        with self._lock:
+            self.seconds += elapsed
+            self.statements += 1
+
+
+def seed(users: int, chats_per_user: int, faker: Faker) -> list[tuple[int, str]]:
+    Base.metadata.create_all(bind=engine)
+    seeded = []
+    with SessionLocal() as session:
+        # Plans for the manager are stored against user 1, keep it out of the benchmarked users
+        if session.get(User, 1) is None:
+            session.add(User(id=1, name="Benchmark Manager", is_manager=True))
+            session.commit()
+        for _ in range(users):
+            user = User(name=f"{faker.name()} {faker.unique.random_int(10000, 99999)}", is_manager=False)
+            session.add(user)
+            session.flush()
+            for i in range(chats_per_user):
+                session.add(Chat(user_id=user.id, message=faker.paragraph(nb_sentences=3), is_ai=i % 2 == 1))
+            seeded.append((user.id, user.name))
+        session.commit()
+    return seeded
+
+
+def run_one(user_id: int, user_name: str) -> instrumentation.RunRecorder:
+    with instrumentation.record_run(f"bench-{user_id}", user_id) as recorder:
+        pipeline.run_pipeline(user_id, user_name, os.environ["OPENAI_API_KEY"], run_id=f"bench-{user_id}")
+    return recorder
+
+
+def main():
+    clients.OpenAI = FakeOpenAI
+    clients.llm_clients.clear()
+    FakeLLMSettings.latency = args.latency
+    FakeLLMSettings.jitter = args.jitter
+
+    faker = Faker()
+    Faker.seed(args.seed)
+    users = seed(args.users, args.chats_per_user, faker)
+
+    timer = DbTimer()
+    event.listen(engine, "before_cursor_execute", timer.before)
+    event.listen(engine, "after_cursor_execute", timer.after)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        recorders = list(executor.map(lambda user: run_one(*user), users))
+    elapsed = time.perf_counter() - started
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stage_seconds = {}
+    for recorder in recorders:
+        for name, stage in recorder.stages.items():
+            stage_seconds.setdefault(name, []).append(stage.wall_seconds)
+
+    report = {
+        "users": args.users,
+        "chats_per_user": args.chats_per_user,
+        "latency": args.latency,
+        "concurrency": args.concurrency,
+        "coach_mode": os.getenv("COACH_GENERATION_MODE", "split"),
+        "elapsed_seconds": round(elapsed, 3),
+        "runs_per_second": round(len(recorders) / elapsed, 3),
+        "run_seconds_p50": round(statistics.median(r.wall_seconds for r in recorders), 3),
+        "llm_calls": FakeLLMSettings.calls,
+        "llm_calls_per_run": round(FakeLLMSettings.calls / len(recorders), 2),
+        "db_seconds": round(timer.seconds, 3),
+        "db_statements": timer.statements,
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 2),
+        "stage_seconds_mean": {name: round(statistics.mean(values), 4) for name, values in stage_seconds.items()},
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        change = report["runs_per_second"] / baseline["runs_per_second"] - 1
+        print(f"runs/sec {baseline['runs_per_second']} -> {report['runs_per_second']} ({change:+.1%})")
+        if change < -args.max_regression:
+            print("Throughput regressed beyond the allowed margin")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure the cost of building a plan response, from loaded rows to the bytes sent.
+
+Builds plans of growing size in memory, no database involved, and times two paths per response:
+
+  * validated   - the old read path: the rows are converted into EmployeeActionItems, which
+                  FastAPI validates again against the route's response_model, turns into
+                  jsonable data and encodes with the stdlib json module
+  * prerendered - the read path since plans are rendered when written: the stored
+                  categorized_action_items bytes are wrapped with orjson.Fragment and sent as is
+
+The render column shows what the write path pays once per write to produce those bytes.
+
+With 4 steps and 3 notes per item, building the response of a 100 item plan (50 KB) took
+1.6 ms validated and 0.007 ms prerendered, and of a 1000 item plan (500 KB) 26 ms and 0.03 ms.
+
+Usage:
+    python benchmarks/plan_response_build.py --items 10 100 1000 --repeat 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 1000], help="action items per plan")
+    parser.add_argument("--items-per-category", type=int, default=10)
+    parser.add_argument("--steps", type=int, default=4, help="steps per action item")
+    parser.add_argument("--notes", type=int, default=3, help="progress notes per action item")
+    parser.add_argument("--repeat", type=int, default=200, help="responses built per path and size")
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# The app reads its settings at import time, nothing is written to this database
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'plan_response_build.db')}")
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+from db_models import PlanOfAction, PlanCategory, ActionItem, ActionItemStep, ActionItemNote  # noqa: E402
+from pydantic_models import EmployeeActionItems  # noqa: E402
+from pkgs.system.queries import to_category_groups, render_plan, employee_plan_json  # noqa: E402
+from routes.system import JSONBytesResponse  # noqa: E402
+
+
+def build_plan(items: int) -> PlanOfAction:
+    plan = PlanOfAction(id=1, user_id=2, user_name="Benchmark User", target_user_id=2, revision=1)
+    for position in range((items + args.items_per_category - 1) // args.items_per_category):
+        count = min(args.items_per_category, items - position * args.items_per_category)
+        plan.categories.append(PlanCategory(position=position, name=f"Category {position}", action_items=[
+            ActionItem(
+                id=position * args.items_per_category + i,
+                position=i,
+                title=f"Action item {i} of category {position}, phrased the way the coach phrases them",
+                status="pending review",
+                version=1,
+                steps=[ActionItemStep(position=j, text=f"Step {j}: a sentence or two on what to do next")
+                       for j in range(args.steps)],
+                notes=[ActionItemNote(position=j, text=f"Note {j}: what happened since the last review")
+                       for j in range(args.notes)]
+            )
+            for i in range(count)
+        ]))
+    return plan
+
+
+async def validated(plan: PlanOfAction, field) -> bytes:
+    content = EmployeeActionItems(
+        user_id=plan.user_id, name=plan.user_name, categorized_action_items=to_category_groups(plan)
+    )
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+
+async def prerendered(plan: PlanOfAction, rendered: bytes) -> bytes:
+    return JSONBytesResponse(employee_plan_json(plan, rendered)).body
+
+
+async def per_call_ms(build, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await build()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def main():
+    field = create_response_field(name="response", type_=EmployeeActionItems | None)
+
+    print(f"{'items':>6} {'bytes':>9} {'validated ms':>13} {'prerendered ms':>15} {'speedup':>8} {'render ms':>10}")
+    for items in args.items:
+        plan = build_plan(items)
+        rendered = render_plan(plan)
+        body = await prerendered(plan, rendered)
+        assert EmployeeActionItems.model_validate_json(body) == EmployeeActionItems.model_validate_json(
+            await validated(plan, field)
+        ), "the two paths must produce the same response"
+
+        validated_ms = await per_call_ms(lambda: validated(plan, field), args.repeat)
+        prerendered_ms = await per_call_ms(lambda: prerendered(plan, rendered), args.repeat)
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            render_plan(plan)
+        render_ms = (time.perf_counter() - started) / args.repeat * 1000
+        print(f"{items:>6} {len(body):>9} {validated_ms:>13.3f} {prerendered_ms:>15.4f} "
+              f"{validated_ms / prerendered_ms:>7.0f}x {render_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# In-memory chat context kept per worker (pkgs/ai/conversation_store.py)
+CHAT_STORE_MAX_USERS = int(os.getenv("CHAT_STORE_MAX_USERS", "1000"))
+CHAT_STORE_MAX_BYTES = int(os.getenv("CHAT_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+CHAT_STORE_TTL_SECONDS = int(os.getenv("CHAT_STORE_TTL_SECONDS", "3600"))
+
+# Prompt window for /chat (pkgs/ai/chatbot.py)
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "6000"))
+CHAT_CONTEXT_RECENT_TURNS = int(os.getenv("CHAT_CONTEXT_RECENT_TURNS", "10"))
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-3.5-turbo")
+
+# Concurrent LLM calls per coach run (pkgs/ai/coach.py)
+COACH_MAX_CONCURRENCY = int(os.getenv("COACH_MAX_CONCURRENCY", "8"))
+# One of split, combined or batched, see pkgs/ai/coach.py
+COACH_GENERATION_MODE = os.getenv("COACH_GENERATION_MODE", "split")
+
+# LLM response cache shared by the pipeline stages (pkgs/ai/llm_cache.py)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PERSISTENT = os.getenv("LLM_CACHE_PERSISTENT", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+LLM_CACHE_MAX_PERSISTENT_ENTRIES = int(os.getenv("LLM_CACHE_MAX_PERSISTENT_ENTRIES", "100000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Background pipeline jobs (pkgs/ai/jobs.py)
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "4"))
+# A job still marked running after this long is assumed to belong to a dead process and is requeued
+PIPELINE_JOB_STALE_SECONDS = int(os.getenv("PIPELINE_JOB_STALE_SECONDS", "1800"))
+# Checkpoints of runs that never completed are dropped after this long
+PIPELINE_CHECKPOINT_TTL_SECONDS = int(os.getenv("PIPELINE_CHECKPOINT_TTL_SECONDS", str(7 * 24 * 3600)))
+# Global OpenAI budget the pipeline job scheduler keeps runs under (pkgs/ai/jobs.py), 0 disables a limit
+PIPELINE_REQUESTS_PER_MINUTE = int(os.getenv("PIPELINE_REQUESTS_PER_MINUTE", "500"))
+PIPELINE_TOKENS_PER_MINUTE = int(os.getenv("PIPELINE_TOKENS_PER_MINUTE", "150000"))
+# Assumed cost of a run until real runs have been measured
+PIPELINE_RUN_ESTIMATED_REQUESTS = int(os.getenv("PIPELINE_RUN_ESTIMATED_REQUESTS", "15"))
+PIPELINE_RUN_ESTIMATED_TOKENS = int(os.getenv("PIPELINE_RUN_ESTIMATED_TOKENS", "12000"))
+
+# Shared OpenAI rate limiter and retries (pkgs/ai/rate_limiter.py)
+# JSON object of model -> [requests per minute, tokens per minute], models not listed get the defaults
+OPENAI_RATE_LIMITS = os.getenv("OPENAI_RATE_LIMITS", '{"gpt-4": [500, 30000], "gpt-3.5-turbo": [3500, 160000]}')
+OPENAI_DEFAULT_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_DEFAULT_REQUESTS_PER_MINUTE", "500"))
+OPENAI_DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_DEFAULT_TOKENS_PER_MINUTE", "30000"))
+# Completion tokens reserved for a request that sets no max_tokens
+OPENAI_ESTIMATED_COMPLETION_TOKENS = int(os.getenv("OPENAI_ESTIMATED_COMPLETION_TOKENS", "256"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_BASE_BACKOFF_SECONDS = float(os.getenv("OPENAI_BASE_BACKOFF_SECONDS", "1"))
+OPENAI_MAX_BACKOFF_SECONDS = float(os.getenv("OPENAI_MAX_BACKOFF_SECONDS", "60"))
+
+# Connection pool shared by the pipeline's LLM clients (pkgs/ai/clients.py)
+# Also read by the openai client of /chat, so one variable points everything at a proxy or mock server
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+LLM_HTTP_MAX_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "64"))
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS", "32"))
+LLM_HTTP_KEEPALIVE_SECONDS = float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", "60"))
+
+# Database connection pools (db_engine.py). DB_POOL_SIZE and DB_MAX_OVERFLOW are the connection budget of one
+# worker, split between the async engine of the routes and the sync engine of the pipeline workers.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", str(DB_POOL_SIZE // 2)))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", str(DB_MAX_OVERFLOW // 2)))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "10"))
+# Connections checked out for longer than this are reported as leaks, 0 disables the detector
+DB_CONNECTION_LEAK_SECONDS = float(os.getenv("DB_CONNECTION_LEAK_SECONDS", "120"))
+DB_CONNECTION_LEAK_CHECK_SECONDS = float(os.getenv("DB_CONNECTION_LEAK_CHECK_SECONDS", "30"))
+
+# Pages of GET /conversation/{user_id}. Streamed reads fetch rows from the cursor in batches of this size.
+CONVERSATION_PAGE_SIZE = int(os.getenv("CONVERSATION_PAGE_SIZE", "50"))
+CONVERSATION_MAX_PAGE_SIZE = int(os.getenv("CONVERSATION_MAX_PAGE_SIZE", "200"))
+CONVERSATION_STREAM_BATCH_SIZE = int(os.getenv("CONVERSATION_STREAM_BATCH_SIZE", "500"))
+# Plans read per batch from the cursor when GET /employees streams its response
+MANAGER_PLANS_STREAM_BATCH_SIZE = int(os.getenv("MANAGER_PLANS_STREAM_BATCH_SIZE", "100"))
+
+# Built dashboard plan responses cached per worker (pkgs/system/plan_cache.py). Writes invalidate
+# the cache of their own worker, the TTL bounds how stale another worker's cache can be.
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "5000"))
+PLAN_CACHE_TTL_SECONDS = float(os.getenv("PLAN_CACHE_TTL_SECONDS", "300"))
+
+# Write-behind of the /chat messages (pkgs/system/chat_writer.py). Messages are written in batches of
+# up to CHAT_WRITE_BATCH_SIZE, waiting at most CHAT_WRITE_FLUSH_INTERVAL_SECONDS for a batch to fill.
+# /chat waits for room once CHAT_WRITE_MAX_PENDING messages are queued.
+CHAT_WRITE_BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", "100"))
+CHAT_WRITE_FLUSH_INTERVAL_SECONDS = float(os.getenv("CHAT_WRITE_FLUSH_INTERVAL_SECONDS", "0.05"))
+CHAT_WRITE_MAX_PENDING = int(os.getenv("CHAT_WRITE_MAX_PENDING", "10000"))
+CHAT_WRITE_RETRIES = int(os.getenv("CHAT_WRITE_RETRIES", "3"))
@@ -1,24 +1,92 @@
 from dotenv import load_dotenv
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import sessionmaker
+import config
+from pkgs.system import db_pool
 
 load_dotenv()
 
 
-usr = os.environ["DB_USERNAME"]
-pswd = os.environ["DB_PASSWORD"]
-host = os.environ["DB_HOST"]
+# DATABASE_URL points the app at another database, e.g. a local one for benchmarks
+database_url = os.getenv("DATABASE_URL")
+if not database_url:
+    usr = os.environ["DB_USERNAME"]
+    pswd = os.environ["DB_PASSWORD"]
+    host = os.environ["DB_HOST"]
+    database_url = f'postgresql://{usr}:{pswd}@{host}:25060/defaultdb'
 
+connect_args = {}
+if database_url.startswith("postgresql"):
+    connect_args = {
+        "connect_timeout": config.DB_CONNECT_TIMEOUT_SECONDS,
+        # Notice dead connections to the managed database before the pool hands them out
+        "keepalives": 1,
+        "keepalives_idle": 30,
+        "keepalives_interval": 10,
+        "keepalives_count": 3,
+    }
 
-engine = create_engine(f'postgresql://{usr}:{pswd}@{host}:25060/defaultdb')
+# Code running in threads, the pipeline workers and the chat context loads, uses the synchronous
+# engine. It gets what the async engine of the routes below leaves of the connection budget.
+engine = create_engine(
+    database_url,
+    poolclass=db_pool.InstrumentedQueuePool,
+    # A pool_size of 0 would mean no limit
+    pool_size=max(config.DB_POOL_SIZE - config.DB_ASYNC_POOL_SIZE, 1),
+    max_overflow=max(config.DB_MAX_OVERFLOW - config.DB_ASYNC_MAX_OVERFLOW, 0),
+    pool_timeout=config.DB_POOL_TIMEOUT_SECONDS,
+    # The managed database closes idle connections, recycle them before it does
+    pool_recycle=config.DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=config.DB_POOL_PRE_PING,
+    connect_args=connect_args
+)
+
+leak_detector = db_pool.LeakDetector(config.DB_CONNECTION_LEAK_SECONDS) if config.DB_CONNECTION_LEAK_SECONDS else None
+db_pool.observe(engine, leak_detector)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
+def to_async_url(url: str) -> str:
+    """The same database through its asyncio driver"""
+    for sync_prefix, async_prefix in (("postgresql://", "postgresql+asyncpg://"),
+                                      ("postgresql+psycopg2://", "postgresql+asyncpg://"),
+                                      ("sqlite://", "sqlite+aiosqlite://")):
+        if url.startswith(sync_prefix):
+            return async_prefix + url[len(sync_prefix):]
+    return url
+
+
+# The routes run on the event loop and use this engine, so a query does not block other requests.
+async_database_url = os.getenv("ASYNC_DATABASE_URL") or to_async_url(database_url)
+async_connect_args = {"timeout": config.DB_CONNECT_TIMEOUT_SECONDS} if async_database_url.startswith("postgresql") else {}
+
+async_engine = create_async_engine(
+    async_database_url,
+    poolclass=db_pool.InstrumentedAsyncQueuePool,
+    pool_size=max(config.DB_ASYNC_POOL_SIZE, 1),
+    max_overflow=config.DB_ASYNC_MAX_OVERFLOW,
+    pool_timeout=config.DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=config.DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=config.DB_POOL_PRE_PING,
+    connect_args=async_connect_args
+)
+
+db_pool.observe(async_engine.sync_engine, leak_detector, name="async")
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -1,9 +1,9 @@
-from sqlalchemy import create_engine, Column,JSON ,Integer, String, DateTime, ForeignKey, Boolean
+from sqlalchemy import create_engine, Column,JSON ,Integer, String, Text, DateTime, ForeignKey, Boolean, LargeBinary, UniqueConstraint, Index
 from sqlalchemy.orm import DeclarativeBase, relationship
 from sqlalchemy.sql import func
 from datetime import datetime
 
-__all__ = ["User", "Chat","PlanOfAction"]
+__all__ = ["User", "Chat","PlanOfAction", "PlanCategory", "ActionItem", "ActionItemStep", "ActionItemNote", "ChatSummary", "LlmCacheEntry", "PipelineBatch", "PipelineJob", "PipelineWatermark", "PipelineCheckpoint"]
 
 
 class Base(DeclarativeBase):
@@ -24,6 +24,8 @@ class User(Base):
 
 class Chat(Base):
     __tablename__ = 'chats'
+    # Conversations are read per user in id order, see migrate.py
+    __table_args__ = (Index('ix_chats_user_id_id', 'user_id', 'id'),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     message = Column(String, nullable=False)
@@ -33,13 +35,158 @@ class Chat(Base):
 
 class PlanOfAction(Base):
     __tablename__ = 'plan_of_actions'
-    
+    # One plan per user and audience, looked up by both, and per audience for the manager, see migrate.py
+    __table_args__ = (
+        Index('uq_plan_of_actions_user_id_target_user_id', 'user_id', 'target_user_id', unique=True),
+        Index('ix_plan_of_actions_target_user_id', 'target_user_id'),
+    )
+
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     user_name = Column(String(50), nullable=False)  # Matching the size with User.name
+    # Legacy copy of the whole plan as one document. Migration 3 backfilled it into the tables below,
+    # which hold the plan since; it is no longer written
     categorized_action_items = Column(JSON, nullable=True)
     target_user_id = Column(Integer, nullable=False)
+    # The categorized_action_items JSON the API serves, rendered when the plan is written. Partial
+    # updates of its items set it to NULL and bump revision; the next read renders it again
+    rendered = Column(LargeBinary, nullable=True)
+    revision = Column(Integer, nullable=False, default=1, server_default='1')
 
     
     # Relationship with User table
-    user = relationship("User", back_populates="plan_of_actions")
\ No newline at end of file
+    user = relationship("User", back_populates="plan_of_actions")
+    categories = relationship(
+        "PlanCategory", back_populates="plan", order_by="PlanCategory.position", cascade="all, delete-orphan"
+    )
+
+
+class PlanCategory(Base):
+    __tablename__ = 'plan_categories'
+    __table_args__ = (Index('ix_plan_categories_plan_id_position', 'plan_id', 'position'),)
+
+    id = Column(Integer, primary_key=True)
+    plan_id = Column(Integer, ForeignKey('plan_of_actions.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Integer, nullable=False)
+    name = Column(Text, nullable=False, index=True)
+
+    plan = relationship("PlanOfAction", back_populates="categories")
+    action_items = relationship(
+        "ActionItem", back_populates="category", order_by="ActionItem.position", cascade="all, delete-orphan"
+    )
+
+
+class ActionItem(Base):
+    __tablename__ = 'action_items'
+    __table_args__ = (Index('ix_action_items_category_id_position', 'category_id', 'position'),)
+
+    id = Column(Integer, primary_key=True)
+    category_id = Column(Integer, ForeignKey('plan_categories.id', ondelete='CASCADE'), nullable=False)
+    # Denormalized from the category so items can be filtered across plans without the join
+    plan_id = Column(Integer, ForeignKey('plan_of_actions.id', ondelete='CASCADE'), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    title = Column(Text, nullable=False)
+    status = Column(String(50), nullable=False, index=True)
+    # Bumped by every partial update, clients send the version they read to detect concurrent edits
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+
+    category = relationship("PlanCategory", back_populates="action_items")
+    plan = relationship("PlanOfAction")
+    steps = relationship(
+        "ActionItemStep", order_by="ActionItemStep.position", cascade="all, delete-orphan"
+    )
+    notes = relationship(
+        "ActionItemNote", order_by="ActionItemNote.position", cascade="all, delete-orphan"
+    )
+
+
+class ActionItemStep(Base):
+    __tablename__ = 'action_item_steps'
+    __table_args__ = (Index('ix_action_item_steps_action_item_id_position', 'action_item_id', 'position'),)
+
+    id = Column(Integer, primary_key=True)
+    action_item_id = Column(Integer, ForeignKey('action_items.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+
+
+class ActionItemNote(Base):
+    __tablename__ = 'action_item_notes'
+    __table_args__ = (Index('ix_action_item_notes_action_item_id_position', 'action_item_id', 'position'),)
+
+    id = Column(Integer, primary_key=True)
+    action_item_id = Column(Integer, ForeignKey('action_items.id', ondelete='CASCADE'), nullable=False)
+    position = Column(Integer, nullable=False)
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class ChatSummary(Base):
+    __tablename__ = 'chat_summaries'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    summary = Column(Text, nullable=False)
+    # Number of the user's chats rows (in id order) folded into the summary
+    summarized_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+
+class LlmCacheEntry(Base):
+    __tablename__ = 'llm_cache'
+
+    # sha256 of the model, prompt and sampling parameters
+    key = Column(String(64), primary_key=True)
+    model = Column(String(50), nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+
+
+class PipelineBatch(Base):
+    __tablename__ = 'pipeline_batches'
+
+    id = Column(Integer, primary_key=True)
+    user_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class PipelineJob(Base):
+    __tablename__ = 'pipeline_jobs'
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    user_name = Column(String(50), nullable=False)
+    # Set when the job was submitted as part of an organization-wide batch
+    batch_id = Column(Integer, ForeignKey('pipeline_batches.id'), nullable=True, index=True)
+    # Checkpoints of the run are stored under this id; a retry after a failure reuses it
+    run_id = Column(String(64), nullable=True)
+    # queued, running, succeeded or failed
+    status = Column(String(20), nullable=False, default='queued', index=True)
+    error = Column(Text, nullable=True)
+    # Per-stage timings and token usage of the run, see pkgs/ai/instrumentation.py
+    summary = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class PipelineWatermark(Base):
+    __tablename__ = 'pipeline_watermarks'
+
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    # Highest chats.id already analyzed by the pipeline
+    last_chat_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+
+class PipelineCheckpoint(Base):
+    __tablename__ = 'pipeline_checkpoints'
+    __table_args__ = (UniqueConstraint('run_id', 'stage'),)
+
+    id = Column(Integer, primary_key=True)
+    run_id = Column(String(64), nullable=False)
+    # findings, routed_feedback, categorized_insights or action_plans
+    stage = Column(String(50), nullable=False)
+    # sha256 of the stage input, a checkpoint is only reused for the same input
+    input_hash = Column(String(64), nullable=False)
+    output = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
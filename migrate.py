@@ -1,12 +1,316 @@
+"""
+Versioned schema migrations.
+
+Every migration has a version, a description and a function that applies it on a connection.
+Applied versions are recorded in schema_migrations, so running this script again only applies
+the migrations added since. Each migration runs in its own transaction; on Postgres an advisory
+lock keeps two deploys from migrating at the same time.
+
+The databases in use were created by the create_all script this replaced, without an alembic
+version table, and the backfills build rows with the app's own models, so the runner stays a
+plain script next to them rather than an alembic environment.
+
+Usage:
+    python migrate.py            apply pending migrations
+    python migrate.py --status   list migrations and whether they are applied
+    python migrate.py --check    EXPLAIN the hot queries and fail if one does not use its index
+"""
+import argparse
+import sys
+
 from db_models import (
     Base,
     User,
     Chat,
-    PlanOfAction
+    PlanOfAction,
+    PlanCategory,
+    ActionItem,
+    ActionItemStep,
+    ActionItemNote,
+    ChatSummary,
+    LlmCacheEntry,
+    PipelineBatch,
+    PipelineJob,
+    PipelineWatermark,
+    PipelineCheckpoint
 )
 
+from sqlalchemy import text, select, delete, func, exists, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
 from db_engine import engine
 
-Base.metadata.create_all(bind=engine, tables=[User.__table__])
-Base.metadata.create_all(bind=engine, tables=[Chat.__table__])
-Base.metadata.create_all(bind=engine,tables=[PlanOfAction.__table__])
\ No newline at end of file
+MIGRATIONS_LOCK_ID = 4712001
+BACKFILL_BATCH_SIZE = 200
+
+
+def create_tables(connection: Connection):
+    for table in (User, Chat, PlanOfAction, ChatSummary, LlmCacheEntry, PipelineBatch, PipelineJob,
+                  PipelineWatermark, PipelineCheckpoint):
+        Base.metadata.create_all(bind=connection, tables=[table.__table__])
+
+    # Columns added to pipeline_jobs after the table was first created. Other dialects are only
+    # used for fresh local databases, where create_all already includes them
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("ALTER TABLE pipeline_jobs ADD COLUMN IF NOT EXISTS run_id VARCHAR(64)"))
+        connection.execute(text("ALTER TABLE pipeline_jobs ADD COLUMN IF NOT EXISTS summary JSON"))
+        connection.execute(text(
+            "ALTER TABLE pipeline_jobs ADD COLUMN IF NOT EXISTS batch_id INTEGER REFERENCES pipeline_batches(id)"
+        ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_pipeline_jobs_batch_id ON pipeline_jobs (batch_id)"))
+
+
+def index_chat_and_plan_lookups(connection: Connection):
+    # (user_id, id) serves the conversation reads, which filter on the user and order by id,
+    # the newest-chat lookup of the pipeline batch and the per-user delete
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_chats_user_id_id ON chats (user_id, id)"))
+    # (user_id, target_user_id, id) serves the plan of a user for an audience, latest first,
+    # and the per-user plan reads and delete through its user_id prefix
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_plan_of_actions_user_id_target_user_id "
+        "ON plan_of_actions (user_id, target_user_id, id)"
+    ))
+    # The manager view reads every plan addressed to the manager
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_plan_of_actions_target_user_id ON plan_of_actions (target_user_id)"
+    ))
+
+
+def plan_rows(plan_id: int, document) -> list:
+    """plan_categories rows, with their items, steps and notes, of a legacy categorized_action_items document"""
+    category_groups = document.get("categorized_action_items", []) if isinstance(document, dict) else []
+    return [
+        PlanCategory(
+            plan_id=plan_id,
+            position=position,
+            name=category_group.get("category", ""),
+            action_items=[
+                ActionItem(
+                    plan_id=plan_id,
+                    position=i,
+                    title=item.get("action_title", ""),
+                    status=item.get("action_status", "pending review"),
+                    steps=[ActionItemStep(position=j, text=step) for j, step in enumerate(item.get("action_plan", []))],
+                    notes=[ActionItemNote(position=j, text=note) for j, note in enumerate(item.get("progress_notes", []))]
+                )
+                for i, item in enumerate(category_group.get("action_items", []))
+            ]
+        )
+        for position, category_group in enumerate(category_groups)
+    ]
+
+
+def latest_plan_ids():
+    """Id of the latest plan of every user and audience. Plans used to be inserted on every pipeline run"""
+    return select(func.max(PlanOfAction.id)).group_by(PlanOfAction.user_id, PlanOfAction.target_user_id)
+
+
+def normalize_plans(connection: Connection):
+    for table in (PlanCategory, ActionItem, ActionItemStep, ActionItemNote):
+        Base.metadata.create_all(bind=connection, tables=[table.__table__])
+
+    # Only the latest plan of a user and audience is backfilled, the ones it superseded are never read.
+    # Plans that already have categories are skipped, so a backfill that failed part way can be rerun
+    pending = select(PlanOfAction.id, PlanOfAction.categorized_action_items).where(
+        PlanOfAction.categorized_action_items.is_not(None),
+        PlanOfAction.id.in_(latest_plan_ids()),
+        ~exists().where(PlanCategory.plan_id == PlanOfAction.id)
+    ).order_by(PlanOfAction.id)
+
+    backfilled = 0
+    last_id = 0
+    session = Session(bind=connection)
+    try:
+        while True:
+            plans = connection.execute(pending.where(PlanOfAction.id > last_id).limit(BACKFILL_BATCH_SIZE)).all()
+            if not plans:
+                break
+            for plan_id, document in plans:
+                session.add_all(plan_rows(plan_id, document))
+            session.flush()
+            session.expunge_all()
+            backfilled += len(plans)
+            last_id = plans[-1].id
+    finally:
+        session.close()
+    print(f"Backfilled {backfilled} plans into plan_categories and action_items")
+
+
+def add_column(connection: Connection, table: str, column: str, definition: str):
+    """Add a column unless the table has it, as tables created after the model changed already do"""
+    if column not in {existing["name"] for existing in inspect(connection).get_columns(table)}:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+def version_action_items(connection: Connection):
+    add_column(connection, "action_items", "version", "INTEGER NOT NULL DEFAULT 1")
+
+
+def render_plans(connection: Connection):
+    # Existing plans start without rendered JSON and are rendered by their first read
+    blob = "BYTEA" if connection.dialect.name == "postgresql" else "BLOB"
+    add_column(connection, "plan_of_actions", "rendered", blob)
+    add_column(connection, "plan_of_actions", "revision", "INTEGER NOT NULL DEFAULT 1")
+
+
+def keep_latest_plans(connection: Connection):
+    # Delete the plans superseded by a later one of the same user and audience, children first as
+    # SQLite only cascades with foreign keys turned on
+    superseded = select(PlanOfAction.id).where(PlanOfAction.id.not_in(latest_plan_ids()))
+    items = select(ActionItem.id).where(ActionItem.plan_id.in_(superseded))
+    connection.execute(delete(ActionItemStep).where(ActionItemStep.action_item_id.in_(items)))
+    connection.execute(delete(ActionItemNote).where(ActionItemNote.action_item_id.in_(items)))
+    connection.execute(delete(ActionItem).where(ActionItem.plan_id.in_(superseded)))
+    connection.execute(delete(PlanCategory).where(PlanCategory.plan_id.in_(superseded)))
+    deleted = connection.execute(delete(PlanOfAction).where(PlanOfAction.id.not_in(latest_plan_ids()))).rowcount
+    print(f"Deleted {deleted} superseded plans")
+
+    # The unique index serves the lookups of ix_plan_of_actions_user_id_target_user_id, which it replaces
+    connection.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_plan_of_actions_user_id_target_user_id "
+        "ON plan_of_actions (user_id, target_user_id)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_plan_of_actions_user_id_target_user_id"))
+
+
+# (version, description, apply), append new migrations at the end and never edit applied ones
+MIGRATIONS = [
+    (1, "Create tables and pipeline job columns", create_tables),
+    (2, "Index chats and plan_of_actions by user and audience", index_chat_and_plan_lookups),
+    (3, "Normalize plans into categories, action items, steps and notes", normalize_plans),
+    (4, "Version action items for partial updates", version_action_items),
+    (5, "Store the rendered JSON of plans", render_plans),
+    (6, "Keep one plan per user and audience", keep_latest_plans),
+]
+
+# (name, statement, index the plan must use) of the queries behind the routes and the pipeline,
+# kept in sync with pkgs/system/queries.py, async_queries.py and actions.py
+HOT_QUERIES = [
+    ("get_user_conversation, newest first",
+     select(Chat).where(Chat.user_id == 1, Chat.id < 100).order_by(Chat.id.desc()).limit(51),
+     "ix_chats_user_id_id"),
+    ("get_user_chat_history",
+     select(Chat).where(Chat.user_id == 1, Chat.id > 100).order_by(Chat.id),
+     "ix_chats_user_id_id"),
+    ("get_users_with_new_chats",
+     select(Chat.user_id, func.max(Chat.id)).group_by(Chat.user_id),
+     "ix_chats_user_id_id"),
+    ("get_plan_of_actions_row",
+     select(PlanOfAction).where(PlanOfAction.user_id == 1, PlanOfAction.target_user_id == 1)
+     .order_by(PlanOfAction.id.desc()).limit(1),
+     "uq_plan_of_actions_user_id_target_user_id"),
+    ("get_user_action_plan",
+     select(PlanOfAction).where(PlanOfAction.target_user_id == 2, PlanOfAction.user_id == 2)
+     .order_by(PlanOfAction.id.desc()).limit(1),
+     "uq_plan_of_actions_user_id_target_user_id"),
+    ("get_manager_action_plan",
+     select(func.max(PlanOfAction.id)).where(PlanOfAction.target_user_id == 1).group_by(PlanOfAction.user_id),
+     "ix_plan_of_actions_target_user_id"),
+    ("plan_tree categories",
+     select(PlanCategory).where(PlanCategory.plan_id.in_([1, 2, 3])).order_by(PlanCategory.position),
+     "ix_plan_categories_plan_id_position"),
+    ("plan_tree action items",
+     select(ActionItem).where(ActionItem.category_id.in_([1, 2, 3])).order_by(ActionItem.position),
+     "ix_action_items_category_id_position"),
+    ("add_progress_note position",
+     select(func.max(ActionItemNote.position)).where(ActionItemNote.action_item_id == 1),
+     "ix_action_item_notes_action_item_id_position"),
+    ("action items by status across plans",
+     select(ActionItem).where(ActionItem.status == "pending review"),
+     "ix_action_items_status"),
+    ("delete plan_of_actions of a user",
+     delete(PlanOfAction).where(PlanOfAction.user_id == 1),
+     "uq_plan_of_actions_user_id_target_user_id"),
+    ("delete chats of a user",
+     delete(Chat).where(Chat.user_id == 1),
+     "ix_chats_user_id_id"),
+]
+
+
+def ensure_migrations_table(connection: Connection):
+    connection.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR(200) NOT NULL, "
+        "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    ))
+
+
+def applied_versions(connection: Connection) -> set:
+    return set(connection.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+
+def migrate():
+    with engine.begin() as connection:
+        ensure_migrations_table(connection)
+
+    for version, description, apply in MIGRATIONS:
+        with engine.begin() as connection:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+            if version in applied_versions(connection):
+                continue
+            print(f"Applying migration {version}: {description}")
+            apply(connection)
+            connection.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:version, :description)"),
+                {"version": version, "description": description}
+            )
+
+
+def status():
+    with engine.begin() as connection:
+        ensure_migrations_table(connection)
+        applied = applied_versions(connection)
+    for version, description, _ in MIGRATIONS:
+        print(f"{version:>4} {'applied' if version in applied else 'pending':<8} {description}")
+
+
+def explain(connection: Connection, statement) -> str:
+    sql = statement.compile(connection, compile_kwargs={"literal_binds": True})
+    if connection.dialect.name == "postgresql":
+        # The planner prefers sequential scans on small tables, so take them off the table to see
+        # whether an index can serve the query at all
+        connection.execute(text("SET LOCAL enable_seqscan = off"))
+        rows = connection.execute(text(f"EXPLAIN {sql}"))
+        return "\n".join(row[0] for row in rows)
+    if connection.dialect.name == "sqlite":
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"))
+        return "\n".join(row[-1] for row in rows)
+    raise RuntimeError(f"EXPLAIN check is not supported on {connection.dialect.name}")
+
+
+def check() -> bool:
+    """EXPLAIN every hot query and report the ones whose plan does not use the expected index"""
+    ok = True
+    connection = engine.connect()
+    try:
+        for name, statement, index in HOT_QUERIES:
+            # Deletes are explained, never run, but roll back anyway to leave nothing behind
+            transaction = connection.begin()
+            try:
+                plan = explain(connection, statement)
+            finally:
+                transaction.rollback()
+            uses_index = index in plan
+            ok = ok and uses_index
+            print(f"{'ok' if uses_index else 'MISSING':<8} {name} -> {index}")
+            if not uses_index:
+                print("    " + plan.replace("\n", "\n    "))
+    finally:
+        connection.close()
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--status", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    if args.status:
+        status()
+    elif args.check:
+        sys.exit(0 if check() else 1)
+    else:
+        migrate()
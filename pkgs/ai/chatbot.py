@@ -2,11 +2,20 @@ from fastapi import FastAPI, HTTPException
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI
 import os
 import dotenv
-from typing import Dict
+from typing import Dict, AsyncGenerator, List
+from functools import lru_cache
 import json
+import asyncio
+import tiktoken
+import config
+from db_engine import SessionLocal
+from pkgs.ai.conversation_store import ConversationStore, ChatContext
+from pkgs.ai.rate_limiter import call_with_retries_async, rate_limiter
+from pkgs.system import queries as system_queries
+from pkgs.system import actions as system_actions
 
 dotenv.load_dotenv()
 
@@ -33,49 +42,245 @@ Example responses:
 
 Remember: Your goal is to facilitate meaningful workplace discussions while staying friendly but professional."""
 
+GREETING = "Hey! How's your day going? I'd love to hear about your work experience."
+
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between an employee and a workplace AI assistant.
+Update the summary with the new messages below. Keep every concrete detail the employee shared about their
+work, team, manager, goals and concerns. Drop small talk. Write in the third person, at most 250 words.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}
+
+Respond with only the updated summary."""
+
+# Tokens the chat format adds per message and to prime the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:
+        print(f"Falling back to approximate token counts for {model}: {str(e)}")
+        return None
+
+
+def count_tokens(messages: List[dict], model: str = "gpt-4") -> int:
+    """Count the prompt tokens of chat messages locally"""
+    encoding = _encoding(model)
+    total = TOKENS_PER_REPLY
+    for message in messages:
+        content = message.get("content") or ""
+        total += TOKENS_PER_MESSAGE + (len(encoding.encode(content)) if encoding else len(content) // 4 + 1)
+    return total
+
+
+class ContextWindow:
+    """
+    Fits a chat context into a token budget: the system prompt, a rolling summary of
+    older turns and as many of the most recent messages as fit.
+
+    Once a context holds twice the recent window, everything but the last recent_turns
+    turns is folded into the summary, so summaries are refreshed in batches rather than
+    on every turn.
+    """
+
+    def __init__(self, model: str, token_budget: int, recent_turns: int):
+        self.model = model
+        self.token_budget = token_budget
+        self.recent_messages = recent_turns * 2
+
+    def prefix(self, context: ChatContext) -> List[dict]:
+        messages = [{"role": "system", "content": SYSTEM_CONTEXT}]
+        if context.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{context.summary}"})
+        elif context.summarized_count == 0:
+            messages.append({"role": "assistant", "content": GREETING})
+        return messages
+
+    def build(self, context: ChatContext) -> List[dict]:
+        """Messages to send: the prefix plus the newest messages that fit the budget"""
+        prefix = self.prefix(context)
+        remaining = self.token_budget - count_tokens(prefix, self.model)
+        window = []
+        for message in reversed(context.messages):
+            tokens = count_tokens([message], self.model) - TOKENS_PER_REPLY
+            # Always send the latest message, even if it alone is over budget
+            if window and tokens > remaining:
+                break
+            window.append(message)
+            remaining -= tokens
+        return prefix + window[::-1]
+
+    def foldable(self, context: ChatContext) -> int:
+        """Number of leading messages that should be folded into the summary now"""
+        older = len(context.messages) - self.recent_messages
+        if older >= self.recent_messages:
+            return older
+        # Fold early when even the recent window no longer fits the budget
+        if older > 0 and count_tokens(self.build(context), self.model) >= self.token_budget:
+            return older
+        return 0
+
+
+def load_conversation(user_id: int) -> ChatContext:
+    """Rebuild a user's chat context from the chats and chat_summaries tables"""
+    with SessionLocal() as session:
+        chat_summary = system_queries.get_chat_summary(user_id, session)
+        summarized_count = chat_summary.summarized_count if chat_summary else 0
+        history = system_queries.get_user_chat_history(user_id, session, offset=summarized_count)
+    return ChatContext(
+        messages=[
+            {"role": "assistant" if item.is_ai else "user", "content": item.message}
+            for item in history
+        ],
+        summary=chat_summary.summary if chat_summary else None,
+        summarized_count=summarized_count
+    )
+
+
+def save_summary(user_id: int, summary: str, summarized_count: int):
+    with SessionLocal() as session:
+        system_actions.save_chat_summary(user_id, summary, summarized_count, session)
+
+
+conversation_store = ConversationStore(
+    loader=load_conversation,
+    max_users=config.CHAT_STORE_MAX_USERS,
+    max_bytes=config.CHAT_STORE_MAX_BYTES,
+    ttl_seconds=config.CHAT_STORE_TTL_SECONDS
+)
+
 
 class Chatbot:
     def __init__(self):
         api_key = os.getenv('OPENAI_API_KEY')
         if not api_key:
             raise ValueError("OpenAI API key not found")
-        self.client = OpenAI(api_key=api_key)
-        self.conversations: Dict[int, list] = {}
+        # Retries go through the shared rate limiter instead of the client
+        self.client = AsyncOpenAI(api_key=api_key, max_retries=0)
+        self.conversations = conversation_store
+        self.window = ContextWindow(
+            model="gpt-4",
+            token_budget=config.CHAT_CONTEXT_TOKEN_BUDGET,
+            recent_turns=config.CHAT_CONTEXT_RECENT_TURNS
+        )
+        self._summarizing: Dict[int, asyncio.Task] = {}
+        # Load the tokenizer up front rather than on the event loop during the first chat
+        _encoding(self.window.model)
 
-    def chat_stream(self, user_id: int, message: str):
-        if user_id not in self.conversations:
-            self.conversations[user_id] = [
-                {"role": "system", "content": SYSTEM_CONTEXT},
-                {"role": "assistant",
-                 "content": "Hey! How's your day going? I'd love to hear about your work experience."}
-            ]
+    async def load_context(self, user_id: int) -> ChatContext:
+        """The user's chat context. A miss reads the chats table, so keep it off the event loop"""
+        return await asyncio.to_thread(self.conversations.get, user_id)
 
-        self.conversations[user_id].append({"role": "user", "content": message})
+    async def chat_stream(self, user_id: int, message: str, context: ChatContext) -> AsyncGenerator[str, None]:
+        """
+        Stream the reply to message on context, from load_context. Load the context before the
+        message is queued to be written, so a context read from the chats table cannot hold it yet.
+        """
+        turn = [{"role": "user", "content": message}]
+        context.messages.extend(turn)
 
+        completed = False
+        reserved = 0
+        used = None
+        full_response = ""
         try:
-            stream = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=self.conversations[user_id],
-                temperature=0.6,  # Reduced for more consistent professionalism
-                max_tokens=1000,
-                stream=True
+            messages = self.window.build(context)
+            prompt_tokens = count_tokens(messages, self.window.model)
+            # Only opening the stream is retried, a reply that fails halfway is reported as an error
+            stream = await call_with_retries_async(
+                self.window.model,
+                prompt_tokens + 1000,
+                lambda: self.client.chat.completions.create(
+                    model=self.window.model,
+                    messages=messages,
+                    temperature=0.6,  # Reduced for more consistent professionalism
+                    max_tokens=1000,
+                    stream=True,
+                    # The last chunk reports the tokens the reply really used, see the finally below
+                    stream_options={"include_usage": True}
+                )
             )
+            # Settled below from here on, a request that failed for good was given back by the retry helper
+            reserved = prompt_tokens + 1000
 
-            full_response = ""
-
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
+            async for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    used = usage.prompt_tokens + usage.completion_tokens
+                if chunk.choices and chunk.choices[0].delta.content is not None:
                     content = chunk.choices[0].delta.content
                     full_response += content
                     message = json.dumps({"content": content}) + "\n"
                     yield message
 
-            self.conversations[user_id].append({
-                "role": "assistant",
-                "content": full_response
-            })
+            assistant_message = {"role": "assistant", "content": full_response}
+            self.conversations.append(user_id, *turn, assistant_message)
+            context.messages.append(assistant_message)
+            self._schedule_summary(user_id, context)
+            completed = True
 
         except Exception as e:
             error_message = json.dumps({"error": str(e)}) + "\n"
             yield error_message
-            raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+            raise HTTPException(status_code=500, detail=str(e))
+
+        finally:
+            # The reservation assumed the whole max_tokens reply; hand back what the turn did not use.
+            # Without a usage chunk (a server that ignores include_usage, or a stream cut short) the
+            # tokens streamed so far are counted here instead
+            if reserved:
+                if used is None:
+                    used = prompt_tokens + count_tokens([{"role": "assistant", "content": full_response}], self.window.model)
+                rate_limiter.for_model(self.window.model).settle(reserved, used)
+
+            # A turn that failed, or was cut short by the client disconnecting (CancelledError or
+            # GeneratorExit), has its user message in the chats table but not in the cached context.
+            # Reload it on the next turn so the context and summarized_count match the table again
+            if not completed:
+                self.conversations.invalidate(user_id)
+
+    def _schedule_summary(self, user_id: int, context: ChatContext):
+        """Fold older messages into the summary in the background, off the reply's critical path"""
+        count = self.window.foldable(context)
+        if not count or user_id in self._summarizing:
+            return
+        task = asyncio.create_task(self._summarize(user_id, context, count))
+        self._summarizing[user_id] = task
+        task.add_done_callback(lambda _: self._summarizing.pop(user_id, None))
+
+    async def _summarize(self, user_id: int, context: ChatContext, count: int):
+        transcript = "\n".join(
+            f"{'AI' if m['role'] == 'assistant' else 'Employee'}: {m['content']}"
+            for m in context.messages[:count]
+        )
+        messages = [{"role": "user", "content": SUMMARY_PROMPT.format(
+            summary=context.summary or "(none yet)",
+            transcript=transcript
+        )}]
+        reserved = count_tokens(messages, config.CHAT_SUMMARY_MODEL) + 500
+        try:
+            response = await call_with_retries_async(
+                config.CHAT_SUMMARY_MODEL,
+                reserved,
+                lambda: self.client.chat.completions.create(
+                    model=config.CHAT_SUMMARY_MODEL,
+                    messages=messages,
+                    temperature=0.2,
+                    max_tokens=500
+                )
+            )
+            if response.usage is not None:
+                rate_limiter.for_model(config.CHAT_SUMMARY_MODEL).settle(reserved, response.usage.total_tokens)
+            summary = response.choices[0].message.content.strip()
+            await asyncio.to_thread(save_summary, user_id, summary, context.summarized_count + count)
+            self.conversations.fold(user_id, context.summarized_count, count, summary)
+        except Exception as e:
+            print(f"Error summarizing conversation of user {user_id}: {str(e)}")
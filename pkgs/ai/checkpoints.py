@@ -0,0 +1,87 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Optional
+
+from db_engine import SessionLocal
+from pkgs.ai import instrumentation
+from db_models import PipelineCheckpoint as DbPipelineCheckpoint
+
+
+def input_hash(value: Any) -> str:
+    """sha256 of a JSON-serializable stage input"""
+    payload = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load(run_id: str, stage: str, stage_input_hash: str) -> Optional[Any]:
+    """Output of a completed stage of the run, if it was computed from the same input"""
+    with SessionLocal() as session:
+        checkpoint = (
+            session.query(DbPipelineCheckpoint)
+            .filter(DbPipelineCheckpoint.run_id == run_id)
+            .filter(DbPipelineCheckpoint.stage == stage)
+            .one_or_none()
+        )
+        if checkpoint is None or checkpoint.input_hash != stage_input_hash:
+            return None
+        return checkpoint.output
+
+
+def save(run_id: str, stage: str, stage_input_hash: str, output: Any):
+    with SessionLocal() as session:
+        checkpoint = (
+            session.query(DbPipelineCheckpoint)
+            .filter(DbPipelineCheckpoint.run_id == run_id)
+            .filter(DbPipelineCheckpoint.stage == stage)
+            .one_or_none()
+        )
+        if checkpoint is None:
+            checkpoint = DbPipelineCheckpoint(run_id=run_id, stage=stage)
+            session.add(checkpoint)
+        checkpoint.input_hash = stage_input_hash
+        checkpoint.output = output
+        checkpoint.created_at = datetime.now(timezone.utc)
+        session.commit()
+
+
+def clear(run_id: str):
+    """Drop the checkpoints of a run once its results are stored"""
+    with SessionLocal() as session:
+        session.query(DbPipelineCheckpoint).filter(
+            DbPipelineCheckpoint.run_id == run_id
+        ).delete(synchronize_session=False)
+        session.commit()
+
+
+def prune(max_age_seconds: int):
+    """Drop checkpoints of runs that were never completed or retried"""
+    try:
+        with SessionLocal() as session:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=max_age_seconds)
+            session.query(DbPipelineCheckpoint).filter(
+                DbPipelineCheckpoint.created_at < cutoff
+            ).delete(synchronize_session=False)
+            session.commit()
+    except Exception as e:
+        print(f"Error pruning pipeline checkpoints: {str(e)}")
+
+
+def run_stage(run_id: str, stage: str, stage_input: Any, compute: Callable[[], Any]) -> Any:
+    """
+    Return the checkpointed output of a stage for this run and input, or compute and checkpoint it.
+
+    A stage whose input changed since it was checkpointed (for example because new chats
+    arrived) is recomputed, which in turn changes the input of every later stage.
+    """
+    stage_input_hash = input_hash(stage_input)
+    output = load(run_id, stage, stage_input_hash)
+    if output is not None:
+        print(f"Resuming run {run_id} from the {stage} checkpoint")
+        with instrumentation.stage(stage, resumed=True):
+            return output
+
+    with instrumentation.stage(stage):
+        output = compute()
+    save(run_id, stage, stage_input_hash, output)
+    return output
@@ -0,0 +1,86 @@
+import threading
+from typing import Any, Dict, Tuple
+
+import httpx
+from llama_index.legacy.llms.openai import OpenAI
+
+import config
+from pkgs.ai.instrumentation import instrumented
+from pkgs.ai.llm_cache import cached
+from pkgs.ai.rate_limiter import limited
+
+
+class LLMClientRegistry:
+    """
+    Process-wide, thread-safe registry of the pipeline's LLM clients.
+
+    A client is built once per model, API key and settings and reused by every stage and run,
+    so the OpenAI SDK client behind it keeps its HTTP connections alive between calls instead of
+    opening new TCP and TLS sessions for every run. All clients share one pooled httpx.Client.
+    """
+
+    def __init__(self, max_connections: int, max_keepalive_connections: int, keepalive_expiry: float):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self._clients: Dict[Tuple, Any] = {}
+        self._http_client: httpx.Client | None = None
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def http_client(self) -> httpx.Client:
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(limits=self.limits, timeout=httpx.Timeout(60.0, connect=10.0))
+            return self._http_client
+
+    def get(self, model: str, api_key: str, **settings: Any) -> Any:
+        """The shared client of a model, wrapped for instrumentation, caching and rate limiting"""
+        if config.OPENAI_BASE_URL:
+            settings.setdefault("api_base", config.OPENAI_BASE_URL)
+        key = (model, api_key, tuple(sorted(settings.items())))
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is not None:
+                self.reused += 1
+                return llm
+        http_client = self.http_client()
+        with self._lock:
+            llm = self._clients.get(key)
+            if llm is None:
+                llm = self._clients[key] = instrumented(cached(limited(OpenAI(
+                    model=model,
+                    api_key=api_key,
+                    http_client=http_client,
+                    **settings
+                ))))
+                self.created += 1
+            else:
+                self.reused += 1
+            return llm
+
+    def clear(self):
+        """Drop every client and close the shared connection pool"""
+        with self._lock:
+            self._clients.clear()
+            http_client, self._http_client = self._http_client, None
+        if http_client is not None:
+            http_client.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"clients": len(self._clients), "created": self.created, "reused": self.reused}
+
+
+llm_clients = LLMClientRegistry(
+    max_connections=config.LLM_HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=config.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=config.LLM_HTTP_KEEPALIVE_SECONDS
+)
+
+
+def llm(model: str, api_key: str, **settings: Any) -> Any:
+    return llm_clients.get(model, api_key, **settings)
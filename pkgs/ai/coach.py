@@ -1,11 +1,53 @@
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Callable
+from concurrent.futures import ThreadPoolExecutor, Future
 from llama_index.legacy.llms.openai import OpenAI
-from random import randint
+from pkgs.ai import clients
+from pkgs.ai import instrumentation
+from pydantic import BaseModel, ValidationError, field_validator
+from random import Random
+import json
+import config
+
+# split: separate title and steps calls per item
+# combined: one JSON call per item returning both
+# batched: one JSON call per category covering all of its items
+GENERATION_MODES = ('split', 'combined', 'batched')
+
+
+class GeneratedActionPlan(BaseModel):
+    action_title: str
+    actions: List[str]
+
+    @field_validator('action_title')
+    @classmethod
+    def clean_title(cls, value: str) -> str:
+        value = value.strip().strip("'").strip('"').strip()
+        if not value:
+            raise ValueError('action_title is empty')
+        return value
+
+    @field_validator('actions')
+    @classmethod
+    def clean_actions(cls, value: List[str]) -> List[str]:
+        actions = [action.strip().removeprefix('ACTION:').strip() for action in value]
+        actions = [action for action in actions if action]
+        if not actions:
+            raise ValueError('actions is empty')
+        return actions
+
+
+class GeneratedActionPlans(BaseModel):
+    action_plans: List[GeneratedActionPlan]
 
 
 class FeedbackCoach:
-    def __init__(self, llm: OpenAI):
+    def __init__(self, llm: OpenAI, max_concurrency: int = config.COACH_MAX_CONCURRENCY,
+                 mode: str = config.COACH_GENERATION_MODE):
+        if mode not in GENERATION_MODES:
+            raise ValueError(f"Unknown coach generation mode '{mode}', expected one of {GENERATION_MODES}")
         self.llm = llm
+        self.max_concurrency = max_concurrency
+        self.mode = mode
 
     def transform_feedback(self, feedback_results: Dict[str, Dict[str, Dict[str, List[str]]]], employee_name: str) -> Dict[
         str, Dict[str, Dict[str, Dict[str, Any]]]]:
@@ -25,43 +67,112 @@ class FeedbackCoach:
             'manager': {'action_plans': {}}
         }
 
-        if 'employee' in feedback_results:
-            employee_insights = feedback_results['employee']['categorized_insights']
-            transformed_feedback['employee']['action_plans'] = self._generate_action_plans(
-                insights=employee_insights,
-                role_type='employee',
-                employee_name=employee_name
-            )
-
-        if 'manager' in feedback_results:
-            manager_insights = feedback_results['manager']['categorized_insights']
-            transformed_feedback['manager']['action_plans'] = self._generate_action_plans(
-                insights=manager_insights,
-                role_type='manager',
-                employee_name=employee_name
-            )
+        # Every title and steps call of both roles shares one bounded pool
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending = {}
+            for role_type in ('employee', 'manager'):
+                if role_type in feedback_results:
+                    pending[role_type] = self._submit_action_plans(
+                        executor=executor,
+                        insights=feedback_results[role_type]['categorized_insights'],
+                        role_type=role_type,
+                        employee_name=employee_name
+                    )
+
+            for role_type, futures in pending.items():
+                transformed_feedback[role_type]['action_plans'] = self._collect_action_plans(futures)
 
         return transformed_feedback
 
-    def _generate_action_plans(self, insights: Dict[str, List[str]], role_type: str, employee_name: str) -> Dict[
-        str, Dict[str, Any]]:
-        """Generate action titles and action steps for each category of insights"""
-        action_plans = {}
+    def _submit_action_plans(self, executor: ThreadPoolExecutor, insights: Dict[str, List[str]], role_type: str,
+                             employee_name: str) -> Dict[str, List[Callable[[], List[Dict[str, Any]]]]]:
+        """
+        Submit the LLM calls for every feedback item, keyed by category in input order.
+        Each category maps to collectors that wait for their calls and return the plans they cover.
+        """
         employee_name = employee_name.split(" ")[0]
 
-        # Generate random min and max action counts
-        min_actions = randint(2, 3)
-        max_actions = randint(4, 5)
+        # Generate random min and max action counts, seeded by the insights so that an unchanged
+        # input produces the same prompts and can be answered from the LLM cache
+        rng = Random(json.dumps([role_type, insights], sort_keys=True))
+        min_actions = rng.randint(2, 3)
+        max_actions = rng.randint(4, 5)
 
+        collectors = {}
         for category, feedback_items in insights.items():
             if not feedback_items:
                 continue
 
-            category_plans = []
-            for feedback in feedback_items:
-                # Customize prompts based on role type
-                if role_type == 'employee':
-                    title_prompt = f"""Based on this {category} feedback, generate a concise, specific action plan title (3-7 words).
+            if self.mode == 'split':
+                collectors[category] = [
+                    self._submit_split(executor, category, feedback, role_type, employee_name, min_actions, max_actions)
+                    for feedback in feedback_items
+                ]
+            else:
+                groups = [feedback_items] if self.mode == 'batched' else [[feedback] for feedback in feedback_items]
+                collectors[category] = [
+                    self._submit_structured(executor, category, group, role_type, employee_name, min_actions,
+                                            max_actions)
+                    for group in groups
+                ]
+
+        return collectors
+
+    def _collect_action_plans(self, collectors: Dict[str, List[Callable[[], List[Dict[str, Any]]]]]) -> Dict[
+        str, List[Dict[str, Any]]]:
+        """Wait for submitted calls and assemble the plans in the order they were submitted"""
+        return {
+            category: [plan for collect in category_collectors for plan in collect()]
+            for category, category_collectors in collectors.items()
+        }
+
+    def _submit_split(self, executor: ThreadPoolExecutor, category: str, feedback: str, role_type: str,
+                      employee_name: str, min_actions: int, max_actions: int) -> Callable[[], List[Dict[str, Any]]]:
+        """Submit separate title and steps calls for one feedback item"""
+        title_prompt, steps_prompt = self._build_prompts(
+            category, feedback, role_type, employee_name, min_actions, max_actions
+        )
+        title_future = instrumentation.submit(executor, self.llm.complete, title_prompt)
+        steps_future = instrumentation.submit(executor, self.llm.complete, steps_prompt)
+
+        def collect() -> List[Dict[str, Any]]:
+            return [{
+                'action_title': title_future.result().text.strip().strip("'").strip('"'),
+                'actions': self._parse_actions(steps_future.result().text)
+            }]
+
+        return collect
+
+    def _submit_structured(self, executor: ThreadPoolExecutor, category: str, feedback_items: List[str],
+                           role_type: str, employee_name: str, min_actions: int,
+                           max_actions: int) -> Callable[[], List[Dict[str, Any]]]:
+        """Submit one call answering title and steps for all given feedback items, falling back to split calls"""
+        prompt = self._build_structured_prompt(
+            category, feedback_items, role_type, employee_name, min_actions, max_actions
+        )
+        future = instrumentation.submit(executor, self.llm.complete, prompt)
+
+        def collect() -> List[Dict[str, Any]]:
+            plans = self._parse_action_plans(future.result().text, expected=len(feedback_items))
+            if plans is not None:
+                return plans
+
+            print(f"Falling back to split generation for {len(feedback_items)} {category} item(s)")
+            fallbacks = [
+                self._submit_split(executor, category, feedback, role_type, employee_name, min_actions, max_actions)
+                for feedback in feedback_items
+            ]
+            return [plan for collect_fallback in fallbacks for plan in collect_fallback()]
+
+        return collect
+
+    @staticmethod
+    def _build_prompts(category: str, feedback: str, role_type: str, employee_name: str, min_actions: int,
+                       max_actions: int) -> tuple[str, str]:
+        """Build the title and steps prompts for one feedback item"""
+        # Customize prompts based on role type
+        if role_type == 'employee':
+            title_prompt = f"""Based on this {category} feedback, generate a concise, specific action plan title (3-7 words).
     Write it from an informal perspective, as if you are the person who will take these actions. For example, say things like Improve Your Skills in X.
 
     Feedback: {feedback}
@@ -69,7 +180,7 @@ class FeedbackCoach:
     Respond with only the title on a single line. Example:
     'Enhance Your Cloud Computing Skills' or 'Improve Your Team Communication'"""
 
-                    steps_prompt = f"""Convert this {category} feedback into specific action steps. 
+            steps_prompt = f"""Convert this {category} feedback into specific action steps. 
     Write the steps from a first-person perspective, as actions you will take personally.
     Provide {min_actions}-{max_actions} clear, actionable steps for improvement.
 
@@ -93,8 +204,8 @@ class FeedbackCoach:
 
     Respond with only action steps, one per line, starting with 'ACTION:'. Be specific and concrete."""
 
-                else:  # manager
-                    title_prompt = f"""Based on this {category} feedback, generate a concise, specific action plan title (3-7 words) 
+        else:  # manager
+            title_prompt = f"""Based on this {category} feedback, generate a concise, specific action plan title (3-7 words) 
     for actions you as a manager will take regarding {employee_name}.
 
     Feedback: {feedback}
@@ -102,7 +213,7 @@ class FeedbackCoach:
     Respond with only the title on a single line. Example:
     'Review {employee_name}'s Task Distribution' or 'Support {employee_name}'s Skill Development'"""
 
-                    steps_prompt = f"""Convert this {category} feedback into specific action steps that you as a manager will take.
+            steps_prompt = f"""Convert this {category} feedback into specific action steps that you as a manager will take.
     Use {employee_name}'s name instead of saying "the employee".
     Provide {min_actions}-{max_actions} clear, actionable steps for improvement.
 
@@ -124,20 +235,63 @@ class FeedbackCoach:
 
     Respond with only action steps, one per line, starting with 'ACTION:'. Be specific and concrete."""
 
-                title_response = self.llm.complete(title_prompt)
-                action_title = title_response.text.strip().strip("'").strip('"')
+        return title_prompt, steps_prompt
 
-                steps_response = self.llm.complete(steps_prompt)
-                actions = self._parse_actions(steps_response.text)
+    @staticmethod
+    def _build_structured_prompt(category: str, feedback_items: List[str], role_type: str, employee_name: str,
+                                 min_actions: int, max_actions: int) -> str:
+        """Build one prompt asking for the title and steps of every given feedback item as JSON"""
+        feedback_list = "\n    ".join(f"Item {i + 1}: {item}" for i, item in enumerate(feedback_items))
 
-                category_plans.append({
-                    'action_title': action_title,
-                    'actions': actions
-                })
+        if role_type == 'employee':
+            guidance = f"""For each feedback item, create an action plan:
+    - action_title: a concise, specific title (3-7 words), written from an informal perspective, as if you are the
+      person who will take these actions. For example 'Enhance Your Cloud Computing Skills' or 'Improve Your Team Communication'
+    - actions: {min_actions}-{max_actions} clear, actionable steps, written as actions you will take personally.
+      Do not use the word 'my'. Use the word 'your' instead.
 
-            action_plans[category] = category_plans
+    IMPORTANT: Only suggest specific courses if the feedback explicitly mentions a desire or need for training/learning.
+    If and only if training is mentioned in the feedback, include a specific course recommendation with platform and instructor.
+    Focus on practical, hands-on actions that can be taken immediately rather than defaulting to formal training.
 
-        return action_plans
+    Example actions when training IS mentioned in feedback:
+    "Enroll in AWS Solutions Architect Professional by Adrian Cantrill on learn.cantrill.io"
+    "Apply new cloud architecture patterns in the current project redesign"
+
+    Example actions when training is NOT mentioned:
+    "Schedule weekly code reviews with senior developers"
+    "Document three key learnings from each project completion"
+    "Take the lead on the next client presentation"
+    """.rstrip()
+        else:  # manager
+            guidance = f"""For each feedback item, create an action plan for actions you as a manager will take regarding {employee_name}:
+    - action_title: a concise, specific title (3-7 words). For example 'Review {employee_name}'s Task Distribution'
+      or 'Support {employee_name}'s Skill Development'
+    - actions: {min_actions}-{max_actions} clear, actionable steps that you as a manager will take.
+      Use {employee_name}'s name instead of saying "the employee".
+
+    IMPORTANT: Only suggest specific courses if the feedback explicitly mentions a need for training/learning opportunities.
+    If and only if training is specifically relevant to the feedback, include a specific course recommendation.
+    Focus on actionable management steps rather than defaulting to training solutions.
+
+    Example actions when training IS mentioned in feedback:
+    "Enroll {employee_name} in Executive Leadership by Wharton Business School on Coursera"
+    "Create monthly mentoring sessions to reinforce leadership training concepts"
+
+    Example actions when training is NOT mentioned:
+    "Schedule bi-weekly 1:1s with {employee_name} to provide regular feedback"
+    "Assign {employee_name} as technical lead for the upcoming client project"
+    "Create opportunities for {employee_name} to mentor junior team members"
+    """.rstrip()
+
+        return f"""Convert this {category} feedback into action plans.
+    {guidance}
+
+    Feedback items:
+    {feedback_list}
+
+    Respond with only JSON, with exactly {len(feedback_items)} action plans in the same order as the feedback items:
+    {{"action_plans": [{{"action_title": "...", "actions": ["...", "..."]}}]}}"""
 
     def _parse_actions(self, response_text: str) -> List[str]:
         """Parse the LLM response into a list of action steps"""
@@ -152,12 +306,28 @@ class FeedbackCoach:
 
         return actions
 
-def run(feedback_results: Dict[str, Any], api_key: str, employee_name: str) -> Dict[str, Any]:
+    def _parse_action_plans(self, response_text: str, expected: int) -> List[Dict[str, Any]] | None:
+        """Validate a structured response against the action plan schema, None if it does not conform"""
+        start = response_text.find('{')
+        end = response_text.rfind('}')
+        if start == -1 or end == -1:
+            return None
+
+        try:
+            parsed = GeneratedActionPlans.model_validate_json(response_text[start:end + 1])
+        except ValidationError as e:
+            print(f"Invalid structured action plans: {str(e)}")
+            return None
+
+        if len(parsed.action_plans) != expected:
+            print(f"Expected {expected} action plans, got {len(parsed.action_plans)}")
+            return None
+
+        return [plan.model_dump() for plan in parsed.action_plans]
+
+def run(feedback_results: Dict[str, Any], api_key: str, employee_name: str, mode: str | None = None) -> Dict[str, Any]:
     """Process feedback results and generate action titles with action steps."""
-    coach = FeedbackCoach(OpenAI(
-        model="gpt-3.5-turbo",
-        api_key=api_key
-    ))
+    coach = FeedbackCoach(clients.llm("gpt-3.5-turbo", api_key), mode=mode or config.COACH_GENERATION_MODE)
 
     transformed_feedback = coach.transform_feedback(feedback_results, employee_name)
     return transformed_feedback
\ No newline at end of file
@@ -0,0 +1,177 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+# Rough per-message overhead of the dict and its keys, on top of the content itself
+MESSAGE_OVERHEAD_BYTES = 200
+
+
+@dataclass
+class ChatContext:
+    """
+    Chat context of one user.
+
+    messages holds the chats rows that are not folded into the summary yet, in order;
+    summarized_count is how many of the user's chats rows the summary covers.
+    """
+    messages: List[dict] = field(default_factory=list)
+    summary: Optional[str] = None
+    summarized_count: int = 0
+
+    def copy(self) -> "ChatContext":
+        return ChatContext(messages=list(self.messages), summary=self.summary, summarized_count=self.summarized_count)
+
+
+@dataclass
+class ConversationEntry:
+    """Cached chat context of one user"""
+    context: ChatContext
+    size: int
+    last_access: float = field(default_factory=time.monotonic)
+
+
+def estimate_size(messages: List[dict]) -> int:
+    return sum(sys.getsizeof(m.get("content", "")) + MESSAGE_OVERHEAD_BYTES for m in messages)
+
+
+def estimate_context_size(context: ChatContext) -> int:
+    return estimate_size(context.messages) + sys.getsizeof(context.summary or "")
+
+
+class ConversationStore:
+    """
+    Bounded LRU/TTL cache of chat contexts, rehydrated from the chats table on a miss.
+
+    Entries are evicted when idle for longer than ttl_seconds, or least recently used
+    first when either max_users or max_bytes is exceeded. Every message is persisted in
+    the chats table, or queued to be (pkgs/system/chat_writer.py, which /chat waits on
+    before a turn), so an evicted context is simply loaded again.
+    """
+
+    def __init__(self, loader: Callable[[int], ChatContext], max_users: int, max_bytes: int, ttl_seconds: int):
+        self.loader = loader
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, ConversationEntry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._user_locks: Dict[int, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def user_lock(self, user_id: int) -> threading.Lock:
+        """Lock serializing loads and updates of one user's context"""
+        with self._lock:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+
+    def get(self, user_id: int) -> ChatContext:
+        """Return a copy of the user's context, loading it from the database on a miss"""
+        with self.user_lock(user_id):
+            with self._lock:
+                self._evict_expired()
+                entry = self._entries.get(user_id)
+                if entry is not None:
+                    self.hits += 1
+                    self._touch(user_id, entry)
+                    return entry.context.copy()
+                self.misses += 1
+
+            # Load outside the store lock so other users are not blocked on the database
+            context = self.loader(user_id)
+
+            with self._lock:
+                self._put(user_id, context.copy())
+            return context
+
+    def append(self, user_id: int, *messages: dict) -> None:
+        """Append messages to a cached context. A context that is not cached is left alone,
+        it will be loaded with these messages from the database on the next get."""
+        with self.user_lock(user_id):
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is None:
+                    return
+                entry.context.messages.extend(messages)
+                added = estimate_size(list(messages))
+                entry.size += added
+                self._bytes += added
+                self._touch(user_id, entry)
+                self._evict_over_capacity()
+
+    def fold(self, user_id: int, base_count: int, count: int, summary: str) -> None:
+        """Replace the first count messages of a cached context with an updated summary.
+        base_count is the summarized_count the summary was built on; a context that has
+        moved on since then is left alone."""
+        with self.user_lock(user_id):
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is None or entry.context.summarized_count != base_count:
+                    return
+                context = entry.context
+                self._put(user_id, ChatContext(
+                    messages=context.messages[count:],
+                    summary=summary,
+                    summarized_count=context.summarized_count + count
+                ))
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._remove(user_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    # The helpers below expect self._lock to be held
+
+    def _put(self, user_id: int, context: ChatContext) -> None:
+        self._remove(user_id)
+        entry = ConversationEntry(context=context, size=estimate_context_size(context))
+        self._entries[user_id] = entry
+        self._bytes += entry.size
+        self._evict_over_capacity()
+
+    def _touch(self, user_id: int, entry: ConversationEntry) -> None:
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(user_id)
+
+    def _remove(self, user_id: int) -> bool:
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+        self._bytes -= entry.size
+        lock = self._user_locks.get(user_id)
+        if lock is not None and not lock.locked():
+            del self._user_locks[user_id]
+        return True
+
+    def _evict_expired(self) -> None:
+        deadline = time.monotonic() - self.ttl_seconds
+        # Entries are kept in access order, so expired ones are at the front
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if entry.last_access > deadline:
+                break
+            self._remove(user_id)
+            self.evictions += 1
+
+    def _evict_over_capacity(self) -> None:
+        # Always keep the most recently used entry, even if it alone exceeds max_bytes
+        while len(self._entries) > 1 and (len(self._entries) > self.max_users or self._bytes > self.max_bytes):
+            user_id = next(iter(self._entries))
+            self._remove(user_id)
+            self.evictions += 1
@@ -1,5 +1,6 @@
 from typing import List, Dict
 from llama_index.legacy.llms.openai import OpenAI
+from pkgs.ai import clients
 
 
 class EmployeeInsightsCategorizer:
@@ -182,10 +183,7 @@ def run(feedback_items: List[str], api_key: str) -> Dict:
         Dict: Categorized feedback
     """
     try:
-        categorizer = EmployeeInsightsCategorizer(OpenAI(
-            model="gpt-4",
-            api_key=api_key
-        ))
+        categorizer = EmployeeInsightsCategorizer(clients.llm("gpt-4", api_key))
 
         categorized_feedback = categorizer.categorize_insights(feedback_items)
 
@@ -4,6 +4,7 @@ from typing import List, Dict
 from dataclasses import dataclass
 
 from llama_index.legacy.llms.openai import OpenAI
+from pkgs.ai import clients
 
 
 @dataclass
@@ -76,7 +77,7 @@ class FeedbackAnalyzer:
         return findings or self.generate_fallback_findings()
 
     @staticmethod
-    def generate_fallback_findings(self) -> List[Finding]:
+    def generate_fallback_findings() -> List[Finding]:
         """Generate fallback findings if parsing fails"""
         return [Finding(
             insight="Unable to extract feedback"
@@ -85,10 +86,7 @@ class FeedbackAnalyzer:
 
 class FeedbackExtractionAgent:
     def __init__(self, api_key: str):
-        self.llm = OpenAI(
-            model="gpt-4",
-            api_key=api_key
-        )
+        self.llm = clients.llm("gpt-4", api_key)
         self.analyzer = FeedbackAnalyzer(self.llm)
 
     def process_conversation(self, conversation: List[Dict]) -> List[Finding]:
@@ -109,8 +107,8 @@ class FeedbackExtractionAgent:
 
         return report
 
-def get_user_conversation(user_id: int, session) -> list[ChatMessage]:
-    return system_queries.get_user_conversation(user_id, session)
+def get_user_conversation(user_id: int, session, after_id: int = 0) -> list[ChatMessage]:
+    return system_queries.get_user_chat_history(user_id, session, after_id=after_id)
 
 def format_user_conversation(conversation_data: list[ChatMessage]):
     if not conversation_data:
@@ -125,13 +123,26 @@ def format_user_conversation(conversation_data: list[ChatMessage]):
     ]
     return formatted_data
 
-def run(*, user_id: int, api_key: str, session):
-    conversation = get_user_conversation(user_id, session)
+def run(*, user_id: int, api_key: str, session, since_chat_id: int = 0, conversation: list[ChatMessage] | None = None):
+    """
+    Extract feedback from the chats of a user with an id above since_chat_id.
+
+    The result carries last_chat_id, the highest chat id covered, to be stored as the
+    user's watermark once the findings are saved. An already loaded conversation can be
+    passed in instead of reading it from the session.
+    """
+    if conversation is None:
+        conversation = get_user_conversation(user_id, session, after_id=since_chat_id)
+    result = dict()
+    result["user_id"] = user_id
+    result["last_chat_id"] = conversation[-1].id if conversation else since_chat_id
+    result["feedback"] = []
+
     formatted_conversation = format_user_conversation(conversation)
+    if not any(entry["from"] == "employee" for entry in formatted_conversation.get("conversation", [])):
+        return result
+
     agent = FeedbackExtractionAgent(api_key=api_key)
     findings = agent.process_conversation(formatted_conversation['conversation'])
-    report = agent.generate_report(findings)
-    result = dict()
-    result["user_id"] = formatted_conversation["user_id"]
-    result["feedback"] = report
-    return result
\ No newline at end of file
+    result["feedback"] = agent.generate_report(findings)
+    return result
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from typing import List, Dict
 from llama_index.legacy.llms.openai import OpenAI
+from pkgs.ai import clients
 
 
 class FeedbackRoutingAgent:
@@ -103,10 +104,7 @@ class FeedbackRoutingAgent:
 
 class FeedbackProcessor:
     def __init__(self, api_key: str):
-        self.llm = OpenAI(
-            model="gpt-4",
-            api_key=api_key
-        )
+        self.llm = clients.llm("gpt-4", api_key)
         self.router = FeedbackRoutingAgent(self.llm)
 
     def process_feedback(self, feedback_data: Dict) -> Dict:
@@ -0,0 +1,212 @@
+import contextvars
+import time
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from threading import Lock
+from typing import Any, Callable, Dict, Optional
+
+from pkgs.system.metrics import registry
+
+STAGE_SECONDS = registry.histogram(
+    "pipeline_stage_seconds", "Wall time of a pipeline stage", ["stage"]
+)
+RUN_SECONDS = registry.histogram(
+    "pipeline_run_seconds", "Wall time of a pipeline run", ["status"]
+)
+LLM_CALL_SECONDS = registry.histogram(
+    "llm_call_seconds", "Wall time of an LLM call, excluding queue wait", ["stage", "model"]
+)
+LLM_QUEUE_WAIT_SECONDS = registry.histogram(
+    "llm_queue_wait_seconds", "Time an LLM call waited for a worker thread", ["stage", "model"]
+)
+LLM_CALLS = registry.counter(
+    "llm_calls_total", "LLM calls by outcome (ok, cached or error)", ["stage", "model", "outcome"]
+)
+LLM_TOKENS = registry.counter(
+    "llm_tokens_total", "Tokens used by LLM calls", ["stage", "model", "kind"]
+)
+LLM_RETRIES = registry.counter(
+    "llm_retries_total", "Retried LLM requests", ["stage", "model"]
+)
+
+_current_run: contextvars.ContextVar[Optional["RunRecorder"]] = contextvars.ContextVar("current_run", default=None)
+_current_stage: contextvars.ContextVar[str] = contextvars.ContextVar("current_stage", default="none")
+_queue_wait: contextvars.ContextVar[float] = contextvars.ContextVar("queue_wait", default=0.0)
+
+
+@dataclass
+class StageSummary:
+    wall_seconds: float = 0.0
+    resumed: bool = False
+    llm_calls: int = 0
+    cached_calls: int = 0
+    failed_calls: int = 0
+    llm_seconds: float = 0.0
+    queue_wait_seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    models: Dict[str, int] = field(default_factory=dict)
+
+
+class RunRecorder:
+    """Collects the per-stage summary of one pipeline run"""
+
+    def __init__(self, run_id: str, user_id: int):
+        self.run_id = run_id
+        self.user_id = user_id
+        self.started = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.status = "running"
+        self.stages: Dict[str, StageSummary] = {}
+        self._lock = Lock()
+
+    def stage(self, name: str) -> StageSummary:
+        with self._lock:
+            return self.stages.setdefault(name, StageSummary())
+
+    def record_llm_call(self, stage: str, model: str, seconds: float, queue_wait: float, prompt_tokens: int,
+                        completion_tokens: int, cached: bool, failed: bool):
+        with self._lock:
+            summary = self.stages.setdefault(stage, StageSummary())
+            summary.llm_calls += 1
+            summary.cached_calls += int(cached)
+            summary.failed_calls += int(failed)
+            summary.llm_seconds += seconds
+            summary.queue_wait_seconds += queue_wait
+            summary.prompt_tokens += prompt_tokens
+            summary.completion_tokens += completion_tokens
+            summary.models[model] = summary.models.get(model, 0) + 1
+
+    def record_retry(self, stage: str):
+        with self._lock:
+            self.stages.setdefault(stage, StageSummary()).retries += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            stages = {
+                name: {key: round(value, 3) if isinstance(value, float) else value for key, value in vars(stage).items()}
+                for name, stage in self.stages.items()
+            }
+        return {
+            "run_id": self.run_id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "llm_calls": sum(stage["llm_calls"] for stage in stages.values()),
+            "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages.values()),
+            "completion_tokens": sum(stage["completion_tokens"] for stage in stages.values()),
+            "stages": stages,
+        }
+
+
+@contextmanager
+def record_run(run_id: str, user_id: int):
+    """Collect a RunRecorder for everything the pipeline does inside this block"""
+    recorder = RunRecorder(run_id, user_id)
+    token = _current_run.set(recorder)
+    try:
+        yield recorder
+        recorder.status = "succeeded"
+    except BaseException:
+        recorder.status = "failed"
+        raise
+    finally:
+        recorder.wall_seconds = time.perf_counter() - recorder.started
+        RUN_SECONDS.observe(recorder.wall_seconds, status=recorder.status)
+        _current_run.reset(token)
+
+
+@contextmanager
+def stage(name: str, resumed: bool = False):
+    """Time a pipeline stage and attribute the LLM calls made inside it to the stage"""
+    token = _current_stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _current_stage.reset(token)
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        recorder = _current_run.get()
+        if recorder is not None:
+            summary = recorder.stage(name)
+            summary.wall_seconds += elapsed
+            summary.resumed = summary.resumed or resumed
+
+
+def submit(executor: Executor, fn: Callable, *args, **kwargs) -> Future:
+    """
+    executor.submit that carries the current run and stage into the worker thread and
+    records how long the task waited for a free worker.
+    """
+    context = contextvars.copy_context()
+    submitted = time.perf_counter()
+
+    def run():
+        _queue_wait.set(time.perf_counter() - submitted)
+        return fn(*args, **kwargs)
+
+    return executor.submit(context.run, run)
+
+
+def record_retry(model: str):
+    stage_name = _current_stage.get()
+    LLM_RETRIES.inc(stage=stage_name, model=model)
+    recorder = _current_run.get()
+    if recorder is not None:
+        recorder.record_retry(stage_name)
+
+
+def response_usage(response) -> tuple[int, int]:
+    raw = getattr(response, "raw", None)
+    usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+    if usage is None:
+        return 0, 0
+    if isinstance(usage, dict):
+        return usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+class InstrumentedLLM:
+    """Wraps an LLM so every complete() call is timed and its token usage recorded"""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+    def complete(self, prompt: str, **kwargs: Any):
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        stage_name = _current_stage.get()
+        queue_wait = _queue_wait.get()
+        # Only the first call of a worker task waited in the queue
+        _queue_wait.set(0.0)
+
+        started = time.perf_counter()
+        response = None
+        try:
+            response = self.llm.complete(prompt, **kwargs)
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            cached = bool(response is not None and (response.additional_kwargs or {}).get("cached"))
+            prompt_tokens, completion_tokens = response_usage(response) if response is not None else (0, 0)
+            outcome = "error" if response is None else "cached" if cached else "ok"
+
+            LLM_CALLS.inc(stage=stage_name, model=model, outcome=outcome)
+            LLM_CALL_SECONDS.observe(elapsed, stage=stage_name, model=model)
+            LLM_QUEUE_WAIT_SECONDS.observe(queue_wait, stage=stage_name, model=model)
+            LLM_TOKENS.inc(prompt_tokens, stage=stage_name, model=model, kind="prompt")
+            LLM_TOKENS.inc(completion_tokens, stage=stage_name, model=model, kind="completion")
+
+            recorder = _current_run.get()
+            if recorder is not None:
+                recorder.record_llm_call(stage_name, model, elapsed, queue_wait, prompt_tokens, completion_tokens,
+                                         cached=cached, failed=response is None)
+
+
+def instrumented(llm):
+    return InstrumentedLLM(llm)
@@ -0,0 +1,225 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import config
+from db_engine import SessionLocal
+from db_models import PipelineJob as DbPipelineJob
+from db_models import PipelineBatch as DbPipelineBatch
+from pkgs.ai import pipeline, checkpoints, instrumentation
+from pkgs.system import actions as system_actions
+from pkgs.system import queries as system_queries
+
+
+class RunBudget:
+    """
+    Admits pipeline runs under a global requests-per-minute and tokens-per-minute budget.
+
+    A run reserves its expected OpenAI usage before it starts and waits while the reservations
+    of the last 60 seconds leave no room for it. Once the run finishes its reservation is
+    corrected to the usage it actually recorded, and the expected usage of later runs follows
+    a moving average of measured runs. A limit of 0 disables that limit.
+    """
+
+    WINDOW_SECONDS = 60.0
+    # Weight of the newest run in the moving average of run usage
+    SMOOTHING = 0.2
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, estimated_requests: int,
+                 estimated_tokens: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.estimated_requests = float(estimated_requests)
+        self.estimated_tokens = float(estimated_tokens)
+        self._reservations: deque = deque()  # [started_at, requests, tokens]
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def acquire(self) -> list | None:
+        """
+        Block until the expected usage of one run fits the budget, returns the reservation.
+        Returns None once the budget is closed.
+        """
+        with self._condition:
+            while not self._closed:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_seconds(now)
+                if wait <= 0:
+                    reservation = [now, self.estimated_requests, self.estimated_tokens]
+                    self._reservations.append(reservation)
+                    return reservation
+                self._condition.wait(timeout=wait)
+            return None
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def settle(self, reservation: list, requests: int, tokens: int, measured: bool = True):
+        """Replace a reservation's estimate with the usage the run recorded"""
+        with self._condition:
+            reservation[1] = requests
+            reservation[2] = tokens
+            if measured:
+                self.estimated_requests += self.SMOOTHING * (requests - self.estimated_requests)
+                self.estimated_tokens += self.SMOOTHING * (tokens - self.estimated_tokens)
+            self._condition.notify_all()
+
+    def usage(self) -> Tuple[float, float]:
+        """Requests and tokens reserved in the current window"""
+        with self._condition:
+            self._expire(time.monotonic())
+            return sum(r[1] for r in self._reservations), sum(r[2] for r in self._reservations)
+
+    def _expire(self, now: float):
+        while self._reservations and now - self._reservations[0][0] >= self.WINDOW_SECONDS:
+            self._reservations.popleft()
+
+    def _wait_seconds(self, now: float) -> float:
+        # A run is always admitted into an empty window, even if it alone is over budget
+        if not self._reservations:
+            return 0.0
+        requests = sum(r[1] for r in self._reservations)
+        tokens = sum(r[2] for r in self._reservations)
+        over_requests = self.requests_per_minute and requests + self.estimated_requests > self.requests_per_minute
+        over_tokens = self.tokens_per_minute and tokens + self.estimated_tokens > self.tokens_per_minute
+        if not over_requests and not over_tokens:
+            return 0.0
+        # Room opens up when the oldest reservation leaves the window, or earlier on a settle()
+        return self._reservations[0][0] + self.WINDOW_SECONDS - now
+
+
+class PipelineJobQueue:
+    """
+    Runs pipeline jobs on a bounded pool of worker threads.
+
+    Jobs are rows in the pipeline_jobs table, so their status can be polled and queued work
+    survives a restart: resume() picks up queued jobs and running jobs that went stale.
+    A user has at most one queued or running job; submitting again returns that job.
+    Every run first waits for room in the shared RunBudget, so a batch of hundreds of users
+    is spread out under the OpenAI quota rather than all starting at once.
+
+    Each job runs under a run id that keys its stage checkpoints. A job submitted after the
+    user's previous job failed takes over that job's run id, so it resumes from the last
+    stage the failed run completed.
+    """
+
+    def __init__(self, max_workers: int, stale_seconds: int, budget: RunBudget):
+        self.max_workers = max_workers
+        self.stale_seconds = stale_seconds
+        self.budget = budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, int] = {}  # user_id -> job_id
+
+    def submit(self, user_id: int, user_name: str, batch_id: int | None = None) -> DbPipelineJob:
+        with self._lock, SessionLocal() as session:
+            return self._submit(user_id, user_name, batch_id, session)
+
+    def submit_batch(self, users: List[Tuple[int, str]]) -> DbPipelineBatch:
+        """Queue a job for each (user_id, user_name) under one batch whose progress can be polled"""
+        with self._lock, SessionLocal() as session:
+            batch = system_actions.create_pipeline_batch(len(users), session)
+            for user_id, user_name in users:
+                self._submit(user_id, user_name, batch.id, session)
+            # Queuing the jobs committed the session and expired the batch
+            session.refresh(batch)
+            session.expunge(batch)
+            return batch
+
+    def _submit(self, user_id: int, user_name: str, batch_id: int | None, session) -> DbPipelineJob:
+        # Expects self._lock to be held
+        # Other workers share the table, so look there as well as in this process
+        job = system_queries.get_active_pipeline_job(user_id, session)
+        if job is None:
+            previous = system_queries.get_latest_pipeline_job(user_id, session)
+            run_id = previous.run_id if previous and previous.status == "failed" and previous.run_id else None
+            job = system_actions.create_pipeline_job(user_id, user_name, run_id or uuid.uuid4().hex, session,
+                                                     batch_id=batch_id)
+            self._enqueue(job.id, user_id, user_name, job.run_id)
+        elif batch_id is not None and job.batch_id is None:
+            # Count the job that is already on its way towards the batch
+            system_actions.set_pipeline_job_batch(job.id, batch_id, session)
+        session.expunge(job)
+        return job
+
+    def resume(self) -> int:
+        """Requeue jobs left behind by a previous process, returns how many were requeued"""
+        checkpoints.prune(config.PIPELINE_CHECKPOINT_TTL_SECONDS)
+        with self._lock, SessionLocal() as session:
+            jobs = system_queries.get_resumable_pipeline_jobs(self.stale_seconds, session)
+            for job in jobs:
+                if job.user_id not in self._in_flight:
+                    self._enqueue(job.id, job.user_id, job.user_name, job.run_id or f"job-{job.id}")
+            return len(jobs)
+
+    def shutdown(self):
+        # Jobs still queued stay queued in the table and are resumed on the next start
+        self.budget.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _enqueue(self, job_id: int, user_id: int, user_name: str, run_id: str):
+        # Expects self._lock to be held
+        self._in_flight[user_id] = job_id
+        self._executor.submit(self._run, job_id, user_id, user_name, run_id)
+
+    def _run(self, job_id: int, user_id: int, user_name: str, run_id: str):
+        reservation = None
+        summary = None
+        try:
+            # The job stays queued while it waits for budget
+            reservation = self.budget.acquire()
+            if reservation is None:
+                return
+            with SessionLocal() as session:
+                if not system_actions.claim_pipeline_job(job_id, self.stale_seconds, session):
+                    return
+
+            error = None
+            recorder = None
+            try:
+                with instrumentation.record_run(run_id, user_id) as recorder:
+                    pipeline.run_pipeline(user_id, user_name, os.environ["OPENAI_API_KEY"], run_id=run_id)
+            except Exception as e:
+                print(f"Pipeline job {job_id} for user {user_id} failed: {str(e)}")
+                error = str(e) or type(e).__name__
+
+            summary = recorder.summary() if recorder else None
+            if summary:
+                print(f"Pipeline job {job_id}: {summary['status']} in {summary['wall_seconds']}s, "
+                      f"{summary['llm_calls']} LLM calls, "
+                      f"{summary['prompt_tokens'] + summary['completion_tokens']} tokens")
+
+            with SessionLocal() as session:
+                system_actions.finish_pipeline_job(job_id, error, summary, session)
+        except Exception as e:
+            print(f"Error updating pipeline job {job_id}: {str(e)}")
+        finally:
+            if reservation is not None:
+                # Cached completions cost nothing against the quota
+                requests = (summary["llm_calls"] - sum(stage["cached_calls"] for stage in summary["stages"].values())
+                            if summary else 0)
+                tokens = summary["prompt_tokens"] + summary["completion_tokens"] if summary else 0
+                # Runs that found nothing to do would drag the estimate for real runs down
+                self.budget.settle(reservation, requests, tokens, measured=requests > 0)
+            with self._lock:
+                if self._in_flight.get(user_id) == job_id:
+                    del self._in_flight[user_id]
+
+
+pipeline_jobs = PipelineJobQueue(
+    max_workers=config.PIPELINE_MAX_WORKERS,
+    stale_seconds=config.PIPELINE_JOB_STALE_SECONDS,
+    budget=RunBudget(
+        requests_per_minute=config.PIPELINE_REQUESTS_PER_MINUTE,
+        tokens_per_minute=config.PIPELINE_TOKENS_PER_MINUTE,
+        estimated_requests=config.PIPELINE_RUN_ESTIMATED_REQUESTS,
+        estimated_tokens=config.PIPELINE_RUN_ESTIMATED_TOKENS
+    )
+)
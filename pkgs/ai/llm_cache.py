@@ -0,0 +1,216 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from llama_index.legacy.llms import CompletionResponse
+from sqlalchemy import func
+
+import config
+from db_engine import SessionLocal
+from db_models import LlmCacheEntry as DbLlmCacheEntry
+from pkgs.system.metrics import registry
+
+LLM_CACHE_REQUESTS = registry.counter(
+    "llm_cache_requests_total", "LLM completion cache lookups per tier", ["tier", "result"]
+)
+LLM_CACHE_SIZE = registry.gauge(
+    "llm_cache_entries", "LLM completion cache entries per tier, the persistent one as of its last prune", ["tier"]
+)
+
+# Prune the persistent tier after this many writes
+PRUNE_EVERY = 100
+
+
+def cache_key(model: str, prompt: str, params: Dict[str, Any]) -> str:
+    """Content address of a completion: sha256 of the model, prompt and sampling parameters"""
+    payload = json.dumps({"model": model, "prompt": prompt, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM completions.
+
+    The memory tier is a per-process LRU; the persistent tier is the llm_cache table, shared by
+    every worker and surviving restarts. Entries in both tiers expire after ttl_seconds, and each
+    tier is trimmed to its own maximum number of entries, oldest first.
+    """
+
+    def __init__(self, max_entries: int, max_persistent_entries: int, ttl_seconds: int, persistent: bool):
+        self.max_entries = max_entries
+        self.max_persistent_entries = max_persistent_entries
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        # Rows of the llm_cache table counted by the last prune, None before the first
+        self.persistent_entries: Optional[int] = None
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                text, stored_at = entry
+                if time.monotonic() - stored_at < self.ttl_seconds:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    LLM_CACHE_REQUESTS.inc(tier="memory", result="hit")
+                    return text
+                del self._entries[key]
+        LLM_CACHE_REQUESTS.inc(tier="memory", result="miss")
+
+        text = self._get_persistent(key) if self.persistent else None
+        if self.persistent:
+            LLM_CACHE_REQUESTS.inc(tier="persistent", result="miss" if text is None else "hit")
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.persistent_hits += 1
+            self._put(key, text)
+        return text
+
+    def set(self, key: str, model: str, text: str) -> None:
+        with self._lock:
+            self._put(key, text)
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if self.persistent:
+            self._set_persistent(key, model, text)
+            if prune:
+                self.prune()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "persistent_entries": self.persistent_entries or 0,
+            }
+
+    def prune(self) -> None:
+        """Drop expired rows from the persistent tier and trim it to max_persistent_entries"""
+        try:
+            with SessionLocal() as session:
+                cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+                session.query(DbLlmCacheEntry).filter(
+                    DbLlmCacheEntry.created_at < cutoff
+                ).delete(synchronize_session=False)
+
+                count = session.query(func.count(DbLlmCacheEntry.key)).scalar()
+                if count > self.max_persistent_entries:
+                    oldest = (
+                        session.query(DbLlmCacheEntry.key)
+                        .order_by(DbLlmCacheEntry.created_at)
+                        .limit(count - self.max_persistent_entries)
+                    )
+                    session.query(DbLlmCacheEntry).filter(
+                        DbLlmCacheEntry.key.in_(oldest.scalar_subquery())
+                    ).delete(synchronize_session=False)
+                session.commit()
+                self.persistent_entries = min(count, self.max_persistent_entries)
+        except Exception as e:
+            print(f"Error pruning LLM cache: {str(e)}")
+
+    def _put(self, key: str, text: str) -> None:
+        # Expects self._lock to be held
+        self._entries[key] = (text, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_persistent(self, key: str) -> Optional[str]:
+        try:
+            with SessionLocal() as session:
+                entry = session.get(DbLlmCacheEntry, key)
+                if entry is None:
+                    return None
+                created_at = entry.created_at
+                if created_at.tzinfo is None:
+                    created_at = created_at.replace(tzinfo=timezone.utc)
+                age = datetime.now(timezone.utc) - created_at
+                if age.total_seconds() >= self.ttl_seconds:
+                    return None
+                return entry.response
+        except Exception as e:
+            print(f"Error reading LLM cache: {str(e)}")
+            return None
+
+    def _set_persistent(self, key: str, model: str, text: str) -> None:
+        try:
+            with SessionLocal() as session:
+                session.merge(DbLlmCacheEntry(
+                    key=key,
+                    model=model,
+                    response=text,
+                    created_at=datetime.now(timezone.utc)
+                ))
+                session.commit()
+        except Exception as e:
+            print(f"Error writing LLM cache: {str(e)}")
+
+
+class CachedLLM:
+    """
+    Wraps a llama_index LLM so that complete() is answered from the cache when the same
+    model, prompt and sampling parameters were seen before. Everything else is delegated.
+    """
+
+    def __init__(self, llm, cache: LLMCache):
+        self.llm = llm
+        self.cache = cache
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+    def sampling_params(self, **kwargs: Any) -> Dict[str, Any]:
+        return {
+            "temperature": getattr(self.llm, "temperature", None),
+            "max_tokens": getattr(self.llm, "max_tokens", None),
+            "additional_kwargs": getattr(self.llm, "additional_kwargs", None),
+            **kwargs,
+        }
+
+    def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        key = cache_key(model, prompt, self.sampling_params(**kwargs))
+
+        text = self.cache.get(key)
+        if text is not None:
+            return CompletionResponse(text=text, additional_kwargs={"cached": True})
+
+        response = self.llm.complete(prompt, **kwargs)
+        self.cache.set(key, model, response.text)
+        return response
+
+
+llm_cache = LLMCache(
+    max_entries=config.LLM_CACHE_MAX_ENTRIES,
+    max_persistent_entries=config.LLM_CACHE_MAX_PERSISTENT_ENTRIES,
+    ttl_seconds=config.LLM_CACHE_TTL_SECONDS,
+    persistent=config.LLM_CACHE_PERSISTENT
+)
+LLM_CACHE_SIZE.set_function(lambda: llm_cache.stats()["entries"], tier="memory")
+if llm_cache.persistent:
+    LLM_CACHE_SIZE.set_function(lambda: llm_cache.persistent_entries or 0, tier="persistent")
+
+
+def cached(llm):
+    """Route an LLM's completions through the shared cache, unless caching is disabled"""
+    if not config.LLM_CACHE_ENABLED:
+        return llm
+    return CachedLLM(llm, llm_cache)
@@ -1,5 +1,6 @@
 from typing import List, Dict
 from llama_index.legacy.llms.openai import OpenAI
+from pkgs.ai import clients
 
 
 class ManagerInsightsCategorizer:
@@ -181,10 +182,7 @@ def run(feedback_items: List[str], api_key: str) -> Dict:
         Dict: Categorized feedback
     """
     try:
-        categorizer = ManagerInsightsCategorizer(OpenAI(
-            model="gpt-3.5-turbo",
-            api_key=api_key
-        ))
+        categorizer = ManagerInsightsCategorizer(clients.llm("gpt-3.5-turbo", api_key))
 
         categorized_feedback = categorizer.categorize_insights(feedback_items)
 
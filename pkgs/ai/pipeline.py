@@ -1,16 +1,42 @@
 from pkgs.ai import feedback_identifier, feedback_router, manager_insights_categorizer, employee_insights_categorizer, coach
+from pkgs.ai import checkpoints, instrumentation
 from pprint import pprint
 from db_engine import SessionLocal
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, List
-from pkgs.system.actions import plan_of_actions
+from pkgs.system.actions import plan_of_actions, merge_plan_of_actions, set_pipeline_watermark
+from pkgs.system import queries as system_queries
+from pydantic_models import EmployeeActionItems as PydanticEmployeeActionItems
+from pydantic_models import CategoryGroup as PydanticCategoryGroup
+from pydantic_models import ActionPlan as PydanticActionPlan
 import json
+import uuid
+import config
+
+
+def to_category_groups(action_plans: Dict[str, List[Dict[str, Any]]]) -> List[PydanticCategoryGroup]:
+    """Category groups of newly generated action plans, every item pending review"""
+    return [
+        PydanticCategoryGroup(
+            category=category,
+            action_items=[
+                PydanticActionPlan(
+                    action_title=item['action_title'],
+                    action_status="pending review",
+                    action_plan=item['actions'],
+                    progress_notes=[]
+                )
+                for item in items
+            ]
+        )
+        for category, items in action_plans.items()
+    ]
 
 
-def transform_pipeline_results(pipeline_results: Dict[str, Any], user_id: int, user_name: str) -> Dict[str, Any]:
+def transform_pipeline_results(pipeline_results: Dict[str, Any], user_id: int, user_name: str) -> Dict[str, PydanticEmployeeActionItems]:
     """
-    Transform pipeline results into a standardized format with separated employee and manager action items.
-    Both employee and manager sections maintain the same structure with user_id, name, and categorized_action_items.
+    Transform pipeline results into the employee's and the manager's action items.
+    The models are validated here once and stored as they are by pkgs/system/actions.plan_of_actions.
 
     Args:
         pipeline_results: Results from the feedback pipeline
@@ -18,69 +44,23 @@ def transform_pipeline_results(pipeline_results: Dict[str, Any], user_id: int, u
         user_name: Name of the user
 
     Returns:
-        Dict containing separated employee and manager data, each with their own user info and categorized action items
+        Dict with the employee and manager EmployeeActionItems, both reported under the user
     """
-    # Initialize the output structure
-    transformed_results = {
-        "employee": {
-            "user_id": user_id,
-            "name": user_name,
-            "categorized_action_items": []
-        },
-        "manager": {
-            "user_id": user_id,  # Using same user_id for manager section as it relates to the employee
-            "name": user_name,  # Using same name for manager section as it relates to the employee
-            "categorized_action_items": []
-        }
+    return {
+        audience: PydanticEmployeeActionItems(
+            user_id=user_id,
+            name=user_name,
+            categorized_action_items=to_category_groups(pipeline_results.get(audience, {}).get('action_plans', {}))
+        )
+        for audience in ("employee", "manager")
     }
 
-    # Process employee action plans
-    if 'employee' in pipeline_results and 'action_plans' in pipeline_results['employee']:
-        for category, items in pipeline_results['employee']['action_plans'].items():
-            category_entry = {
-                "category": category,
-                "action_items": []
-            }
-
-            for item in items:
-                action_item = {
-                    "action_title": item['action_title'],
-                    "action_status": "pending review",
-                    "action_plan": item['actions'],
-                    "progress_notes": []
-                }
-                category_entry["action_items"].append(action_item)
-
-            transformed_results["employee"]["categorized_action_items"].append(category_entry)
-
-    # Process manager action plans
-    if 'manager' in pipeline_results and 'action_plans' in pipeline_results['manager']:
-        for category, items in pipeline_results['manager']['action_plans'].items():
-            category_entry = {
-                "category": category,
-                "action_items": []
-            }
-
-            for item in items:
-                action_item = {
-                    "action_title": item['action_title'],
-                    "action_status": "pending review",
-                    "action_plan": item['actions'],
-                    "progress_notes": []
-                }
-                category_entry["action_items"].append(action_item)
-
-            transformed_results["manager"]["categorized_action_items"].append(category_entry)
+def _run_in_stage(stage: str, run, **kwargs):
+    with instrumentation.stage(stage):
+        return run(**kwargs)
 
-    return transformed_results
-
-def run_pipeline(user_id: int, user_name: str, api_key: str) -> Dict[str, Any]:
-    session = SessionLocal()
-    # Get initial feedback
-    feedback = feedback_identifier.run(user_id=user_id, api_key=api_key, session=session)
-
-    # Route feedback
-    routed_feedback = feedback_router.run(feedback_data=feedback, api_key=api_key)
+def categorize_insights(routed_feedback: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+    """Run the manager and employee categorizers side by side"""
     manager_insights = routed_feedback['applicable_to_manager']
     employee_insights = routed_feedback['applicable_to_user']
 
@@ -95,14 +75,20 @@ def run_pipeline(user_id: int, user_name: str, api_key: str) -> Dict[str, Any]:
 
     with ThreadPoolExecutor(max_workers=2) as executor:
         # Submit both tasks and store them with identifiers
-        manager_task = executor.submit(
+        manager_task = instrumentation.submit(
+            executor,
+            _run_in_stage,
+            "manager_insights_categorizer",
             manager_insights_categorizer.run,
             feedback_items=manager_insights,
             api_key=api_key
         )
         future_tasks[manager_task] = 'manager'
 
-        employee_task = executor.submit(
+        employee_task = instrumentation.submit(
+            executor,
+            _run_in_stage,
+            "employee_insights_categorizer",
             employee_insights_categorizer.run,
             feedback_items=employee_insights,
             api_key=api_key
@@ -121,10 +107,65 @@ def run_pipeline(user_id: int, user_name: str, api_key: str) -> Dict[str, Any]:
                     "error": str(e),
                     "categorized_insights": {}
                 }
-    results = coach.run(results, api_key, user_name)
-    results = transform_pipeline_results(results, user_id, user_name)
-    plan_of_actions(user_id, user_name, results["manager"], 1, SessionLocal())
-    plan_of_actions(user_id, user_name, results["employee"], user_id, SessionLocal())
 
     return results
 
+def run_pipeline(user_id: int, user_name: str, api_key: str, incremental: bool = True,
+                 run_id: str | None = None) -> Dict[str, Any]:
+    """
+    Generate action plans from a user's chats and store them.
+
+    Incremental runs only analyze chats added since the user's watermark and merge the new
+    action items into the stored plans, keeping existing items and their progress notes.
+    A full run analyzes every chat and replaces the stored plans.
+
+    The output of every stage is checkpointed under run_id, keyed by a hash of the stage
+    input. Running again with the same run_id resumes after the last completed stage.
+    """
+    run_id = run_id or uuid.uuid4().hex
+
+    with SessionLocal() as session:
+        since_chat_id = system_queries.get_pipeline_watermark(user_id, session) if incremental else 0
+        conversation = feedback_identifier.get_user_conversation(user_id, session, after_id=since_chat_id)
+
+    # Get initial feedback
+    feedback = checkpoints.run_stage(
+        run_id, "findings",
+        {"user_id": user_id, "chats": [[item.id, item.is_ai, item.message] for item in conversation]},
+        lambda: feedback_identifier.run(user_id=user_id, api_key=api_key, session=None,
+                                        since_chat_id=since_chat_id, conversation=conversation)
+    )
+
+    if not feedback['feedback']:
+        # Nothing new to act on, only move the watermark past the analyzed chats
+        with SessionLocal() as session:
+            set_pipeline_watermark(user_id, feedback['last_chat_id'], session)
+        checkpoints.clear(run_id)
+        return transform_pipeline_results({}, user_id, user_name)
+
+    # Route feedback
+    routed_feedback = checkpoints.run_stage(
+        run_id, "routed_feedback", feedback,
+        lambda: feedback_router.run(feedback_data=feedback, api_key=api_key)
+    )
+
+    categorized_insights = checkpoints.run_stage(
+        run_id, "categorized_insights", routed_feedback,
+        lambda: categorize_insights(routed_feedback, api_key)
+    )
+
+    action_plans = checkpoints.run_stage(
+        run_id, "action_plans",
+        {"insights": categorized_insights, "user_name": user_name, "mode": config.COACH_GENERATION_MODE},
+        lambda: coach.run(categorized_insights, api_key, user_name)
+    )
+    results = transform_pipeline_results(action_plans, user_id, user_name)
+
+    save_plan = merge_plan_of_actions if incremental else plan_of_actions
+    with SessionLocal() as session:
+        save_plan(user_id, user_name, results["manager"].categorized_action_items, 1, session)
+        save_plan(user_id, user_name, results["employee"].categorized_action_items, user_id, session)
+        set_pipeline_watermark(user_id, feedback['last_chat_id'], session)
+
+    checkpoints.clear(run_id)
+    return results
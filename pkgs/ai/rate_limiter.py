@@ -0,0 +1,249 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+import openai
+
+import config
+from pkgs.ai import instrumentation
+from pkgs.system.metrics import registry
+
+T = TypeVar("T")
+
+RATE_LIMIT_WAIT_SECONDS = registry.histogram(
+    "llm_rate_limit_wait_seconds", "Time an LLM request waited for the shared rate limiter", ["model"]
+)
+
+# Retried: rate limits, timeouts, dropped connections and 5xx responses
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """
+    A bucket of capacity units refilled continuously at refill_per_second.
+
+    take() always succeeds and may leave the bucket in debt; it returns how long the caller
+    has to wait until its share has been refilled. Callers that are told to wait are served
+    in the order they called take(), which keeps the rate at the ceiling without a thundering
+    herd when a backlog clears.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        # Expects self._lock to be held
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.refill_per_second)
+        self._updated = now
+
+    def take(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # A single request larger than the bucket would otherwise never fit
+            self._level -= min(amount, self.capacity)
+            if self._level >= 0:
+                return 0.0
+            return -self._level / self.refill_per_second
+
+    def give(self, amount: float):
+        """Return units taken for a request that turned out to need fewer"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._level = min(self.capacity, self._level + amount)
+
+    def drain(self, seconds: float):
+        """Empty the bucket so the next caller waits at least seconds, e.g. after a 429"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._level = min(self._level, -seconds * self.refill_per_second)
+
+
+class ModelLimiter:
+    """Requests-per-minute and tokens-per-minute buckets of one model"""
+
+    def __init__(self, model: str, requests_per_minute: int, tokens_per_minute: int):
+        self.model = model
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+
+    def reserve(self, tokens: int) -> float:
+        """Take a request and its expected tokens, returns how long to wait before sending it"""
+        return max(self.requests.take(1), self.tokens.take(tokens))
+
+    def settle(self, reserved_tokens: int, used_tokens: int):
+        if used_tokens < reserved_tokens:
+            self.tokens.give(reserved_tokens - used_tokens)
+
+    def back_off(self, seconds: float):
+        """Hold every caller of this model back for seconds, the server told us we are over quota"""
+        self.requests.drain(seconds)
+
+    def acquire(self, tokens: int):
+        wait = self.reserve(tokens)
+        RATE_LIMIT_WAIT_SECONDS.observe(wait, model=self.model)
+        if wait:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int):
+        wait = self.reserve(tokens)
+        RATE_LIMIT_WAIT_SECONDS.observe(wait, model=self.model)
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Process-wide registry of ModelLimiters, shared by every OpenAI call site so the pipeline,
+    /chat and summaries draw from the same per-model quota.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[int, int]], default_limits: Tuple[int, int]):
+        self.limits = limits
+        self.default_limits = default_limits
+        self._models: Dict[str, ModelLimiter] = {}
+        self._lock = threading.Lock()
+
+    def for_model(self, model: str) -> ModelLimiter:
+        with self._lock:
+            limiter = self._models.get(model)
+            if limiter is None:
+                requests_per_minute, tokens_per_minute = self.limits.get(model, self.default_limits)
+                limiter = self._models[model] = ModelLimiter(model, requests_per_minute, tokens_per_minute)
+            return limiter
+
+
+def _parse_limits(value: str) -> Dict[str, Tuple[int, int]]:
+    try:
+        return {model: (int(rpm), int(tpm)) for model, (rpm, tpm) in json.loads(value).items()}
+    except Exception as e:
+        print(f"Ignoring invalid OPENAI_RATE_LIMITS: {str(e)}")
+        return {}
+
+
+rate_limiter = RateLimiter(
+    limits=_parse_limits(config.OPENAI_RATE_LIMITS),
+    default_limits=(config.OPENAI_DEFAULT_REQUESTS_PER_MINUTE, config.OPENAI_DEFAULT_TOKENS_PER_MINUTE)
+)
+
+
+def estimate_tokens(prompt_chars: int, max_tokens: Optional[int]) -> int:
+    """Tokens to reserve for a request: roughly 4 characters per prompt token plus the completion"""
+    return prompt_chars // 4 + 1 + (max_tokens or config.OPENAI_ESTIMATED_COMPLETION_TOKENS)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(float(value) * scale, 0.0)
+        except ValueError:
+            continue
+    return None
+
+
+def retry_delay(attempt: int, error: Exception) -> float:
+    """Retry-After when the server sent one, else exponential backoff with full jitter"""
+    retry_after = _retry_after(error)
+    if retry_after is not None:
+        return min(retry_after, config.OPENAI_MAX_BACKOFF_SECONDS)
+    return random.uniform(0, min(config.OPENAI_MAX_BACKOFF_SECONDS, config.OPENAI_BASE_BACKOFF_SECONDS * 2 ** attempt))
+
+
+def call_with_retries(model: str, tokens: int, call: Callable[[], T]) -> T:
+    """
+    Run a blocking OpenAI request under the model's limits, retrying transient failures.
+
+    The request's tokens are taken once, a retry only takes another request. They are given back
+    when the request fails for good, callers settle them only once it succeeds.
+    """
+    limiter = rate_limiter.for_model(model)
+    try:
+        for attempt in range(config.OPENAI_MAX_RETRIES + 1):
+            limiter.acquire(tokens if attempt == 0 else 0)
+            try:
+                return call()
+            except RETRYABLE_ERRORS as e:
+                if attempt == config.OPENAI_MAX_RETRIES:
+                    raise
+                delay = retry_delay(attempt, e)
+                instrumentation.record_retry(model)
+                print(f"Retrying {model} request in {delay:.1f}s after {type(e).__name__}: {str(e)}")
+                if isinstance(e, openai.RateLimitError):
+                    # Every caller of the model waits, this one included on its next acquire
+                    limiter.back_off(delay)
+                else:
+                    time.sleep(delay)
+    except BaseException:
+        limiter.settle(tokens, 0)
+        raise
+
+
+async def call_with_retries_async(model: str, tokens: int, call: Callable[[], Awaitable[T]]) -> T:
+    """call_with_retries for the async client, cancelling gives the tokens back too"""
+    limiter = rate_limiter.for_model(model)
+    try:
+        for attempt in range(config.OPENAI_MAX_RETRIES + 1):
+            await limiter.acquire_async(tokens if attempt == 0 else 0)
+            try:
+                return await call()
+            except RETRYABLE_ERRORS as e:
+                if attempt == config.OPENAI_MAX_RETRIES:
+                    raise
+                delay = retry_delay(attempt, e)
+                instrumentation.record_retry(model)
+                print(f"Retrying {model} request in {delay:.1f}s after {type(e).__name__}: {str(e)}")
+                if isinstance(e, openai.RateLimitError):
+                    # Every caller of the model waits, this one included on its next acquire
+                    limiter.back_off(delay)
+                else:
+                    await asyncio.sleep(delay)
+    except BaseException:
+        limiter.settle(tokens, 0)
+        raise
+
+
+class RateLimitedLLM:
+    """
+    Wraps a llama_index LLM so every complete() call goes through the shared rate limiter
+    and is retried on rate limits and transient errors. The client's own retries are
+    turned off so a failing request is not retried at two levels.
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+        if hasattr(llm, "max_retries"):
+            llm.max_retries = 0
+
+    def __getattr__(self, name: str):
+        return getattr(self.llm, name)
+
+    def complete(self, prompt: str, **kwargs: Any):
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        reserved = estimate_tokens(len(prompt), getattr(self.llm, "max_tokens", None))
+        response = call_with_retries(model, reserved, lambda: self.llm.complete(prompt, **kwargs))
+        prompt_tokens, completion_tokens = instrumentation.response_usage(response)
+        if prompt_tokens or completion_tokens:
+            rate_limiter.for_model(model).settle(reserved, prompt_tokens + completion_tokens)
+        return response
+
+
+def limited(llm):
+    return RateLimitedLLM(llm)
@@ -4,24 +4,118 @@ from sqlalchemy.types import JSON
 from fastapi import APIRouter, FastAPI, HTTPException, Request, Depends
 from db_models import PlanOfAction as DbPlanOfActionModel
 from db_models import PlanOfAction as DbPlanOfAction
+from db_models import PlanCategory as DbPlanCategory
+from db_models import ActionItem as DbActionItem
+from db_models import ActionItemStep as DbActionItemStep
+from db_models import ActionItemNote as DbActionItemNote
+from pydantic_models import CategoryGroup as PydanticCategoryGroup
+from pydantic_models import ActionPlan as PydanticActionPlan
 from db_models import Chat as DbChat
+from db_models import ChatSummary as DbChatSummary
+from db_models import PipelineJob as DbPipelineJob
+from db_models import PipelineBatch as DbPipelineBatch
+from db_models import PipelineWatermark as DbPipelineWatermark
+from pkgs.system import queries as system_queries
+from pkgs.system.plan_cache import plan_cache
+from datetime import datetime, timedelta, timezone
 from db_engine import engine, get_db
 
 
+def to_action_item(item: PydanticActionPlan, plan: DbPlanOfAction, position: int) -> DbActionItem:
+    return DbActionItem(
+        plan=plan,
+        position=position,
+        title=item.action_title,
+        status=item.action_status,
+        steps=[DbActionItemStep(position=i, text=step) for i, step in enumerate(item.action_plan)],
+        notes=[DbActionItemNote(position=i, text=note) for i, note in enumerate(item.progress_notes)]
+    )
+
+
+def get_or_create_plan_row(user_id: int, user_name: str, target_user_id: int, db: Session) -> DbPlanOfAction:
+    plan = system_queries.get_plan_of_actions_row(user_id, target_user_id, db)
+    if plan is None:
+        plan = DbPlanOfActionModel(user_id=user_id, target_user_id=target_user_id)
+        db.add(plan)
+    plan.user_name = user_name
+    return plan
+
+
+def commit_plan(plan: DbPlanOfAction, db: Session):
+    """Render the plan as the API serves it and commit it, the only place its JSON is validated"""
+    user_id, target_user_id = plan.user_id, plan.target_user_id
+    try:
+        # Assigns the ids and versions of new items, which the rendered plan carries
+        db.flush()
+        plan.rendered = system_queries.render_plan(plan)
+        plan.revision += 1
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    plan_cache.invalidate_plan(user_id, target_user_id)
+
+
 def plan_of_actions(
         user_id: int,
         user_name: str,
-        categorized_action_items: Dict[str, Any],
+        categorized_action_items: List[PydanticCategoryGroup],
         target_user_id: int,
         db: Session = Depends(get_db)
 ):
-    plans_of_action = DbPlanOfActionModel(
-        user_id=user_id,
-        user_name=user_name,
-        categorized_action_items=categorized_action_items,
-        target_user_id=target_user_id
-    )
-    db.add(plans_of_action)
+    """Store the plan of a user for the given audience, replacing the plan stored before"""
+    plan = get_or_create_plan_row(user_id, user_name, target_user_id, db)
+    # The categories replaced are deleted along with their items, steps and notes
+    plan.categories = [
+        DbPlanCategory(
+            position=position,
+            name=category_group.category,
+            action_items=[to_action_item(item, plan, i) for i, item in enumerate(category_group.action_items)]
+        )
+        for position, category_group in enumerate(categorized_action_items)
+    ]
+    commit_plan(plan, db)
+
+
+def merge_plan_of_actions(
+        user_id: int,
+        user_name: str,
+        categorized_action_items: List[PydanticCategoryGroup],
+        target_user_id: int,
+        db: Session = Depends(get_db)
+):
+    """
+    Merge newly generated action items into the stored plan of a user.
+
+    Existing action items are kept untouched, including their status and progress notes.
+    New items are appended to the category of the same name, skipping titles the category
+    already has, and new categories are appended at the end. Only the new rows are written.
+    """
+    plan = get_or_create_plan_row(user_id, user_name, target_user_id, db)
+    by_category = {category.name: category for category in plan.categories}
+
+    for category_group in categorized_action_items:
+        category = by_category.get(category_group.category)
+        if category is None:
+            category = DbPlanCategory(position=len(plan.categories), name=category_group.category)
+            plan.categories.append(category)
+            by_category[category.name] = category
+
+        titles = {item.title.strip().lower() for item in category.action_items}
+        for item in category_group.action_items:
+            if item.action_title.strip().lower() not in titles:
+                category.action_items.append(to_action_item(item, plan, len(category.action_items)))
+                titles.add(item.action_title.strip().lower())
+
+    commit_plan(plan, db)
+
+
+def set_pipeline_watermark(user_id: int, last_chat_id: int, db: Session = Depends(get_db)):
+    watermark = db.get(DbPipelineWatermark, user_id)
+    if watermark is None:
+        watermark = DbPipelineWatermark(user_id=user_id)
+        db.add(watermark)
+    watermark.last_chat_id = last_chat_id
     try:
         db.commit()
     except Exception as e:
@@ -29,6 +123,78 @@ def plan_of_actions(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def save_chat_summary(user_id: int, summary: str, summarized_count: int, db: Session = Depends(get_db)):
+    chat_summary = db.get(DbChatSummary, user_id)
+    if chat_summary is None:
+        chat_summary = DbChatSummary(user_id=user_id)
+        db.add(chat_summary)
+    chat_summary.summary = summary
+    chat_summary.summarized_count = summarized_count
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def create_pipeline_batch(user_count: int, db: Session = Depends(get_db)) -> DbPipelineBatch:
+    batch = DbPipelineBatch(user_count=user_count)
+    db.add(batch)
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    db.refresh(batch)
+    return batch
+
+
+def create_pipeline_job(user_id: int, user_name: str, run_id: str, db: Session = Depends(get_db),
+                        batch_id: int | None = None) -> DbPipelineJob:
+    job = DbPipelineJob(user_id=user_id, user_name=user_name, run_id=run_id, status="queued", batch_id=batch_id)
+    db.add(job)
+    try:
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    db.refresh(job)
+    return job
+
+
+def set_pipeline_job_batch(job_id: int, batch_id: int, db: Session = Depends(get_db)):
+    db.query(DbPipelineJob).filter(DbPipelineJob.id == job_id).update({
+        DbPipelineJob.batch_id: batch_id
+    }, synchronize_session=False)
+    db.commit()
+
+
+def claim_pipeline_job(job_id: int, stale_seconds: int, db: Session = Depends(get_db)) -> bool:
+    """Mark a queued or stale running job as running. False if another worker got to it first."""
+    now = datetime.now(timezone.utc)
+    claimed = db.query(DbPipelineJob).filter(
+        DbPipelineJob.id == job_id,
+        (DbPipelineJob.status == "queued")
+        | ((DbPipelineJob.status == "running") & (DbPipelineJob.started_at < now - timedelta(seconds=stale_seconds)))
+    ).update({
+        DbPipelineJob.status: "running",
+        DbPipelineJob.started_at: now
+    }, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def finish_pipeline_job(job_id: int, error: str | None = None, summary: Dict[str, Any] | None = None,
+                        db: Session = Depends(get_db)):
+    db.query(DbPipelineJob).filter(DbPipelineJob.id == job_id).update({
+        DbPipelineJob.status: "failed" if error else "succeeded",
+        DbPipelineJob.error: error,
+        DbPipelineJob.summary: summary,
+        DbPipelineJob.finished_at: datetime.now(timezone.utc)
+    }, synchronize_session=False)
+    db.commit()
+
+
 def delete_chat_and_plan_of_actions_of_employee(user_id: int, db: Session = Depends(get_db)):
     try:
         # Delete plan of actions
@@ -36,6 +202,15 @@ def delete_chat_and_plan_of_actions_of_employee(user_id: int, db: Session = Depe
             DbPlanOfAction.user_id == user_id
         ).delete(synchronize_session=False)
 
+        # Delete the pipeline watermark and chat summary along with the chats they refer to
+        db.query(DbPipelineWatermark).filter(
+            DbPipelineWatermark.user_id == user_id
+        ).delete(synchronize_session=False)
+
+        db.query(DbChatSummary).filter(
+            DbChatSummary.user_id == user_id
+        ).delete(synchronize_session=False)
+
         # Delete chats
         deleted_chats = db.query(DbChat).filter(
             DbChat.user_id == user_id
@@ -43,6 +218,7 @@ def delete_chat_and_plan_of_actions_of_employee(user_id: int, db: Session = Depe
 
         # Commit the transaction
         db.commit()
+        plan_cache.invalidate_user(user_id)
 
         return {
             "status": "success",
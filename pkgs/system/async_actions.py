@@ -0,0 +1,124 @@
+"""
+Async versions of the writes the routes make, on the asyncpg engine (db_engine.async_engine).
+"""
+from fastapi import Depends, HTTPException
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from db_models import User as DbUser
+from db_models import Chat as DbChat
+from db_models import PlanOfAction as DbPlanOfAction
+from db_models import ActionItem as DbActionItem
+from db_models import ActionItemNote as DbActionItemNote
+from db_models import ChatSummary as DbChatSummary
+from db_models import PipelineWatermark as DbPipelineWatermark
+from db_engine import get_async_db
+from pkgs.system.plan_cache import plan_cache
+
+
+async def add_user(name: str, is_manager: bool, db: AsyncSession = Depends(get_async_db)) -> DbUser:
+    user = DbUser(name=name, is_manager=is_manager)
+    db.add(user)
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    return user
+
+
+async def bump_action_item_version(item_id: int, version: int, values: dict, db: AsyncSession) -> int:
+    """
+    Apply values to the action item if it is still at version, in place and bumping its version.
+    Returns the plan_id of the item; 404 if there is no such item, 409 if it was changed since.
+    """
+    result = await db.execute(
+        update(DbActionItem)
+        .where(DbActionItem.id == item_id, DbActionItem.version == version)
+        .values(version=DbActionItem.version + 1, **values)
+        .returning(DbActionItem.plan_id)
+    )
+    plan_id = result.scalar_one_or_none()
+    if plan_id is not None:
+        return plan_id
+
+    current = await db.scalar(select(DbActionItem.version).where(DbActionItem.id == item_id))
+    if current is None:
+        raise HTTPException(status_code=404, detail="Action item not found")
+    raise HTTPException(
+        status_code=409,
+        detail=f"Action item {item_id} is at version {current}, not {version}; reload it and try again"
+    )
+
+
+async def commit_action_item_update(plan_id: int, db: AsyncSession):
+    # The rendered plan no longer matches its items, the next read renders it again
+    plan = (await db.execute(
+        update(DbPlanOfAction)
+        .where(DbPlanOfAction.id == plan_id)
+        .values(rendered=None, revision=DbPlanOfAction.revision + 1)
+        .returning(DbPlanOfAction.user_id, DbPlanOfAction.target_user_id)
+    )).one()
+    try:
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    plan_cache.invalidate_plan(plan.user_id, plan.target_user_id)
+
+
+async def set_action_status(item_id: int, action_status: str, version: int,
+                            db: AsyncSession = Depends(get_async_db)) -> int:
+    """Change the status of one action item, returning its new version"""
+    try:
+        plan_id = await bump_action_item_version(item_id, version, {"status": action_status}, db)
+    except HTTPException:
+        await db.rollback()
+        raise
+    await commit_action_item_update(plan_id, db)
+    return version + 1
+
+
+async def add_progress_note(item_id: int, note: str, version: int,
+                            db: AsyncSession = Depends(get_async_db)) -> int:
+    """Append a progress note to one action item, returning its new version"""
+    try:
+        # The version update locks the item row first, so concurrent appends cannot take the same position
+        plan_id = await bump_action_item_version(item_id, version, {}, db)
+        next_position = select(func.coalesce(func.max(DbActionItemNote.position) + 1, 0)).where(
+            DbActionItemNote.action_item_id == item_id
+        ).scalar_subquery()
+        await db.execute(insert(DbActionItemNote).values(action_item_id=item_id, position=next_position, text=note))
+    except HTTPException:
+        await db.rollback()
+        raise
+    await commit_action_item_update(plan_id, db)
+    return version + 1
+
+
+async def delete_chat_and_plan_of_actions_of_employee(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    try:
+        deleted_plans = await db.execute(delete(DbPlanOfAction).where(DbPlanOfAction.user_id == user_id))
+
+        # Delete the pipeline watermark and chat summary along with the chats they refer to
+        await db.execute(delete(DbPipelineWatermark).where(DbPipelineWatermark.user_id == user_id))
+        await db.execute(delete(DbChatSummary).where(DbChatSummary.user_id == user_id))
+
+        deleted_chats = await db.execute(delete(DbChat).where(DbChat.user_id == user_id))
+
+        await db.commit()
+        plan_cache.invalidate_user(user_id)
+
+        return {
+            "status": "success",
+            "deleted_records": {
+                "plans_of_action": deleted_plans.rowcount,
+                "chats": deleted_chats.rowcount
+            }
+        }
+
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to delete records: {str(e)}"
+        )
@@ -0,0 +1,216 @@
+"""
+Async versions of the queries the routes run, on the asyncpg engine (db_engine.async_engine).
+Results are converted with the same helpers as pkgs/system/queries.py.
+"""
+from typing import AsyncIterator, List
+from fastapi import Depends
+from sqlalchemy import select, func, Select
+from sqlalchemy.ext.asyncio import AsyncSession
+import config
+from pydantic_models import ChatMessage as PydanticChatModel
+from pydantic_models import ConversationPage as PydanticConversationPage
+from pydantic_models import User as PydanticUserModel
+from pydantic_models import PipelineBatch as PydanticPipelineBatch
+from db_models import Chat as DbChatModel
+from db_models import PlanOfAction as DbPlanOfActionModel
+from db_models import User as DbUserModel
+from db_models import PipelineJob as DbPipelineJobModel
+from db_models import PipelineBatch as DbPipelineBatchModel
+from db_models import PipelineWatermark as DbPipelineWatermarkModel
+from db_engine import get_async_db, AsyncSessionLocal
+from pkgs.system.queries import plan_tree, render_plan, store_rendered_plan, employee_plan_json, pipeline_batch_progress
+from pkgs.system.plan_cache import plan_cache, employee_key, manager_key, MISSING
+
+
+def conversation_statement(user_id: int, cursor: int | None, newest_first: bool) -> Select:
+    """Chats of a user after (or, newest first, before) the chat id cursor, served by ix_chats_user_id_id"""
+    statement = select(DbChatModel).where(DbChatModel.user_id == user_id)
+    if newest_first:
+        if cursor is not None:
+            statement = statement.where(DbChatModel.id < cursor)
+        return statement.order_by(DbChatModel.id.desc())
+    if cursor is not None:
+        statement = statement.where(DbChatModel.id > cursor)
+    return statement.order_by(DbChatModel.id)
+
+
+def manager_plans_statement() -> Select:
+    """The plans addressed to the manager in id order, only the latest of a user should older ones remain"""
+    latest = (
+        select(func.max(DbPlanOfActionModel.id))
+        .where(DbPlanOfActionModel.target_user_id == 1)
+        .group_by(DbPlanOfActionModel.user_id)
+    )
+    return select(DbPlanOfActionModel).where(DbPlanOfActionModel.id.in_(latest)).order_by(DbPlanOfActionModel.id)
+
+
+async def get_user_conversation(
+        user_id: int,
+        db: AsyncSession = Depends(get_async_db),
+        limit: int = config.CONVERSATION_PAGE_SIZE,
+        cursor: int | None = None,
+        newest_first: bool = True
+) -> PydanticConversationPage:
+    """
+    One page of a user's conversation, keyset-paginated on chats.id.
+
+    Pages are read newest first, or in id order, starting after the cursor (the next_cursor of
+    the previous page). Unlike an offset, the cursor keeps every page an index range scan and
+    does not shift when new messages arrive.
+    """
+    # One extra row tells whether there is a next page
+    chat_items = (await db.scalars(
+        conversation_statement(user_id, cursor, newest_first).limit(limit + 1)
+    )).all()
+    has_more = len(chat_items) > limit
+    chat_items = chat_items[:limit]
+    return PydanticConversationPage(
+        messages=[PydanticChatModel.model_validate(item) for item in chat_items],
+        next_cursor=chat_items[-1].id if has_more else None
+    )
+
+
+async def stream_user_conversation(
+        user_id: int,
+        cursor: int | None = None,
+        newest_first: bool = False,
+        batch_size: int = config.CONVERSATION_STREAM_BATCH_SIZE
+) -> AsyncIterator[PydanticChatModel]:
+    """
+    The whole conversation of a user from a server-side cursor, batch_size rows at a time.
+
+    Opens its own session: the request's session is closed before a streaming response is sent.
+    """
+    async with AsyncSessionLocal() as db:
+        statement = conversation_statement(user_id, cursor, newest_first).execution_options(yield_per=batch_size)
+        async for item in await db.stream_scalars(statement):
+            yield PydanticChatModel.model_validate(item)
+
+
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)) -> PydanticUserModel | None:
+    user = await db.get(DbUserModel, user_id)
+    if user is None:
+        return None
+    return PydanticUserModel(name=user.name, is_manager=user.is_manager)
+
+
+async def get_user_names(user_ids: List[int], db: AsyncSession = Depends(get_async_db)) -> list[tuple[int, str]]:
+    rows = await db.execute(
+        select(DbUserModel.id, DbUserModel.name)
+        .where(DbUserModel.id.in_(user_ids))
+        .order_by(DbUserModel.id)
+    )
+    return [(row.id, row.name) for row in rows]
+
+
+async def get_users_with_new_chats(db: AsyncSession = Depends(get_async_db)) -> list[tuple[int, str]]:
+    latest_chats = (
+        select(DbChatModel.user_id, func.max(DbChatModel.id).label("last_chat_id"))
+        .group_by(DbChatModel.user_id)
+        .subquery()
+    )
+    rows = await db.execute(
+        select(DbUserModel.id, DbUserModel.name)
+        .join(latest_chats, latest_chats.c.user_id == DbUserModel.id)
+        .outerjoin(DbPipelineWatermarkModel, DbPipelineWatermarkModel.user_id == DbUserModel.id)
+        .where(latest_chats.c.last_chat_id > func.coalesce(DbPipelineWatermarkModel.last_chat_id, 0))
+        .order_by(DbUserModel.id)
+    )
+    return [(row.id, row.name) for row in rows]
+
+
+async def employee_plans_json(action_plans: List[DbPlanOfActionModel], db: AsyncSession = Depends(get_async_db)) -> List[bytes]:
+    """
+    The EmployeeActionItems JSON of every plan. The plans a partial update left without rendered
+    JSON are rendered from their rows in one plan_tree load and stored for the next read.
+    """
+    stale = [action_plan for action_plan in action_plans if action_plan.rendered is None]
+    if not stale:
+        return [employee_plan_json(action_plan, action_plan.rendered) for action_plan in action_plans]
+
+    await db.scalars(
+        select(DbPlanOfActionModel)
+        .options(plan_tree())
+        .where(DbPlanOfActionModel.id.in_([action_plan.id for action_plan in stale]))
+    )
+    rendered = {}
+    for action_plan in stale:
+        rendered[action_plan.id] = render_plan(action_plan)
+        await db.execute(store_rendered_plan(action_plan, rendered[action_plan.id]))
+    result = [
+        employee_plan_json(action_plan, rendered.get(action_plan.id) or action_plan.rendered)
+        for action_plan in action_plans
+    ]
+    await db.commit()
+    return result
+
+
+async def get_user_action_plan(user_id: int, db: AsyncSession = Depends(get_async_db)) -> bytes | None:
+    """The EmployeeActionItems JSON of the plan a user sees of themselves, None if there is none"""
+    key = employee_key(user_id)
+    cached, version = plan_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    # The latest should an older plan remain, see migration 6
+    action_plan = (await db.scalars(
+        select(DbPlanOfActionModel)
+        .where(DbPlanOfActionModel.target_user_id == user_id)
+        .where(DbPlanOfActionModel.user_id == user_id)
+        .order_by(DbPlanOfActionModel.id.desc())
+        .limit(1)
+    )).first()
+
+    result = (await employee_plans_json([action_plan], db))[0] if action_plan else None
+    plan_cache.put(key, result, version, len(result or b""))
+    return result
+
+
+async def get_manager_action_plan(db: AsyncSession = Depends(get_async_db)) -> bytes:
+    """The JSON array of the EmployeeActionItems addressed to the manager"""
+    key = manager_key(1)
+    cached, version = plan_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    action_plans = (await db.scalars(manager_plans_statement())).all()
+    result = b"[" + b",".join(await employee_plans_json(list(action_plans), db)) + b"]"
+    plan_cache.put(key, result, version, len(result))
+    return result
+
+
+async def stream_manager_action_plan(
+        batch_size: int = config.MANAGER_PLANS_STREAM_BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    The EmployeeActionItems JSON of the plans addressed to the manager one at a time, read from a
+    server-side cursor in batches of batch_size rows, so memory stays bounded by the batch however
+    large the team. Plans without rendered JSON are rendered on the way but not stored.
+
+    Opens its own session: the request's session is closed before a streaming response is sent.
+    """
+    async with AsyncSessionLocal() as db:
+        statement = manager_plans_statement().execution_options(yield_per=batch_size)
+        async for action_plan in await db.stream_scalars(statement):
+            rendered = action_plan.rendered
+            if rendered is None:
+                rendered = render_plan(await db.scalar(
+                    select(DbPlanOfActionModel)
+                    .options(plan_tree())
+                    .where(DbPlanOfActionModel.id == action_plan.id)
+                ))
+            yield employee_plan_json(action_plan, rendered)
+
+
+async def get_pipeline_job(job_id: int, db: AsyncSession = Depends(get_async_db)) -> DbPipelineJobModel | None:
+    return await db.get(DbPipelineJobModel, job_id)
+
+
+async def get_pipeline_batch(batch_id: int, db: AsyncSession = Depends(get_async_db)) -> PydanticPipelineBatch | None:
+    batch = await db.get(DbPipelineBatchModel, batch_id)
+    if batch is None:
+        return None
+    jobs = (await db.scalars(
+        select(DbPipelineJobModel).where(DbPipelineJobModel.batch_id == batch_id)
+    )).all()
+    return pipeline_batch_progress(batch, list(jobs))
@@ -0,0 +1,170 @@
+"""
+Write-behind persistence of the /chat messages.
+
+/chat queues the user message, and the AI reply once it has streamed, instead of committing them
+on the request. One writer task per worker drains the queue in batches, each written in one
+transaction on a session of its own, so nothing waits on the database before the first token and
+no connection is held while a reply streams.
+
+Messages are written in the order they were queued, which keeps the messages of every user in
+order. A reader that needs the chats table to be complete for a user, like a chat context loaded
+from it, first waits for the messages still queued for them with wait_for_user.
+"""
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+
+import config
+from db_engine import AsyncSessionLocal
+from db_models import Chat as DbChat
+from pkgs.system.metrics import registry
+
+CHAT_WRITES = registry.counter(
+    "chat_writes_total", "Chat messages written behind /chat", ["result"]
+)
+CHAT_WRITE_BATCHES = registry.histogram(
+    "chat_write_batch_size", "Chat messages per write", buckets=(1, 2, 5, 10, 25, 50, 100, 250)
+)
+CHAT_WRITE_PENDING = registry.gauge(
+    "chat_write_pending", "Chat messages queued and not written yet"
+)
+
+# Doubled after every failed attempt of a message
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+@dataclass
+class PendingChat:
+    sequence: int
+    user_id: int
+    message: str
+    is_ai: bool
+    # When the message was received rather than when its batch was written
+    timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class ChatWriter:
+    """
+    Queue of chat messages written to the chats table in batches by one background task.
+
+    Every message gets a sequence number when queued; written is the sequence number up to which
+    every message is written, or dropped after retries ran out.
+    """
+
+    def __init__(self, batch_size: int, flush_interval_seconds: float, max_pending: int, retries: int):
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_pending = max_pending
+        self.retries = max(retries, 1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._progress: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._sequence = 0
+        self._written = 0
+        self._last_by_user: Dict[int, int] = {}
+
+    async def add(self, user_id: int, message: str, is_ai: bool) -> None:
+        """Queue a message, waiting for room when max_pending messages are queued already"""
+        self._start()
+        self._sequence += 1
+        self._last_by_user[user_id] = self._sequence
+        await self._queue.put(PendingChat(self._sequence, user_id, message, is_ai))
+
+    async def wait_for_user(self, user_id: int) -> None:
+        """Wait until every message queued so far for the user is written"""
+        target = self._last_by_user.get(user_id, 0)
+        if target <= self._written:
+            return
+        async with self._progress:
+            await self._progress.wait_for(lambda: self._written >= target)
+
+    def pending(self) -> int:
+        return self._sequence - self._written
+
+    async def close(self) -> None:
+        """Write everything queued and stop the writer task, called on shutdown"""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    # Started on the first message, on the event loop serving the routes
+    def _start(self) -> None:
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._progress = asyncio.Condition()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            # Give the batch a moment to fill, under load the queue already holds the next messages
+            await asyncio.sleep(self.flush_interval_seconds)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # Never let the writer die, the messages of the batch are lost but the queue keeps draining
+                print(f"Error in chat writer: {str(e)}")
+            finally:
+                await self._written_up_to(batch)
+
+    async def _write(self, batch: List[PendingChat]) -> None:
+        CHAT_WRITE_BATCHES.observe(len(batch))
+        try:
+            await self._insert(batch)
+            CHAT_WRITES.inc(len(batch), result="written")
+            return
+        except Exception as e:
+            print(f"Error writing {len(batch)} chat messages, writing them one by one: {str(e)}")
+
+        # One bad message, like one of a deleted user, fails the whole batch. Written one by one
+        # it only takes itself down
+        for chat in batch:
+            for attempt in range(self.retries):
+                try:
+                    await self._insert([chat])
+                    CHAT_WRITES.inc(result="written")
+                    break
+                except Exception as e:
+                    error = e
+                    if attempt + 1 < self.retries:
+                        await asyncio.sleep(RETRY_BACKOFF_SECONDS * 2 ** attempt)
+            else:
+                print(f"Dropping chat message of user {chat.user_id} after {self.retries} attempts: {str(error)}")
+                CHAT_WRITES.inc(result="dropped")
+
+    async def _insert(self, batch: List[PendingChat]) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(DbChat), [
+                {"user_id": chat.user_id, "message": chat.message, "is_ai": chat.is_ai, "timestamp": chat.timestamp}
+                for chat in batch
+            ])
+            await db.commit()
+
+    async def _written_up_to(self, batch: List[PendingChat]) -> None:
+        self._written = batch[-1].sequence
+        for chat in batch:
+            if self._last_by_user.get(chat.user_id, 0) <= self._written:
+                self._last_by_user.pop(chat.user_id, None)
+        async with self._progress:
+            self._progress.notify_all()
+        for _ in batch:
+            self._queue.task_done()
+
+
+chat_writer = ChatWriter(
+    batch_size=config.CHAT_WRITE_BATCH_SIZE,
+    flush_interval_seconds=config.CHAT_WRITE_FLUSH_INTERVAL_SECONDS,
+    max_pending=config.CHAT_WRITE_MAX_PENDING,
+    retries=config.CHAT_WRITE_RETRIES
+)
+CHAT_WRITE_PENDING.set_function(chat_writer.pending)
@@ -0,0 +1,174 @@
+import asyncio
+import itertools
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List
+
+import greenlet
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from pkgs.system.metrics import registry
+
+POOL_WAIT_SECONDS = registry.histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a connection from the pool", ["engine"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0)
+)
+POOL_TIMEOUTS = registry.counter(
+    "db_pool_timeouts_total", "Connection requests that gave up after pool_timeout", ["engine"]
+)
+POOL_CONNECTIONS = registry.gauge(
+    "db_pool_connections", "Connections of the pool by state", ["engine", "state"]
+)
+POOL_INVALIDATED = registry.counter(
+    "db_pool_invalidated_total", "Connections dropped as stale or broken", ["engine"]
+)
+POOL_LEAKS = registry.gauge(
+    "db_pool_leaked_connections", "Connections checked out for longer than the leak threshold"
+)
+
+
+class TimedCheckout:
+    """Records how long callers wait for a connection of the pool, labelled with engine_name"""
+    engine_name = "sync"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            POOL_TIMEOUTS.inc(engine=self.engine_name)
+            raise
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - started, engine=self.engine_name)
+
+
+class InstrumentedQueuePool(TimedCheckout, QueuePool):
+    """QueuePool of the sync engine that records how long callers wait for a connection"""
+
+
+class InstrumentedAsyncQueuePool(TimedCheckout, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool of the async engine that records how long callers wait for a connection"""
+    engine_name = "async"
+
+
+class LeakDetector:
+    """
+    Remembers when and where every pooled connection was checked out, and reports the ones
+    held for longer than threshold_seconds. A session that is never closed keeps its connection
+    checked out, so under bursts it shows up here long before the pool is exhausted.
+    """
+
+    def __init__(self, threshold_seconds: float, stack_depth: int = 12):
+        self.threshold_seconds = threshold_seconds
+        self.stack_depth = stack_depth
+        # id(connection record) -> (checked out at, holder, stack)
+        self._checked_out: Dict[int, tuple] = {}
+        self._reported: set = set()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def _caller_stack(self) -> traceback.StackSummary:
+        start = sys._getframe(2)
+        # The async engine checks out from inside the greenlet of greenlet_spawn, whose stack ends
+        # in SQLAlchemy. The coroutine that opened the session is on the greenlet it switched from.
+        parent = greenlet.getcurrent().parent
+        if parent is not None and parent.gr_frame is not None:
+            start = parent.gr_frame
+        # Skip SQLAlchemy's own frames so the stack starts at the code that opened the session
+        frames = (
+            (frame, lineno) for frame, lineno in traceback.walk_stack(start)
+            if "sqlalchemy" not in frame.f_code.co_filename and frame.f_code.co_filename != "<string>"
+        )
+        stack = traceback.StackSummary.extract(itertools.islice(frames, self.stack_depth), lookup_lines=False)
+        stack.reverse()
+        return stack
+
+    @staticmethod
+    def _holder() -> str:
+        holder = f"thread {threading.current_thread().name}"
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        return f"{holder}, task {task.get_name()}" if task is not None else holder
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        stack = self._caller_stack()
+        with self._lock:
+            self._checked_out[id(connection_record)] = (time.monotonic(), self._holder(), stack)
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self._checked_out.pop(id(connection_record), None)
+            self._reported.discard(id(connection_record))
+
+    def leaks(self) -> List[tuple]:
+        """(seconds held, holder, stack) of every connection held past the threshold"""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                (now - checked_out_at, holder, stack)
+                for checked_out_at, holder, stack in self._checked_out.values()
+                if now - checked_out_at >= self.threshold_seconds
+            ]
+
+    def report(self) -> int:
+        """Print each leaked connection once, returns how many are currently leaked"""
+        now = time.monotonic()
+        with self._lock:
+            leaked = {
+                key: value for key, value in self._checked_out.items()
+                if now - value[0] >= self.threshold_seconds
+            }
+            new = [key for key in leaked if key not in self._reported]
+            self._reported.update(new)
+        for key in new:
+            checked_out_at, holder, stack = leaked[key]
+            print(f"Database connection held for {now - checked_out_at:.1f}s by {holder}, checked out at:\n"
+                  + "".join(traceback.format_list(stack)))
+        return len(leaked)
+
+    def start(self, interval_seconds: float):
+        """Check for leaks every interval_seconds on a daemon thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.report()
+                except Exception as e:
+                    print(f"Error checking for leaked database connections: {str(e)}")
+
+        self._thread = threading.Thread(target=loop, name="db-leak-detector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+def observe(engine: Engine, leak_detector: LeakDetector | None = None, name: str = "sync"):
+    """
+    Export the engine's pool state as metrics labelled with name and feed the leak detector.
+    For an AsyncEngine pass its sync_engine, which is where the pool events fire.
+    """
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        POOL_CONNECTIONS.set_function(pool.checkedout, engine=name, state="checked_out")
+        POOL_CONNECTIONS.set_function(pool.checkedin, engine=name, state="idle")
+        POOL_CONNECTIONS.set_function(lambda: max(pool.overflow(), 0), engine=name, state="overflow")
+        POOL_CONNECTIONS.set_function(pool.size, engine=name, state="pool_size")
+
+    event.listen(engine, "invalidate", lambda *args: POOL_INVALIDATED.inc(engine=name))
+    if leak_detector is not None:
+        event.listen(engine, "checkout", leak_detector.on_checkout)
+        event.listen(engine, "checkin", leak_detector.on_checkin)
+        POOL_LEAKS.set_function(lambda: len(leak_detector.leaks()))
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, Tuple
+
+import config
+from pkgs.system.metrics import registry
+
+PLAN_CACHE_REQUESTS = registry.counter(
+    "plan_cache_requests_total", "Dashboard plan cache lookups", ["kind", "result"]
+)
+PLAN_CACHE_SIZE = registry.gauge(
+    "plan_cache_size", "Dashboard plan cache size", ["unit"]
+)
+
+# Returned by get on a miss, a cached plan can itself be None when the user has none
+MISSING = object()
+
+
+def employee_key(user_id: int) -> Tuple[str, int]:
+    """The plan an employee sees of themselves, see get_user_action_plan"""
+    return ("employee", user_id)
+
+
+def manager_key(manager_id: int) -> Tuple[str, int]:
+    """Every plan addressed to a manager, see get_manager_action_plan"""
+    return ("manager", manager_id)
+
+
+@dataclass
+class PlanCacheEntry:
+    value: Any
+    size: int
+    stored_at: float = field(default_factory=time.monotonic)
+
+
+class PlanCache:
+    """
+    Bounded LRU cache of the dashboard responses as JSON, filled on read and invalidated on write.
+
+    Every key has a version that invalidate bumps. A reader takes the version along with the
+    lookup and stores what it loaded under that version; if a write invalidated the key in the
+    meantime the load may predate the write, so it is dropped instead of cached.
+
+    Invalidation only reaches the cache of this process. ttl_seconds bounds how long another
+    worker's cache can serve a plan after a write made here.
+    """
+
+    def __init__(self, enabled: bool, max_entries: int, ttl_seconds: float):
+        self.enabled = enabled
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Hashable, PlanCacheEntry]" = OrderedDict()
+        self._versions: Dict[Hashable, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Tuple[Any, int]:
+        """(cached value or MISSING, version to pass to put)"""
+        with self._lock:
+            version = self._versions.get(key, 0)
+            entry = self._entries.get(key) if self.enabled else None
+            if entry is not None and time.monotonic() - entry.stored_at > self.ttl_seconds:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                PLAN_CACHE_REQUESTS.inc(kind=key[0], result="miss")
+                return MISSING, version
+            self.hits += 1
+            self._entries.move_to_end(key)
+        PLAN_CACHE_REQUESTS.inc(kind=key[0], result="hit")
+        return entry.value, version
+
+    def put(self, key: Hashable, value: Any, version: int, size: int) -> bool:
+        """Cache value loaded at version, size is its approximate size in bytes"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            if self._versions.get(key, 0) != version:
+                return False
+            self._remove(key)
+            self._entries[key] = PlanCacheEntry(value=value, size=size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            return True
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._remove(key)
+                self.invalidations += 1
+
+    def invalidate_plan(self, user_id: int, target_user_id: int) -> None:
+        """Invalidate the responses that include the plan of user_id for target_user_id"""
+        self.invalidate(employee_key(user_id), manager_key(target_user_id))
+
+    def invalidate_user(self, user_id: int) -> None:
+        """Invalidate the responses that include any plan of user_id"""
+        with self._lock:
+            managers = [key for key in set(self._entries) | set(self._versions) if key[0] == "manager"]
+        self.invalidate(employee_key(user_id), *managers)
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._entries):
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+    # Expects self._lock to be held
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+
+plan_cache = PlanCache(
+    enabled=config.PLAN_CACHE_ENABLED,
+    max_entries=config.PLAN_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.PLAN_CACHE_TTL_SECONDS
+)
+PLAN_CACHE_SIZE.set_function(lambda: plan_cache.stats()["entries"], unit="entries")
+PLAN_CACHE_SIZE.set_function(lambda: plan_cache.stats()["bytes"], unit="bytes")
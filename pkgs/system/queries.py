@@ -1,55 +1,91 @@
 from typing import List, Optional
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, selectinload
 from fastapi import Depends
 from pydantic_models import ChatMessage as PydanticChatModel
 from pydantic_models import PlanOfAction as PydanticPlanOfAction
-from pydantic_models import User as PydanticUserModel
 from db_models import Chat as DbChatModel
 from db_models import PlanOfAction as DbPlanOfActionModel
-from pydantic_models import EmployeeActionItems as PydanticEmployeeActionItems
+from db_models import PlanCategory as DbPlanCategoryModel
+from db_models import ActionItem as DbActionItemModel
 from pydantic_models import CategoryGroup as PydanticCategoryGroup
 from pydantic_models import ActionPlan as PydanticActionPlan
-from db_models import User as DbUserModel
+from pydantic_models import PipelineBatch as PydanticPipelineBatch
+from db_models import ChatSummary as DbChatSummaryModel
+from db_models import PipelineJob as DbPipelineJobModel
+from db_models import PipelineBatch as DbPipelineBatchModel
+from db_models import PipelineWatermark as DbPipelineWatermarkModel
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import update, Update
+from pydantic import TypeAdapter
+import orjson
 from db_engine import engine, get_db
 import json
 
 
-def get_user_conversation(
+def get_user_chat_history(
         user_id: int,
-        db: Session = Depends(get_db)
+        db: Session = Depends(get_db),
+        offset: int = 0,
+        after_id: int = 0
 ) -> List[PydanticChatModel]:
     """
-    Get all feedback items for a specific user.
+    Get the chat history of a user in the order the messages were sent.
 
     Args:
-        user_id (int): The ID of the user to get feedback for
+        user_id (int): The ID of the user
         db (Session): Database session dependency
+        offset (int): Number of leading messages to skip, e.g. those already folded into a summary
+        after_id (int): Only return messages with a higher id, e.g. those not analyzed yet
 
     Returns:
-        List[PydanticFeedbackModel]: List of feedback items converted to Pydantic models
+        List[PydanticChatModel]: Chat messages ordered by id, including whether each came from the AI
     """
-    # Query all chat items for the user
     chat_items = (
         db.query(DbChatModel)
         .filter(DbChatModel.user_id == user_id)
+        .filter(DbChatModel.id > after_id)
+        .order_by(DbChatModel.id)
+        .offset(offset)
         .all()
     )
 
-    # Convert to Pydantic models
-    pydantic_chat_items = [
+    return [
         PydanticChatModel(
             id=item.id,
             user_id=item.user_id,
-            message=item.message
+            message=item.message,
+            is_ai=item.is_ai
         )
         for item in chat_items
     ]
 
-    return pydantic_chat_items
+def get_chat_summary(user_id: int, db: Session = Depends(get_db)) -> DbChatSummaryModel | None:
+    return (
+        db.query(DbChatSummaryModel)
+        .filter(DbChatSummaryModel.user_id == user_id)
+        .one_or_none()
+    )
+
+def get_pipeline_watermark(user_id: int, db: Session = Depends(get_db)) -> int:
+    """Highest chats.id of the user already analyzed by the pipeline, 0 if none"""
+    watermark = db.get(DbPipelineWatermarkModel, user_id)
+    return watermark.last_chat_id if watermark else 0
+
+def get_plan_of_actions_row(user_id: int, target_user_id: int, db: Session = Depends(get_db)) -> DbPlanOfActionModel | None:
+    """The latest stored plan of a user for the given audience (the user or the manager), loaded with plan_tree"""
+    return (
+        db.query(DbPlanOfActionModel)
+        .options(plan_tree())
+        .filter(DbPlanOfActionModel.user_id == user_id)
+        .filter(DbPlanOfActionModel.target_user_id == target_user_id)
+        .order_by(DbPlanOfActionModel.id.desc())
+        .first()
+    )
 
 def get_personal_plan_of_actions(user_id: int,db: Session = Depends(get_db)):
     plan_of_actions = (
         db.query(DbPlanOfActionModel)
+        .options(plan_tree())
         .filter(DbPlanOfActionModel.user_id == user_id)
         .all()
     )
@@ -58,7 +94,9 @@ def get_personal_plan_of_actions(user_id: int,db: Session = Depends(get_db)):
         PydanticPlanOfAction(
             user_id= actions.user_id,
             user_name= actions.user_name ,
-            categorized_action_items=actions.categorized_action_items,
+            categorized_action_items={"categorized_action_items": [
+                category_group.model_dump() for category_group in to_category_groups(actions)
+            ]},
             target_user_id= actions.target_user_id,
         )
         for actions in plan_of_actions
@@ -68,6 +106,7 @@ def get_personal_plan_of_actions(user_id: int,db: Session = Depends(get_db)):
 def get_plan_of_actions(db: Session = Depends(get_db)):
     plan_of_actions = (
         db.query(DbPlanOfActionModel)
+        .options(plan_tree())
         .all()
     )
      # Convert to Pydantic models
@@ -75,99 +114,144 @@ def get_plan_of_actions(db: Session = Depends(get_db)):
         PydanticPlanOfAction(
             user_id= actions.user_id,
             user_name= actions.user_name ,
-            categorized_action_items=actions.categorized_action_items,
+            categorized_action_items={"categorized_action_items": [
+                category_group.model_dump() for category_group in to_category_groups(actions)
+            ]},
             target_user_id= actions.target_user_id,
         )
         for actions in plan_of_actions
     ]
     return pydantic_plan_of_actions
 
-def get_user(user_id: int,db: Session = Depends(get_db)) ->PydanticUserModel:
-    user = (
-        db.query(DbUserModel).filter(DbUserModel.id == user_id)
-        .one_or_none()
+def plan_tree():
+    """Loader options fetching a plan's categories, items, steps and notes in one query per level"""
+    return selectinload(DbPlanOfActionModel.categories).selectinload(DbPlanCategoryModel.action_items).options(
+        selectinload(DbActionItemModel.steps),
+        selectinload(DbActionItemModel.notes)
     )
-    result=PydanticUserModel(name=user.name,is_manager=user.is_manager)
-    return result
 
 
-def get_user_action_plan(user_id: int, db: Session = Depends(get_db)) -> PydanticEmployeeActionItems | None:
-    # Get the action plan from database
-    action_plan = (
-        db.query(DbPlanOfActionModel)
-        .filter(DbPlanOfActionModel.target_user_id == user_id)
-        .filter(DbPlanOfActionModel.user_id == user_id)
-        .one_or_none()
+def to_category_groups(action_plan: DbPlanOfActionModel) -> List[PydanticCategoryGroup]:
+    return [
+        PydanticCategoryGroup(
+            category=category.name,
+            action_items=[
+                PydanticActionPlan(
+                    action_title=item.title,
+                    action_status=item.status,
+                    action_plan=[step.text for step in item.steps],
+                    progress_notes=[note.text for note in item.notes],
+                    id=item.id,
+                    version=item.version
+                )
+                for item in category.action_items
+            ]
+        )
+        for category in action_plan.categories
+    ]
+
+
+category_groups_adapter = TypeAdapter(List[PydanticCategoryGroup])
+
+
+def render_plan(action_plan: DbPlanOfActionModel) -> bytes:
+    """The categorized_action_items JSON of a plan loaded with plan_tree, validated on the way"""
+    return category_groups_adapter.dump_json(to_category_groups(action_plan))
+
+
+def store_rendered_plan(action_plan: DbPlanOfActionModel, rendered: bytes) -> Update:
+    """Store rendered unless the plan was written since it was read, which bumps revision"""
+    return (
+        update(DbPlanOfActionModel)
+        .where(DbPlanOfActionModel.id == action_plan.id, DbPlanOfActionModel.revision == action_plan.revision)
+        .values(rendered=rendered)
     )
 
-    if not action_plan:
-        return None
-
-    # Get the raw value
-    raw_data = getattr(action_plan, 'categorized_action_items', None)
-
-    # Extract the inner categorized_action_items array
-    categorized_items = raw_data.get('categorized_action_items', []) if isinstance(raw_data, dict) else []
-
-    return PydanticEmployeeActionItems(
-        user_id=action_plan.target_user_id,
-        name=action_plan.user_name,
-        categorized_action_items=[
-            PydanticCategoryGroup(
-                category=category_group["category"],
-                action_items=[
-                    PydanticActionPlan(
-                        action_title=item["action_title"],
-                        action_status=item["action_status"],
-                        action_plan=item["action_plan"],
-                        progress_notes=item["progress_notes"]
-                    )
-                    for item in category_group["action_items"]
-                ]
-            )
-            for category_group in categorized_items
-        ]
+
+def employee_plan_json(action_plan: DbPlanOfActionModel, rendered: bytes) -> bytes:
+    """The EmployeeActionItems JSON of a plan around its rendered categorized_action_items"""
+    return orjson.dumps({
+        "user_id": action_plan.user_id,
+        "name": action_plan.user_name,
+        # Passed through as is, rendered was validated when the plan was written
+        "categorized_action_items": orjson.Fragment(rendered)
+    })
+
+
+def get_active_pipeline_job(user_id: int, db: Session = Depends(get_db)) -> DbPipelineJobModel | None:
+    """The queued or running pipeline job of a user, if any"""
+    return (
+        db.query(DbPipelineJobModel)
+        .filter(DbPipelineJobModel.user_id == user_id)
+        .filter(DbPipelineJobModel.status.in_(("queued", "running")))
+        .order_by(DbPipelineJobModel.id)
+        .first()
     )
 
 
-def get_manager_action_plan(db: Session = Depends(get_db)) -> list[PydanticEmployeeActionItems]:
-    # Get all action plans where target_user_id is 1
-    action_plans = (
-        db.query(DbPlanOfActionModel)
-        .filter(DbPlanOfActionModel.target_user_id == 1)
-        .all()
+def get_latest_pipeline_job(user_id: int, db: Session = Depends(get_db)) -> DbPipelineJobModel | None:
+    return (
+        db.query(DbPipelineJobModel)
+        .filter(DbPipelineJobModel.user_id == user_id)
+        .order_by(DbPipelineJobModel.id.desc())
+        .first()
     )
 
-    if not action_plans:
-        return []
-
-    result = []
-    for action_plan in action_plans:
-        # Get the raw value
-        raw_data = getattr(action_plan, 'categorized_action_items', None)
-
-        # Extract the inner categorized_action_items array
-        categorized_items = raw_data.get('categorized_action_items', []) if isinstance(raw_data, dict) else []
-
-        employee_action_items = PydanticEmployeeActionItems(
-            user_id=action_plan.user_id,
-            name=action_plan.user_name,
-            categorized_action_items=[
-                PydanticCategoryGroup(
-                    category=category_group["category"],
-                    action_items=[
-                        PydanticActionPlan(
-                            action_title=item["action_title"],
-                            action_status=item["action_status"],
-                            action_plan=item["action_plan"],
-                            progress_notes=item["progress_notes"]
-                        )
-                        for item in category_group["action_items"]
-                    ]
-                )
-                for category_group in categorized_items
-            ]
+
+def get_resumable_pipeline_jobs(stale_seconds: int, db: Session = Depends(get_db)) -> list[DbPipelineJobModel]:
+    """Queued jobs, plus running jobs whose process has not reported back for stale_seconds"""
+    stale_before = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    return (
+        db.query(DbPipelineJobModel)
+        .filter(
+            (DbPipelineJobModel.status == "queued")
+            | ((DbPipelineJobModel.status == "running") & (DbPipelineJobModel.started_at < stale_before))
         )
-        result.append(employee_action_items)
+        .order_by(DbPipelineJobModel.id)
+        .all()
+    )
+
 
-    return result
\ No newline at end of file
+def pipeline_batch_progress(batch: DbPipelineBatchModel, jobs: list[DbPipelineJobModel]) -> PydanticPipelineBatch:
+    counts = {"queued": 0, "running": 0, "succeeded": 0, "failed": 0}
+    llm_calls = 0
+    tokens = 0
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+        if job.summary:
+            llm_calls += job.summary.get("llm_calls", 0)
+            tokens += job.summary.get("prompt_tokens", 0) + job.summary.get("completion_tokens", 0)
+
+    finished = counts["succeeded"] + counts["failed"]
+    started = [job.started_at for job in jobs if job.started_at]
+    ended = [job.finished_at for job in jobs if job.finished_at]
+    elapsed = 0.0
+    if started:
+        end = max(ended) if finished == len(jobs) else datetime.now(timezone.utc)
+        start = min(started)
+        if start.tzinfo is None:
+            start = start.replace(tzinfo=timezone.utc)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        elapsed = max((end - start).total_seconds(), 0.0)
+    minutes = elapsed / 60 if elapsed else 0.0
+    runs_per_minute = finished / minutes if minutes else 0.0
+
+    return PydanticPipelineBatch(
+        id=batch.id,
+        user_count=batch.user_count,
+        created_at=batch.created_at,
+        job_ids=[job.id for job in jobs],
+        queued=counts["queued"],
+        running=counts["running"],
+        succeeded=counts["succeeded"],
+        failed=counts["failed"],
+        llm_calls=llm_calls,
+        tokens=tokens,
+        elapsed_seconds=round(elapsed, 1),
+        runs_per_minute=round(runs_per_minute, 2),
+        tokens_per_minute=round(tokens / minutes, 1) if minutes else 0.0,
+        estimated_seconds_remaining=(
+            round((len(jobs) - finished) / runs_per_minute * 60, 1) if runs_per_minute else None
+        )
+    )
@@ -1,16 +1,22 @@
-from typing import List,Dict
+from typing import List,Dict,Literal
 from datetime import datetime
-from pydantic import BaseModel, ValidationError, field_validator, EmailStr
+from pydantic import BaseModel, Field, ValidationError, field_validator, EmailStr
 
 class ChatMessage(BaseModel):
     message: str
     user_id: int
     is_ai: bool = False  # Added with a default value
     id: int | None = None  # Optional, for when reading from DB
+    timestamp: datetime | None = None
 
     class Config:
         from_attributes = True  # This allows conversion from SQLAlchemy models
 
+class ConversationPage(BaseModel):
+    messages: List[ChatMessage]
+    # Pass as cursor to get the next page, None on the last page
+    next_cursor: int | None = None
+
 class User(BaseModel):
     name: str
     is_manager: bool
@@ -31,6 +37,10 @@ class PlanOfAction(BaseModel):
 class RunPipelineRequest(BaseModel):
     user_id: int
 
+class RunPipelineBatchRequest(BaseModel):
+    # Omit to run the pipeline for every user with chats it has not analyzed yet
+    user_ids: List[int] | None = None
+
 class UserRequest(BaseModel):
     user_id: int
 
@@ -40,6 +50,23 @@ class ActionPlan(BaseModel):
     action_status: str
     action_plan: List[str]
     progress_notes: List[str]
+    id: int | None = None  # Set when read from DB, for the partial updates
+    version: int | None = None
+
+# Statuses an action item can be set to, generated items start as pending review
+ActionStatus = Literal["pending review", "accepted", "in progress", "completed", "dismissed"]
+
+class ActionStatusUpdate(BaseModel):
+    action_status: ActionStatus
+    version: int  # version of the action item the change was made on
+
+class ProgressNoteAppend(BaseModel):
+    note: str = Field(min_length=1)
+    version: int
+
+class ActionItemVersion(BaseModel):
+    id: int
+    version: int
 
 class CategoryGroup(BaseModel):
     category: str
@@ -48,4 +75,37 @@ class CategoryGroup(BaseModel):
 class EmployeeActionItems(BaseModel):
     user_id: int
     name: str
-    categorized_action_items: List[CategoryGroup]
\ No newline at end of file
+    categorized_action_items: List[CategoryGroup]
+
+
+class PipelineJob(BaseModel):
+    id: int
+    user_id: int
+    batch_id: int | None = None
+    run_id: str | None = None
+    status: str
+    error: str | None = None
+    summary: Dict | None = None
+    created_at: datetime
+    started_at: datetime | None = None
+    finished_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
+
+class PipelineBatch(BaseModel):
+    id: int
+    user_count: int
+    created_at: datetime
+    job_ids: List[int]
+    queued: int
+    running: int
+    succeeded: int
+    failed: int
+    llm_calls: int
+    tokens: int
+    elapsed_seconds: float
+    runs_per_minute: float
+    tokens_per_minute: float
+    estimated_seconds_remaining: float | None = None
@@ -1,12 +1,17 @@
 import os
 from pkgs.ai.chatbot import Chatbot
 from db_models import Chat as DbChat
-from db_engine import engine, get_db
+from db_engine import engine, get_db, get_async_db, AsyncSessionLocal
 from pydantic_models import ChatMessage as PydanticChatMessage
 from pydantic_models import RunPipelineRequest 
-from pkgs.system import queries as system_queries 
+from pydantic_models import RunPipelineBatchRequest
+from pydantic_models import PipelineBatch as PydanticPipelineBatch
+from pydantic_models import PipelineJob as PydanticPipelineJob
+from pkgs.system import async_queries as system_queries
+from pkgs.system import async_actions as system_actions
+from pkgs.system.chat_writer import chat_writer
 from pkgs.ai import pipeline 
-from threading import Thread
+from pkgs.ai.jobs import pipeline_jobs
 from sqlalchemy.exc import SQLAlchemyError
 from pydantic import ValidationError
 from fastapi import APIRouter, HTTPException, Depends
@@ -21,6 +26,7 @@ from datetime import datetime
 from fastapi import APIRouter, FastAPI, HTTPException, Request, Depends
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, AsyncGenerator
 import json
 import asyncio
@@ -30,7 +36,7 @@ chatbot = Chatbot()
 
 
 @router.post("/chat")
-async def chat(chat_message: PydanticChatMessage, db: Session = Depends(get_db)):
+async def chat(chat_message: PydanticChatMessage):
     try:
         user_id = chat_message.user_id
         message = chat_message.message
@@ -38,32 +44,23 @@ async def chat(chat_message: PydanticChatMessage, db: Session = Depends(get_db))
         # Log incoming message for debugging
         print(f"Received message: {message} from user: {user_id}")
 
-        try:
-            # Create and store user message
-            chat_message_db = DbChat(
-                user_id=user_id,
-                message=message,
-                is_ai=False
-            )
-            db.add(chat_message_db)
-            db.commit()
-
-            # Get the stream from chatbot
-            original_stream = chatbot.chat_stream(user_id, message)
-
-            # Return streaming response
-            return StreamingResponse(
-                stream_and_store(user_id, message, db, original_stream),
-                media_type='text/event-stream'
-            )
-
-        except SQLAlchemyError as db_error:
-            print(f"Database error: {str(db_error)}")
-            db.rollback()
-            raise HTTPException(
-                status_code=500,
-                detail="Database error occurred while storing message"
-            )
+        # The chat context may have to be loaded from the chats table, so let the messages still
+        # queued for the user be written first. Usually there are none and this returns at once
+        await chat_writer.wait_for_user(user_id)
+        context = await chatbot.load_context(user_id)
+
+        # Queue the user message, it is written behind the stream without holding a connection.
+        # Queued after the load, so the context holds the messages before it and not this one
+        await chat_writer.add(user_id, message, False)
+
+        # Get the async stream from chatbot, consumed on the event loop
+        original_stream = chatbot.chat_stream(user_id, message, context)
+
+        # Return streaming response
+        return StreamingResponse(
+            stream_and_store(user_id, message, original_stream),
+            media_type='text/event-stream'
+        )
 
     except Exception as e:
         print(f"General error: {str(e)}")
@@ -76,12 +73,11 @@ async def chat(chat_message: PydanticChatMessage, db: Session = Depends(get_db))
 async def stream_and_store(
         user_id: int,
         message: str,
-        db: Session,
-        original_stream
+        original_stream: AsyncGenerator[str, None]
 ) -> AsyncGenerator[str, None]:
     chunks = []
     try:
-        for chunk in original_stream:
+        async for chunk in original_stream:
             # Pass through original chunk to client
             yield f"data: {chunk}\n\n"
 
@@ -91,19 +87,12 @@ async def stream_and_store(
                 if content.strip():  # Only append non-empty content
                     chunks.append(content)
 
-        # After streaming completes, save the complete message
+        # After streaming completes, queue the complete message to be written
         complete_message = "".join(chunks)
-        ai_message = DbChat(
-            user_id=user_id,
-            message=complete_message,
-            is_ai=True
-        )
-        db.add(ai_message)
-        db.commit()
+        await chat_writer.add(user_id, complete_message, True)
 
     except Exception as e:
         print(f"Error in stream_and_store: {str(e)}")
-        db.rollback()
         error_message = json.dumps({"content": f"Error: {str(e)}"})
         yield f"data: {error_message}\n\n"
 
@@ -112,14 +101,37 @@ async def stream_and_store(
         error_message = json.dumps({"content": f"Error: {str(e)}"})
         yield f"data: {error_message}\n\n"
     
-def _run_pipeline(user_id: int, user_name: str):
-    api_key = os.environ["OPENAI_API_KEY"]
-    pipeline.run_pipeline(user_id, user_name, api_key)
-
 @router.post("/run-pipeline")
-async def run_pipeline(request_data: RunPipelineRequest,db: Session = Depends(get_db)):
-    user=system_queries.get_user(request_data.user_id,db)
-    thread = Thread(target=_run_pipeline, args=(request_data.user_id, user.name))
-    thread.start()
-    return 200
-    
+async def run_pipeline(request_data: RunPipelineRequest, db: AsyncSession = Depends(get_async_db)) -> PydanticPipelineJob:
+    user = await system_queries.get_user(request_data.user_id, db)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Submitting writes the job through the sync session, keep it off the event loop
+    job = await asyncio.to_thread(pipeline_jobs.submit, request_data.user_id, user.name)
+    return PydanticPipelineJob.model_validate(job)
+
+@router.post("/run-pipeline/batch")
+async def run_pipeline_batch(request_data: RunPipelineBatchRequest, db: AsyncSession = Depends(get_async_db)) -> PydanticPipelineBatch:
+    if request_data.user_ids is None:
+        users = await system_queries.get_users_with_new_chats(db)
+    else:
+        users = await system_queries.get_user_names(request_data.user_ids, db)
+        missing = set(request_data.user_ids) - {user_id for user_id, _ in users}
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Users not found: {sorted(missing)}")
+    batch = await asyncio.to_thread(pipeline_jobs.submit_batch, users)
+    return await system_queries.get_pipeline_batch(batch.id, db)
+
+@router.get("/pipeline-batches/{batch_id}")
+async def get_pipeline_batch(batch_id: int, db: AsyncSession = Depends(get_async_db)) -> PydanticPipelineBatch:
+    batch = await system_queries.get_pipeline_batch(batch_id, db)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Pipeline batch not found")
+    return batch
+
+@router.get("/pipeline-jobs/{job_id}")
+async def get_pipeline_job(job_id: int, db: AsyncSession = Depends(get_async_db)) -> PydanticPipelineJob:
+    job = await system_queries.get_pipeline_job(job_id, db)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Pipeline job not found")
+    return PydanticPipelineJob.model_validate(job)
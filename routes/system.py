@@ -3,53 +3,136 @@ import os
 from datetime import datetime, timedelta
 import asyncio
 from functools import lru_cache
-from fastapi import APIRouter, FastAPI, HTTPException, Request, Depends
+from fastapi import APIRouter, FastAPI, HTTPException, Request, Depends, Query
 from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
-from typing import List, Set
+from typing import AsyncIterator, List, Literal, Set
 import json
 
-from db_engine import engine, get_db
+from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from db_engine import engine, get_db, get_async_db
 
 from pydantic_models import User as PydanticUser
 from pydantic_models import UserRequest
+from pydantic_models import ChatMessage as PydanticChatMessage
+from pydantic_models import ConversationPage as PydanticConversationPage
 from pydantic_models import EmployeeActionItems as PydanticEmployeeActionItems
+from pydantic_models import ActionStatusUpdate, ProgressNoteAppend
+from pydantic_models import ActionItemVersion as PydanticActionItemVersion
 from db_models import User as DbUser
 
-from pkgs.system import queries as system_queries
-from pkgs.system import actions as system_actions
+from pkgs.system import async_queries as system_queries
+from pkgs.system import async_actions as system_actions
+from pkgs.ai.chatbot import conversation_store
+from pkgs.system.chat_writer import chat_writer
+from pkgs.system.metrics import registry as metrics_registry
+from fastapi.responses import PlainTextResponse, StreamingResponse, JSONResponse
 
 router = APIRouter()
 
 
+class JSONBytesResponse(JSONResponse):
+    """
+    JSON that is already serialized, sent as is. Routes returning it skip the validation and
+    encoding of response_model, which stays only to document the response.
+    """
+
+    def render(self, content: bytes) -> bytes:
+        return content
+
+
+async def dump_models(models: AsyncIterator[BaseModel]) -> AsyncIterator[bytes]:
+    async for model in models:
+        yield model.model_dump_json().encode()
+
+
+async def stream_ndjson(documents: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    async for document in documents:
+        yield document + b"\n"
+
+
+async def stream_json_array(documents: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    separator = b"["
+    async for document in documents:
+        yield separator + document
+        separator = b","
+    yield b"[]" if separator == b"[" else b"]"
+
+
 @router.post("/users")
-async def add_user_to_db(user: PydanticUser, db: Session = Depends(get_db)):
+async def add_user_to_db(user: PydanticUser, db: AsyncSession = Depends(get_async_db)):
     # If the user does not exist, add them to the database
-    new_user = DbUser(name=user.name, is_manager=user.is_manager)
-    db.add(new_user)
-    try:
-        db.commit()
-        return {"status": "User added"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
-
-@router.get("/conversation/{user_id}")
-async def get_conversation(user_id: int, db: Session = Depends(get_db)):
-    return system_queries.get_user_conversation(user_id, db)
-
-@router.get("/employees/{user_id}")
-async def get_employee_action_plan(user_id: int, db: Session = Depends(get_db)) -> PydanticEmployeeActionItems | None:
-    return system_queries.get_user_action_plan(user_id, db)
-
-@router.get("/employees")
-async def get_manager_action_plan(db: Session = Depends(get_db)) -> list[PydanticEmployeeActionItems] | None:
-    return system_queries.get_manager_action_plan(db)
+    await system_actions.add_user(user.name, user.is_manager, db)
+    return {"status": "User added"}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/conversation/{user_id}", response_model=list[PydanticChatMessage] | PydanticConversationPage,
+            response_class=JSONBytesResponse)
+async def get_conversation(
+        user_id: int,
+        limit: int | None = Query(None, ge=1, le=config.CONVERSATION_MAX_PAGE_SIZE,
+                                  description="page size, CONVERSATION_PAGE_SIZE when only cursor is passed"),
+        cursor: int | None = Query(None, description="next_cursor of the previous page"),
+        order: Literal["asc", "desc"] | None = Query(None, description="desc by default for pages, asc otherwise"),
+        stream: bool = Query(False, description="stream the whole conversation as NDJSON, ignoring limit"),
+        db: AsyncSession = Depends(get_async_db)
+):
+    if stream:
+        messages = system_queries.stream_user_conversation(user_id, cursor, order == "desc")
+        return StreamingResponse(stream_ndjson(dump_models(messages)), media_type="application/x-ndjson")
+    if limit is None and cursor is None:
+        # Without paging parameters the response keeps its original shape, the whole conversation as a list
+        messages = system_queries.stream_user_conversation(user_id, None, order == "desc")
+        return StreamingResponse(stream_json_array(dump_models(messages)), media_type="application/json")
+    # Pages start from the latest messages unless asked otherwise
+    page = await system_queries.get_user_conversation(
+        user_id, db, limit or config.CONVERSATION_PAGE_SIZE, cursor, order != "asc"
+    )
+    return JSONBytesResponse(page.model_dump_json().encode())
+
+@router.get("/employees/{user_id}", response_model=PydanticEmployeeActionItems | None, response_class=JSONBytesResponse)
+async def get_employee_action_plan(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    plan = await system_queries.get_user_action_plan(user_id, db)
+    return JSONBytesResponse(b"null" if plan is None else plan)
+
+@router.get("/employees", response_model=list[PydanticEmployeeActionItems] | None, response_class=JSONBytesResponse)
+async def get_manager_action_plan(
+        request: Request,
+        stream: bool = Query(False, description="send employees as they are read instead of all at once"),
+        db: AsyncSession = Depends(get_async_db)
+):
+    if stream:
+        # NDJSON when asked for, otherwise the same JSON array as the buffered response
+        if "application/x-ndjson" in request.headers.get("accept", ""):
+            return StreamingResponse(stream_ndjson(system_queries.stream_manager_action_plan()),
+                                     media_type="application/x-ndjson")
+        return StreamingResponse(stream_json_array(system_queries.stream_manager_action_plan()),
+                                 media_type="application/json")
+    return JSONBytesResponse(await system_queries.get_manager_action_plan(db))
+
+@router.patch("/action-items/{item_id}/status", response_model=PydanticActionItemVersion)
+async def set_action_status(item_id: int, change: ActionStatusUpdate, db: AsyncSession = Depends(get_async_db)):
+    version = await system_actions.set_action_status(item_id, change.action_status, change.version, db)
+    return PydanticActionItemVersion(id=item_id, version=version)
+
+@router.patch("/action-items/{item_id}/progress-notes", response_model=PydanticActionItemVersion)
+async def add_progress_note(item_id: int, change: ProgressNoteAppend, db: AsyncSession = Depends(get_async_db)):
+    version = await system_actions.add_progress_note(item_id, change.note, change.version, db)
+    return PydanticActionItemVersion(id=item_id, version=version)
 
 @router.delete("/chat-and-plan-of-action")
-async def delete_chat_and_plan_of_action(user: UserRequest, db: Session = Depends(get_db)):
-    system_actions.delete_chat_and_plan_of_actions_of_employee(user.user_id, db)
+async def delete_chat_and_plan_of_action(user: UserRequest, db: AsyncSession = Depends(get_async_db)):
+    # Messages still queued would be written after the delete
+    await chat_writer.wait_for_user(user.user_id)
+    await system_actions.delete_chat_and_plan_of_actions_of_employee(user.user_id, db)
+    conversation_store.invalidate(user.user_id)
 
 
@@ -0,0 +1,96 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+import config
+from pkgs.ai import rate_limiter as rate_limiter_module
+from pkgs.ai.rate_limiter import ModelLimiter, call_with_retries, call_with_retries_async
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def rate_limit_error() -> openai.RateLimitError:
+    # Retry-After of 0 keeps the back-off from holding the test up
+    response = httpx.Response(429, headers={"retry-after": "0"}, request=REQUEST)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def connection_error() -> openai.APIConnectionError:
+    return openai.APIConnectionError(request=REQUEST)
+
+
+@pytest.fixture
+def limiter(monkeypatch) -> ModelLimiter:
+    limiter = ModelLimiter("test-model", requests_per_minute=1000, tokens_per_minute=100_000)
+    # No refill, so the level shows exactly what the calls took and gave back
+    limiter.tokens.refill_per_second = 0
+    monkeypatch.setattr(rate_limiter_module.rate_limiter, "for_model", lambda model: limiter)
+    monkeypatch.setattr(config, "OPENAI_MAX_RETRIES", 3)
+    monkeypatch.setattr(config, "OPENAI_BASE_BACKOFF_SECONDS", 0)
+    return limiter
+
+
+def failing(errors: list, result: str = "ok"):
+    def call():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return call
+
+
+def test_retries_take_the_tokens_once(limiter):
+    call = failing([rate_limit_error(), connection_error(), rate_limit_error()])
+
+    assert call_with_retries("test-model", 10_000, call) == "ok"
+    assert limiter.tokens._level == 90_000
+
+    limiter.settle(10_000, 2_000)
+    assert limiter.tokens._level == 98_000
+
+
+def test_tokens_are_given_back_when_every_attempt_fails(limiter):
+    call = failing([connection_error() for _ in range(4)])
+
+    with pytest.raises(openai.APIConnectionError):
+        call_with_retries("test-model", 10_000, call)
+    assert limiter.tokens._level == 100_000
+
+
+def test_tokens_are_given_back_on_a_non_retryable_error(limiter):
+    call = failing([ValueError("bad request")])
+
+    with pytest.raises(ValueError):
+        call_with_retries("test-model", 10_000, call)
+    assert limiter.tokens._level == 100_000
+
+
+def test_async_retries_take_the_tokens_once(limiter):
+    errors = [rate_limit_error(), connection_error(), rate_limit_error()]
+
+    async def call():
+        if errors:
+            raise errors.pop(0)
+        return "ok"
+
+    assert asyncio.run(call_with_retries_async("test-model", 10_000, call)) == "ok"
+    assert limiter.tokens._level == 90_000
+
+    limiter.settle(10_000, 2_000)
+    assert limiter.tokens._level == 98_000
+
+
+def test_async_tokens_are_given_back_when_cancelled(limiter):
+    async def call():
+        await asyncio.sleep(10)
+
+    async def cancel_midway():
+        task = asyncio.create_task(call_with_retries_async("test-model", 10_000, call))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+    assert limiter.tokens._level == 100_000